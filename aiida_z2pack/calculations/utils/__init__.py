@@ -3,4 +3,5 @@ from .prepare_pw import prepare_nscf
 from .prepare_overlap import prepare_overlap
 from .prepare_wannier90 import prepare_wannier90
 from .prepare_z2pack import prepare_z2pack
-from .utils import merge_dict_input_to_root, recursive_get_linked_node, get_previous_node
\ No newline at end of file
+from .cost_model import estimate_z2pack_cost
+from .utils import merge_dict_input_to_root, recursive_get_linked_node, get_previous_node, get_root_parent
\ No newline at end of file
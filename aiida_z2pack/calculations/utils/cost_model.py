@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+import ast
+
+from aiida.common import exceptions
+from aiida_quantumespresso.calculations import _lowercase_dict
+
+# Seconds spent by each stage of a z2pack call. `*_per_kpoint` stages scale with the number of k-points of the
+# line, `*_per_call` stages are paid once for every pw.x/pw2wannier90.x/wannier90.x call.
+DEFAULT_TIMINGS = {
+    'nscf_per_kpoint': 10.0,
+    'overlap_per_kpoint': 2.0,
+    'wannier90_per_call': 1.0,
+    'overhead_per_call': 5.0,
+}
+
+
+def parse_iterator(iterator):
+    """Convert the `iterator` z2pack setting in the list of number of k-points per line that it produces.
+
+    Only `range(...)` expressions and literal lists/tuples of integers are supported.
+    """
+    if isinstance(iterator, (list, tuple)):
+        return [int(n) for n in iterator]
+
+    string = str(iterator).strip()
+    try:
+        if string.startswith('range'):
+            args = ast.literal_eval(string[len('range'):].strip())
+            if not isinstance(args, tuple):
+                args = (args,)
+            return list(range(*args))
+        return [int(n) for n in ast.literal_eval(string)]
+    except (ValueError, SyntaxError, TypeError):
+        raise exceptions.InputValidationError('Can\'t evaluate the cost for iterator `{}`.'.format(iterator))
+
+
+def get_max_num_lines(num_lines, min_neighbour_dist):
+    """Return the maximum number of lines z2pack can add on a surface.
+
+    Starting from `num_lines` equispaced lines, z2pack bisects the interval between two neighbouring lines as long
+    as their distance is larger than `min_neighbour_dist`.
+    """
+    if num_lines < 2:
+        return num_lines
+
+    spacing = 1. / (num_lines - 1)
+    depth = 0
+    while spacing > min_neighbour_dist:
+        spacing /= 2
+        depth += 1
+
+    return (num_lines - 1) * 2 ** depth + 1
+
+
+def estimate_z2pack_cost(cls, settings, timings=None, num_cores=1):
+    """Estimate the number of DFT calls, k-points and core-hours required by a z2pack calculation.
+
+    The surface does not enter the estimate, as z2pack parametrizes every surface on the same unit square.
+
+    :param cls: the `Z2packCalculation` class (or instance) providing the default settings.
+    :param settings: dictionary of z2pack settings (`num_lines`, `iterator`, `min_neighbour_dist`, `pos_tol`).
+    :param timings: optional dictionary of per-stage timings in seconds (see `DEFAULT_TIMINGS`).
+    :param num_cores: number of cores used by every call.
+
+    :return: dictionary with `(lower, upper)` bounds for `lines`, `kpoints_per_line`, `calls`, `kpoints` and
+             `core_hours`.
+    """
+    settings_dict = _lowercase_dict(settings, dict_name='z2pack_settings')
+
+    num_lines          = settings_dict.get('num_lines', cls._DEFAULT_NUM_LINES)
+    min_neighbour_dist = settings_dict.get('min_neighbour_dist', cls._DEFAULT_MIN_NEIGHBOUR_DISTANCE)
+    iterator           = parse_iterator(settings_dict.get('iterator', cls._DEFAULT_ITERATOR))
+    pos_tol            = settings_dict.get('pos_tol', cls._DEFAULT_POS_TOLERANCE)
+
+    if not iterator:
+        raise exceptions.InputValidationError('The `iterator` must produce at least one value.')
+
+    # Without `pos_tol` z2pack stops at the first step, otherwise it needs at least two steps to check convergence
+    steps_min = 1 if pos_tol is None else min(2, len(iterator))
+    steps_max = 1 if pos_tol is None else len(iterator)
+
+    lines_min = num_lines
+    lines_max = get_max_num_lines(num_lines, min_neighbour_dist)
+
+    kpoints_min = lines_min * sum(iterator[:steps_min])
+    kpoints_max = lines_max * sum(iterator[:steps_max])
+    calls_min   = lines_min * steps_min
+    calls_max   = lines_max * steps_max
+
+    tim = dict(DEFAULT_TIMINGS)
+    tim.update(timings or {})
+    per_kpoint = tim['nscf_per_kpoint'] + tim['overlap_per_kpoint']
+    per_call   = tim['wannier90_per_call'] + tim['overhead_per_call']
+
+    def core_hours(kpoints, calls):
+        return (kpoints * per_kpoint + calls * per_call) * num_cores / 3600.
+
+    return {
+        'lines': (lines_min, lines_max),
+        'kpoints_per_line': (iterator[0], iterator[steps_max - 1]),
+        'calls': (calls_min, calls_max),
+        'kpoints': (kpoints_min, kpoints_max),
+        'core_hours': (core_hours(kpoints_min, calls_min), core_hours(kpoints_max, calls_max)),
+    }
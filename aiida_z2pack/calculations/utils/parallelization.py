@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+
+# Below this number of bands the serial diagonalization is faster than the distributed one.
+_MIN_BANDS_PARALLEL_DIAG = 100
+
+_POOLS_FLAGS = ('-nk', '-npools', '-npool')
+_DIAG_FLAGS = ('-nd', '-ndiag', '-northo')
+
+
+def get_num_mpiprocs(resources, computer):
+    """Return the total number of MPI processes of a `resources` option dictionary."""
+    num_mpiprocs = resources.get('tot_num_mpiprocs', None)
+    if num_mpiprocs is None:
+        per_machine = resources.get('num_mpiprocs_per_machine', None)
+        if per_machine is None:
+            per_machine = computer.get_default_mpiprocs_per_machine() or 1
+        num_mpiprocs = resources.get('num_machines', 1) * per_machine
+
+    return num_mpiprocs
+
+
+def get_num_bands(parameters):
+    """Return the `nbnd` set in a dictionary of pw.x parameters, or `None` if it is not set."""
+    for namelist, content in parameters.items():
+        if namelist.upper() == 'SYSTEM':
+            for key, value in content.items():
+                if key.lower() == 'nbnd':
+                    return value
+
+    return None
+
+
+def get_pw_parallelization(num_kpoints, num_cores, num_bands=None):
+    """Choose the pw.x parallelization layout for a run with few k-points.
+
+    K-point pools are preferred over plane-wave parallelization, as they scale almost perfectly: the number of pools
+    is the largest divisor of `num_cores` not larger than `num_kpoints`.
+    All the allocated cores are used: within a pool pw.x distributes the plane waves and the FFT planes, not the bands.
+    The distributed diagonalization is used only for large numbers of bands.
+
+    :param num_kpoints: number of k-points of the run.
+    :param num_cores: number of allocated cores.
+    :param num_bands: optional number of bands of the run.
+
+    :return: dictionary with `npools`, `ndiag` and `num_mpiprocs`.
+    """
+    num_kpoints = max(int(num_kpoints), 1)
+    num_cores = max(int(num_cores), 1)
+
+    npools = max(n for n in range(1, min(num_kpoints, num_cores) + 1) if num_cores % n == 0)
+    ranks_per_pool = num_cores // npools
+
+    ndiag = 1
+    if num_bands and num_bands >= _MIN_BANDS_PARALLEL_DIAG:
+        ndiag = int(ranks_per_pool**0.5)**2
+
+    return {
+        'npools': npools,
+        'ndiag': ndiag,
+        'num_mpiprocs': num_cores,
+    }
+
+
+def get_parallelization_cmdline(layout):
+    """Return the pw.x command line flags for a layout returned by `get_pw_parallelization`."""
+    cmdline = []
+    if layout['npools'] > 1:
+        cmdline += ['-nk', str(layout['npools'])]
+    if layout['num_mpiprocs'] // layout['npools'] > 1:
+        cmdline += ['-nd', str(layout['ndiag'])]
+
+    return cmdline
+
+
+def set_parallelization_cmdline(cmdline, num_kpoints, num_cores, num_bands=None):
+    """Adapt the pw.x command line flags of a run to its number of k-points.
+
+    Pools/diagonalization flags given explicitly are kept, unless there are more pools than k-points, in which case
+    they are replaced by the ones of the layout chosen by `get_pw_parallelization`.
+
+    :param cmdline: list of command line parameters (not modified).
+
+    :return: tuple with the new list of command line parameters and the chosen layout.
+    """
+    layout = get_pw_parallelization(num_kpoints, num_cores, num_bands)
+
+    cmdline = list(cmdline)
+    npools = None
+    for flag in _POOLS_FLAGS:
+        if flag in cmdline:
+            npools = int(cmdline[cmdline.index(flag) + 1])
+
+    if npools is not None and npools <= num_kpoints:
+        return cmdline, layout
+
+    res = []
+    skip = False
+    for item in cmdline:
+        if skip:
+            skip = False
+            continue
+        if item in _POOLS_FLAGS + _DIAG_FLAGS:
+            skip = True
+            continue
+        res.append(item)
+
+    return res + get_parallelization_cmdline(layout), layout
+
+
+def apply_pw_parallelization(inputs, num_kpoints):
+    """Set the pools/diagonalization flags in the `settings` of the inputs of a `PwBaseWorkChain`.
+
+    :param inputs: AttributeDict with the inputs of a `PwBaseWorkChain`, modified in place.
+    :param num_kpoints: number of k-points of the run.
+
+    :return: the chosen layout or `None` if the allocated resources are not known.
+    """
+    pw_inputs = inputs['pw']
+    try:
+        resources = pw_inputs['metadata']['options']['resources']
+    except KeyError:
+        return None
+    num_cores = get_num_mpiprocs(resources, pw_inputs['code'].computer)
+
+    parameters = pw_inputs['parameters']
+    if not isinstance(parameters, dict):
+        parameters = parameters.get_dict()
+    num_bands = get_num_bands(parameters)
+
+    settings = pw_inputs.get('settings', {})
+    if not isinstance(settings, dict):
+        settings = settings.get_dict()
+    settings = dict(settings)
+
+    settings['cmdline'], layout = set_parallelization_cmdline(
+        settings.get('cmdline', []), num_kpoints, num_cores, num_bands)
+    pw_inputs['settings'] = settings
+
+    return layout
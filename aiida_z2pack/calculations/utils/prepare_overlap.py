@@ -1,20 +1,30 @@
 from __future__ import absolute_import
+from aiida.common import exceptions
 from aiida_quantumespresso.calculations.namelists import NamelistsCalculation
 
 
-class Temp(NamelistsCalculation):
-    pass
+def set_blocked_keywords(parameters, blocked_keywords):
+    """Return a copy of `parameters` with the `(namelist, key, value)` of `blocked_keywords` set.
 
+    Same as `NamelistsCalculation.set_blocked_keywords`, without storing the keywords on a shared class.
+    """
+    parameters = {namelist: dict(values) for namelist, values in parameters.items()}
+    for namelist, key, value in blocked_keywords:
+        namelist = namelist.upper()
+        key = key.lower()
+        if key in parameters.setdefault(namelist, {}):
+            raise exceptions.InputValidationError(
+                "You cannot specify explicitly the '{}' key in the '{}' namelist.".format(key, namelist))
+        parameters[namelist][key] = value
 
-def prepare_overlap(cls, folder):
-    parameters = cls.inputs.overlap_parameters.get_dict()
-    blocked = cls._blocked_keywords_overlap
+    return parameters
 
-    Temp._blocked_keywords = blocked
 
-    parameters = Temp.set_blocked_keywords(parameters)
+def prepare_overlap(cls, folder):
+    parameters = cls.inputs.overlap_parameters.get_dict()
+    parameters = set_blocked_keywords(parameters, cls._blocked_keywords_overlap)
 
-    content = Temp.generate_input_file(parameters) + '\n\n'
+    content = NamelistsCalculation.generate_input_file(parameters) + '\n\n'
 
     input_filename = cls._INPUT_OVERLAP_FILE
 
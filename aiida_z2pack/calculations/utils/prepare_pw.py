@@ -1,13 +1,27 @@
 from __future__ import absolute_import
 import copy
+import threading
 from aiida.plugins import CalculationFactory
 from aiida_quantumespresso.calculations import _uppercase_dict
 
-PwCalculation = CalculationFactory('quantumespresso.pw')
+_GENERATOR = None
+_GENERATOR_LOCK = threading.Lock()
 
 
-class Temp(PwCalculation):
-    _use_kpoints = False
+def _get_input_generator():
+    """Return a `PwCalculation` subclass writing the input files without kpoints, loading the plugin on first use."""
+    global _GENERATOR  # pylint: disable=global-statement
+
+    with _GENERATOR_LOCK:
+        if _GENERATOR is None:
+            PwCalculation = CalculationFactory('quantumespresso.pw')
+
+            class Temp(PwCalculation):
+                _use_kpoints = False
+
+            _GENERATOR = Temp
+
+    return _GENERATOR
 
 
 def _prepare_pw(cls, folder, calculation):
@@ -24,7 +38,7 @@ def _prepare_pw(cls, folder, calculation):
         cls.inputs.structure,
     ]
 
-    input_filecontent, _ = Temp._generate_PWCPinputdata(*arguments)
+    input_filecontent, _ = _get_input_generator()._generate_PWCPinputdata(*arguments)
 
     input_filename = getattr(cls,
                              '_INPUT_PW_{}_FILE'.format(calculation.upper()))
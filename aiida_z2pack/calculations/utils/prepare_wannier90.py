@@ -1,6 +1,20 @@
 from __future__ import absolute_import
+from aiida_quantumespresso.calculations import _lowercase_dict
 from aiida_wannier90.io import write_win
 
+
+def get_blocked_keywords_wannier90(cls):
+    """Return the keywords fixed in the Wannier90 input, with `spinors` for noncollinear spin-orbit calculations."""
+    blocked = list(cls._blocked_keywords_wannier90)
+
+    pw_dct = _lowercase_dict(cls.inputs.pw_parameters.get_dict(), 'pw_dct')
+    system = pw_dct['system']
+    if system.get('noncolin', False) and system.get('lspinorb', False):
+        blocked.append(('spinors', True))
+
+    return blocked
+
+
 def prepare_wannier90(cls, folder):
     input_filename = folder.get_abs_path(cls._INPUT_W90_FILE)
     try:
@@ -8,7 +22,7 @@ def prepare_wannier90(cls, folder):
     except:
         parameters = {}
 
-    for k, v in cls._blocked_keywords_wannier90:
+    for k, v in get_blocked_keywords_wannier90(cls):
         parameters[k] = v
 
     write_win(input_filename,
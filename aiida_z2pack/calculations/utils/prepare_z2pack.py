@@ -1,36 +1,21 @@
 from __future__ import absolute_import
+import os
+import re
+from aiida import orm
 from aiida.common import exceptions
 from aiida_quantumespresso.calculations import _lowercase_dict
 
+from .cost_model import parse_iterator
+from .parallelization import get_num_bands, get_num_mpiprocs, get_pw_parallelization, get_parallelization_cmdline
+from .utils import get_root_parent
+
 def prepare_z2pack(cls, folder):
     input_filename = folder.get_abs_path(cls._INPUT_Z2PACK_FILE)
-    try:
-        pw_code = cls.inputs.pw_code
-    except AttributeError:
-        raise exceptions.InputValidationError('No nscf code specified for this calculation')
-    try:
-        overlap_code = cls.inputs.overlap_code
-    except AttributeError:
-        raise exceptions.InputValidationError('No overlap code specified for this calculation')
-    try:
-        wannier90_code = cls.inputs.wannier90_code
-    except AttributeError:
-        raise exceptions.InputValidationError('No Wannier90 code specified for this calculation')
-
     try:
         settings_dict = _lowercase_dict(cls.inputs.z2pack_settings.get_dict(), dict_name='z2pack_settings')
     except:
         raise exceptions.InputValidationError('No settings specified for this calculation')
 
-    if 'npools' not in settings_dict:
-        pools_cmd = ''
-    else:
-        npools = settings_dict['npools']
-        if isinstance(npools, int):
-            pools_cmd = ' -nk ' + str(npools) + ' '
-        else:
-            raise exceptions.InputValidationError('npools must be an integer.')
-
     try:
         dim_mode = settings_dict['dimension_mode']
     except KeyError:
@@ -41,16 +26,6 @@ def prepare_z2pack(cls, folder):
     except KeyError:
         raise exceptions.InputValidationError('No invariant specified for this calculation')
 
-    if 'mpi_command' in settings_dict:
-        mpi_command = settings_dict['mpi_command']
-    else:
-        computer           = cls.inputs.pw_code.computer
-        proc_per_machine   = computer.get_default_mpiprocs_per_machine()
-        n_machines         = cls.inputs.metadata.options.resources['num_machines']
-        mpi_procs          = proc_per_machine * n_machines
-        mpi_command        = computer.get_mpirun_command()
-        mpi_command        = ' '.join(mpi_command).format(tot_num_mpiprocs=mpi_procs)
-
     pos_tol            = settings_dict.get('pos_tol', cls._DEFAULT_POS_TOLERANCE)
     gap_tol            = settings_dict.get('gap_tol', cls._DEFAULT_GAP_TOLERANCE)
     move_tol           = settings_dict.get('move_tol', cls._DEFAULT_MOVE_TOLERANCE)
@@ -59,10 +34,23 @@ def prepare_z2pack(cls, folder):
     iterator           = settings_dict.get('iterator', cls._DEFAULT_ITERATOR)
     # restart_mode       = settings_dict.get('restart_mode', False)
     prepend_code       = settings_dict.get('prepend_code', '')
+    backend            = settings_dict.get('backend', cls._DEFAULT_BACKEND).lower()
+    dft_check_lines    = settings_dict.get('dft_check_lines', 0)
+    band_windows       = get_band_windows(settings_dict)
+    use_fp             = backend == 'fp' or dft_check_lines > 0
+    overlap_store      = settings_dict.get('overlap_store', None) if use_fp else None
+    use_python_engine  = use_fp and get_overlap_engine(cls, settings_dict) == 'python'
 
 
 
-    if dim_mode == '3D':
+    if dim_mode == '2D':
+        if invariant == 'z2':
+            surface = 'lambda t1,t2: [t2, t1/2, 0]'
+        elif invariant == 'chern':
+            surface = 'lambda t1,t2: [t1, t2, 0]'
+        else:
+            raise exceptions.InputValidationError('Only Z2 and Chern invariants are implemented for dim_mode==2D')
+    elif dim_mode == '3D':
         try:
             surface = settings_dict['surface']
             # surface = settings_dict.get_dict()['surface']
@@ -73,40 +61,31 @@ def prepare_z2pack(cls, folder):
     input_file_lines.append('#!/usr/bin/env python')
     input_file_lines.append('import z2pack')
     input_file_lines.append('import json')
-
-    nscf_cmd      = ' {} {}'.format(mpi_command, pw_code.get_execname())
-    overlap_cmd   = ' {} {}'.format(mpi_command, overlap_code.get_execname())
-    wannier90_cmd = ' {}'.format(wannier90_code.get_execname())
-
-    pw_in_cmd = settings_dict.get('pw_in_command', '<')
-
-    z2cmd = (
-        "(\n    '" +
-        "ln -s ../out .; ln -s ../pseudo .;'\n    '" +
-        wannier90_cmd + ' ' + cls._SEEDNAME + ' -pp;' + "' +\n    '" +
-        nscf_cmd + pools_cmd + ' {} '.format(pw_in_cmd) + cls._INPUT_PW_NSCF_FILE + ' >& ' + cls._OUTPUT_PW_NSCF_FILE + ";' +\n    '" +
-        overlap_cmd + ' {} '.format(pw_in_cmd) + cls._INPUT_OVERLAP_FILE + '  >& ' + cls._OUTPUT_OVERLAP_FILE + ";'\n" +
-        ')'
-        # yapf: disable
-        )
+    input_file_lines.append('import os')
 
     # yapf: disable
-    input_file_lines.append('')
-    input_file_lines.append('z2cmd =' +  z2cmd)
+    if backend == 'tb':
+        input_file_lines.append('import numpy as np')
+        input_file_lines.append('import tbmodels')
+    if band_windows or overlap_store or use_python_engine:
+        folder.insert_path(os.path.join(os.path.dirname(__file__), cls._HELPERS_FILE), cls._HELPERS_FILE)
+        input_file_lines.append(
+            'from z2pack_helpers import BandWindowSystem, CachedOverlapSystem, PythonOverlapSystem, '
+            'StoredOverlapSystem, get_convergence_report'
+            )
 
-    input_file_lines.append('')
-    input_files = [cls._INPUT_PW_NSCF_FILE, cls._INPUT_OVERLAP_FILE,cls._INPUT_W90_FILE]
-    input_file_lines.append('input_files = ' + str(input_files))
-    input_file_lines.append('system = z2pack.fp.System(')
-    input_file_lines.append('    input_files = input_files,')
-    input_file_lines.append('    kpt_fct     = [z2pack.fp.kpoint.qe_explicit, z2pack.fp.kpoint.wannier90_full],')
-    # input_file_lines.append('    build_folder= \'.\',')
-    # input_file_lines.append('\t kpt_fct=[z2pack.fp.kpoint.qe, z2pack.fp.kpoint.wannier90],')
-    input_file_lines.append('    kpt_path    = ' + str([cls._INPUT_PW_NSCF_FILE, cls._INPUT_W90_FILE]) + ',')
-    input_file_lines.append('    command     = z2cmd,')
-    input_file_lines.append("    executable  = '/bin/bash',")
-    input_file_lines.append("    mmn_path    = '{}.mmn'".format(cls._SEEDNAME))
-    input_file_lines.append(')')
+    if backend == 'fp':
+        input_file_lines.extend(get_fp_system_lines(cls, settings_dict, 'system'))
+    else:
+        if dft_check_lines > 0:
+            input_file_lines.extend(get_fp_system_lines(cls, settings_dict, 'fp_system'))
+        input_file_lines.append('')
+        input_file_lines.append("model  = tbmodels.Model.from_wannier_files(hr_file='{}')".format(cls._INPUT_HR_FILE))
+        input_file_lines.append('system = z2pack.tb.System(model, bands={})'.format(cls.tb_bands))
+    if band_windows:
+        input_file_lines.append('')
+        input_file_lines.append('# Compute the overlaps of every line only once for all the band windows')
+        input_file_lines.append('system = CachedOverlapSystem(system)')
 
     input_file_lines.append('')
     input_file_lines.append('gap_check={}')
@@ -121,35 +100,12 @@ def prepare_z2pack(cls, folder):
     if prepend_code != '':
         input_file_lines.append('\t' + prepend_code)
     if dim_mode == '2D' or dim_mode == '3D':
-        input_file_lines.append('result = z2pack.surface.run(')
-        input_file_lines.append('    system             = system,')
-        if dim_mode == '2D':
-            if invariant == 'z2':
-                input_file_lines.append(
-                    '    surface            = lambda t1,t2: [t2, t1/2, 0],')
-            elif invariant == 'chern':
-                input_file_lines.append(
-                    '    surface            = lambda t1,t2: [t1, t2, 0],')
-        elif dim_mode == '3D':
-            input_file_lines.append('    surface            = ' + surface +
-                                    ',')
-        input_file_lines.append('    pos_tol            = ' + str(pos_tol) +
-                                ',')
-        input_file_lines.append('    gap_tol            = ' + str(gap_tol) +
-                                ',')
-        input_file_lines.append('    move_tol           = ' + str(move_tol) +
-                                ',')
-        input_file_lines.append('    num_lines          = ' + str(num_lines) +
-                                ',')
-        input_file_lines.append('    min_neighbour_dist = ' +
-                                str(min_neighbour_dist) + ',')
-        input_file_lines.append('    iterator           = ' + str(iterator) +
-                                ',')
-        input_file_lines.append('    save_file          = ' + "'" +
-                                cls._OUTPUT_SAVE_FILE + "'" + ',')
-        if cls.restart_mode:
-            input_file_lines.append('    load               = True')
-        input_file_lines.append('    )')
+        surface_args = [
+            ('surface', surface), ('pos_tol', pos_tol), ('gap_tol', gap_tol), ('move_tol', move_tol),
+            ('num_lines', num_lines), ('min_neighbour_dist', min_neighbour_dist), ('iterator', iterator),
+            ]
+        input_file_lines.extend(
+            get_surface_run_lines('result', 'system', surface_args, cls._OUTPUT_SAVE_FILE, cls.restart_mode))
 
         if invariant.lower() == 'z2':
             input_file_lines.append('Z2 = z2pack.invariant.z2(result)')
@@ -193,6 +149,42 @@ def prepare_z2pack(cls, folder):
     input_file_lines.append(
         "res_dict['convergence_report']['PosCheck'].update(pos_check)")
 
+    if band_windows:
+        input_file_lines.append('')
+        input_file_lines.append("res_dict['band_windows'] = []")
+        for n, (first, last) in enumerate(band_windows):
+            window_system = 'BandWindowSystem(system, {}, {})'.format(first, last)
+            save_file = cls._OUTPUT_WINDOW_SAVE_FILE.format(n)
+            input_file_lines.extend(
+                get_surface_run_lines('window_result', window_system, surface_args, save_file, cls.restart_mode))
+            input_file_lines.append("res_dict['band_windows'].append({")
+            input_file_lines.append("    'bands': [{}, {}],".format(first, last))
+            if invariant == 'z2':
+                input_file_lines.append("    'invariant': {'Z2': z2pack.invariant.z2(window_result)},")
+            else:
+                input_file_lines.append("    'invariant': {'Chern': z2pack.invariant.chern(window_result)},")
+            input_file_lines.append("    'convergence_report': get_convergence_report(window_result),")
+            input_file_lines.append('    })')
+
+    if backend == 'tb' and dft_check_lines > 0:
+        input_file_lines.extend(get_dft_check_lines(cls, surface, dft_check_lines, pos_tol, iterator))
+
+    if overlap_store:
+        input_file_lines.append('')
+        input_file_lines.append(
+            "res_dict['overlap_store'] = {'hits': overlap_store.hits, 'misses': overlap_store.misses}")
+
+    if use_fp and not use_python_engine:
+        input_file_lines.append('')
+        input_file_lines.append("res_dict['nnkp_cache'] = {}")
+        input_file_lines.append("for key in ('hits', 'misses'):")
+        input_file_lines.append("    path = os.path.join('{}', key)".format(cls._NNKP_CACHE_FOLDER))
+        input_file_lines.append('    if os.path.exists(path):')
+        input_file_lines.append('        with open(path) as fp:')
+        input_file_lines.append("            res_dict['nnkp_cache'][key] = len(fp.readlines())")
+        input_file_lines.append('    else:')
+        input_file_lines.append("        res_dict['nnkp_cache'][key] = 0")
+
     input_file_lines.append('')
     input_file_lines.append("with open('" + cls._OUTPUT_RESULT_FILE +
                             "', 'w') as fp:")
@@ -203,3 +195,264 @@ def prepare_z2pack(cls, folder):
     with open(input_filename, 'w') as file_input:
         file_input.write('\n'.join(input_file_lines))
         file_input.write('\n')
+
+
+def get_band_windows(settings_dict):
+    """Return the validated list of `[first, last]` band windows of the z2pack settings."""
+    band_windows = settings_dict.get('band_windows', [])
+    for window in band_windows:
+        if (
+            not isinstance(window, (list, tuple)) or len(window) != 2 or
+            not all(isinstance(n, int) for n in window) or not 1 <= window[0] <= window[1]
+            ):
+            raise exceptions.InputValidationError(
+                '`band_windows` must be a list of `[first, last]` band indexes, got `{}`.'.format(window))
+
+    return band_windows
+
+
+def get_surface_run_lines(result, system, surface_args, save_file, load):
+    """Return the lines of the driver running `z2pack.surface.run` on `system` and storing the result in `result`."""
+    input_file_lines = ['{} = z2pack.surface.run('.format(result)]
+    input_file_lines.append('    {:<18} = {},'.format('system', system))
+    for name, value in surface_args:
+        input_file_lines.append('    {:<18} = {},'.format(name, value))
+    input_file_lines.append("    {:<18} = '{}',".format('save_file', save_file))
+    if load:
+        input_file_lines.append('    {:<18} = True'.format('load'))
+    input_file_lines.append('    )')
+
+    return input_file_lines
+
+
+def get_fp_system_lines(cls, settings_dict, name):
+    """Return the lines of the driver defining the first-principles z2pack system `name`."""
+    try:
+        pw_code = cls.inputs.pw_code
+    except AttributeError:
+        raise exceptions.InputValidationError('No nscf code specified for this calculation')
+    overlap_engine = get_overlap_engine(cls, settings_dict)
+    if overlap_engine == 'pw2wannier90':
+        try:
+            overlap_code = cls.inputs.overlap_code
+        except AttributeError:
+            raise exceptions.InputValidationError('No overlap code specified for this calculation')
+        try:
+            wannier90_code = cls.inputs.wannier90_code
+        except AttributeError:
+            raise exceptions.InputValidationError('No Wannier90 code specified for this calculation')
+
+    layout = None
+    if 'npools' in settings_dict:
+        npools = settings_dict['npools']
+        if isinstance(npools, int):
+            pools_cmd = ' -nk ' + str(npools) + ' '
+        else:
+            raise exceptions.InputValidationError('npools must be an integer.')
+    elif 'mpi_command' in settings_dict:
+        pools_cmd = ''
+    else:
+        # z2pack does not pass to pw.x the last point of a line, equivalent to the first one.
+        # pw.x fails with more pools than k-points, so the layout is chosen for the first (shortest) step of the
+        # iterator: the longer lines of the following steps run with the same, possibly fewer, pools.
+        iterator  = parse_iterator(settings_dict.get('iterator', cls._DEFAULT_ITERATOR))
+        nbnd      = get_num_bands(cls.inputs.pw_parameters.get_dict()) if 'pw_parameters' in cls.inputs else None
+        layout    = get_pw_parallelization(
+            max(iterator[0] - 1, 1), get_num_mpiprocs(cls.inputs.metadata.options.resources, pw_code.computer), nbnd
+            )
+        cmdline   = get_parallelization_cmdline(layout)
+        pools_cmd = ' ' + ' '.join(cmdline) + ' ' if cmdline else ''
+
+    if 'mpi_command' in settings_dict:
+        mpi_command = settings_dict['mpi_command']
+    else:
+        computer           = cls.inputs.pw_code.computer
+        if layout is None:
+            mpi_procs      = get_num_mpiprocs(cls.inputs.metadata.options.resources, computer)
+        else:
+            mpi_procs      = layout['num_mpiprocs']
+        mpi_command        = computer.get_mpirun_command()
+        mpi_command        = ' '.join(mpi_command).format(tot_num_mpiprocs=mpi_procs)
+
+    nscf_cmd = ' {} {}'.format(mpi_command, pw_code.get_execname())
+    pw_in_cmd = settings_dict.get('pw_in_command', '<')
+
+    if overlap_engine == 'python':
+        z2cmd = (
+            "(\n    '" +
+            "ln -s ../out .; ln -s ../pseudo .;'\n    '" +
+            nscf_cmd + pools_cmd + ' {} '.format(pw_in_cmd) + cls._INPUT_PW_NSCF_FILE + ' >& ' + cls._OUTPUT_PW_NSCF_FILE + ";'" + '\n' +
+            ')'
+            # yapf: disable
+            )
+        input_file_lines = ['']
+        input_file_lines.append('z2cmd =' +  z2cmd)
+        input_file_lines.extend(get_python_system_lines(cls, settings_dict, name))
+        input_file_lines.extend(get_overlap_store_lines(cls, settings_dict, name))
+        return input_file_lines
+
+    overlap_cmd   = ' {} {}'.format(mpi_command, overlap_code.get_execname())
+    wannier90_cmd = ' {}'.format(wannier90_code.get_execname())
+
+    # The wavefunctions are only needed by the overlap code: remove them to keep the working directory small
+    prune_cmd = ''
+    if settings_dict.get('prune_wavefunctions', False):
+        wfc_files = ['out/{}.wfc*'.format(cls._PREFIX), 'out/{}.save/wfc*'.format(cls._PREFIX)]
+        prune_cmd = " +\n    ' rm -f " + ' '.join(wfc_files) + ";'"
+
+    # The nnkp file depends only on the k-points and cell written in the .win file: cache it by the hash of the file
+    nnkp_cache = '../' + cls._NNKP_CACHE_FOLDER
+    nnkp_file  = nnkp_cache + '/$h.nnkp'
+
+    z2cmd = (
+        "(\n    '" +
+        "ln -s ../out .; ln -s ../pseudo .;'\n    '" +
+        ' mkdir -p ' + nnkp_cache + '; h=$(md5sum < ' + cls._INPUT_W90_FILE + ' | cut -c1-32);' + "' +\n    '" +
+        ' if [ -f ' + nnkp_file + ' ]; then cp ' + nnkp_file + ' ' + cls._SEEDNAME + '.nnkp;' +
+        ' echo $h >> ' + nnkp_cache + '/hits;' + "' +\n    '" +
+        ' else' + wannier90_cmd + ' ' + cls._SEEDNAME + ' -pp && cp ' + cls._SEEDNAME + '.nnkp ' + nnkp_file + ';' +
+        ' echo $h >> ' + nnkp_cache + '/misses; fi;' + "' +\n    '" +
+        nscf_cmd + pools_cmd + ' {} '.format(pw_in_cmd) + cls._INPUT_PW_NSCF_FILE + ' >& ' + cls._OUTPUT_PW_NSCF_FILE + ";' +\n    '" +
+        overlap_cmd + ' {} '.format(pw_in_cmd) + cls._INPUT_OVERLAP_FILE + '  >& ' + cls._OUTPUT_OVERLAP_FILE + ";'" +
+        prune_cmd + '\n' +
+        ')'
+        # yapf: disable
+        )
+
+    # yapf: disable
+    input_file_lines = ['']
+    input_file_lines.append('z2cmd =' +  z2cmd)
+
+    input_file_lines.append('')
+    input_files = [cls._INPUT_PW_NSCF_FILE, cls._INPUT_OVERLAP_FILE,cls._INPUT_W90_FILE]
+    input_file_lines.append('input_files = ' + str(input_files))
+    input_file_lines.append(name + ' = z2pack.fp.System(')
+    input_file_lines.append('    input_files = input_files,')
+    input_file_lines.append('    kpt_fct     = [z2pack.fp.kpoint.qe_explicit, z2pack.fp.kpoint.wannier90_full],')
+    # input_file_lines.append('    build_folder= \'.\',')
+    # input_file_lines.append('\t kpt_fct=[z2pack.fp.kpoint.qe, z2pack.fp.kpoint.wannier90],')
+    input_file_lines.append('    kpt_path    = ' + str([cls._INPUT_PW_NSCF_FILE, cls._INPUT_W90_FILE]) + ',')
+    input_file_lines.append('    command     = z2cmd,')
+    input_file_lines.append("    executable  = '/bin/bash',")
+    input_file_lines.append("    mmn_path    = '{}.mmn'".format(cls._SEEDNAME))
+    input_file_lines.append(')')
+    input_file_lines.extend(get_overlap_store_lines(cls, settings_dict, name))
+    # yapf: enable
+
+    return input_file_lines
+
+
+def get_overlap_store_lines(cls, settings_dict, name):
+    """Return the lines of the driver wrapping the system `name` in the `overlap_store`, if requested."""
+    if 'overlap_store' not in settings_dict:
+        return []
+
+    path     = settings_dict['overlap_store']
+    max_size = settings_dict.get('overlap_store_max_size', cls._DEFAULT_OVERLAP_STORE_MAX_SIZE)
+    if not os.path.isabs(path):
+        raise exceptions.InputValidationError('`overlap_store` must be an absolute path on the remote computer.')
+
+    input_file_lines = ['']
+    input_file_lines.append('# Reuse the overlaps of the lines already computed on the same scf')
+    input_file_lines.append('overlap_store = StoredOverlapSystem({}, {!r}, {!r}, {})'.format(
+        name, path, cls._get_overlap_store_key(), int(max_size * 1024**2)))
+    input_file_lines.append('{} = overlap_store'.format(name))
+
+    return input_file_lines
+
+
+def get_overlap_engine(cls, settings_dict):
+    """Return the validated engine computing the overlap matrices of the first-principles calculations."""
+    overlap_engine = settings_dict.get('overlap_engine', cls._DEFAULT_OVERLAP_ENGINE).lower()
+    if overlap_engine not in ('pw2wannier90', 'python'):
+        raise exceptions.InputValidationError('`overlap_engine` must be either `pw2wannier90` or `python`.')
+
+    return overlap_engine
+
+
+def get_upf_pseudo_type(upf):
+    """Return the `pseudo_type` declared in the header of a `UpfData` (`NC`, `SL`, `US`, `PAW`, ...)."""
+    with upf.open() as handle:
+        content = handle.read()
+
+    match = re.search(r'pseudo_type\s*=\s*["\'](\w+)["\']', content)
+    if match is None:
+        # UPF v1: the type is the first word of the third line of the `PP_HEADER` block
+        match = re.search(r'<PP_HEADER>[^\n]*\n(?:[^\n]*\n){2}\s*(\w+)', content)
+    if match is None:
+        return None
+
+    return match.group(1).upper()
+
+
+def get_python_system_lines(cls, settings_dict, name):
+    """Return the lines of the driver defining the system `name` computing the overlaps from the pw.x wavefunctions."""
+    pw_params = cls.inputs.pw_parameters.get_dict()
+    if any(namelist.get('nspin', 1) == 2 for namelist in pw_params.values() if isinstance(namelist, dict)):
+        raise exceptions.InputValidationError('The `python` overlap engine does not support `nspin=2`.')
+
+    # The augmentation charges are not included in the overlaps: only norm-conserving pseudos give the right result
+    scf = get_root_parent(cls, orm.CalcJobNode)
+    for upf, _, label in scf.get_incoming(link_label_filter='pseudos%').all():
+        pseudo_type = get_upf_pseudo_type(upf)
+        if pseudo_type not in ('NC', 'SL'):
+            raise exceptions.InputValidationError(
+                'The `python` overlap engine requires norm-conserving pseudopotentials: `{}` has type `{}`.'.format(
+                    label, pseudo_type))
+
+    w90_params    = _lowercase_dict(cls.inputs.wannier90_parameters.get_dict(), dict_name='wannier90_parameters')
+    exclude_bands = w90_params.get('exclude_bands', [])
+    if not isinstance(exclude_bands, (list, tuple)):
+        raise exceptions.InputValidationError(
+            'The `python` overlap engine requires `exclude_bands` to be a list of band indexes.')
+
+    # yapf: disable
+    input_file_lines = ['']
+    input_file_lines.append(name + ' = PythonOverlapSystem(')
+    input_file_lines.append("    input_files   = ['{}'],".format(cls._INPUT_PW_NSCF_FILE))
+    input_file_lines.append('    kpt_fct       = z2pack.fp.kpoint.qe_explicit,')
+    input_file_lines.append("    kpt_path      = '{}',".format(cls._INPUT_PW_NSCF_FILE))
+    input_file_lines.append('    command       = z2cmd,')
+    input_file_lines.append("    executable    = '/bin/bash',")
+    input_file_lines.append("    save_dir      = '{}',".format(os.path.join('out', cls._PREFIX + '.save')))
+    input_file_lines.append('    exclude_bands = {},'.format(list(exclude_bands)))
+    input_file_lines.append('    num_bands     = {},'.format(w90_params.get('num_bands', None)))
+    input_file_lines.append('    prune         = {}'.format(bool(settings_dict.get('prune_wavefunctions', False))))
+    input_file_lines.append(')')
+    # yapf: enable
+
+    return input_file_lines
+
+
+def get_dft_check_lines(cls, surface, num_lines, pos_tol, iterator):
+    """Return the lines of the driver that re-run with `fp_system` the `num_lines` lines with the smallest gap."""
+    nbnd = cls.tb_bands
+    # yapf: disable
+    input_file_lines = ['']
+    input_file_lines.append('surface_fct = ' + surface)
+    input_file_lines.append('')
+    input_file_lines.append('def get_line_gap(s):')
+    input_file_lines.append('    gap = np.inf')
+    input_file_lines.append('    for t in np.linspace(0, 1, 21):')
+    input_file_lines.append('        eig = model.eigenval(surface_fct(s, t))')
+    input_file_lines.append('        gap = min(gap, eig[{}] - eig[{}])'.format(nbnd, nbnd - 1))
+    input_file_lines.append('    return gap')
+    input_file_lines.append('')
+    input_file_lines.append("res_dict['dft_check'] = []")
+    input_file_lines.append('line_gaps = sorted((get_line_gap(s), i) for i, s in enumerate(result.t))')
+    input_file_lines.append('for gap, i in line_gaps[:{}]:'.format(num_lines))
+    input_file_lines.append('    s = result.t[i]')
+    input_file_lines.append('    fp_result = z2pack.line.run(')
+    input_file_lines.append('        system   = fp_system,')
+    input_file_lines.append('        line     = lambda t, s=s: surface_fct(s, t),')
+    input_file_lines.append('        pos_tol  = ' + str(pos_tol) + ',')
+    input_file_lines.append('        iterator = ' + str(iterator) + ',')
+    input_file_lines.append('        )')
+    input_file_lines.append('    diff = abs(fp_result.pol - result.pol[i]) % 1')
+    input_file_lines.append("    res_dict['dft_check'].append({")
+    input_file_lines.append("        't': float(s), 'band_gap': float(gap), 'tb_pol': float(result.pol[i]),")
+    input_file_lines.append("        'fp_pol': float(fp_result.pol), 'difference': float(min(diff, 1 - diff)),")
+    input_file_lines.append('        })')
+    # yapf: enable
+
+    return input_file_lines
@@ -1,8 +1,5 @@
 from __future__ import absolute_import
 from aiida import orm
-from aiida.plugins import CalculationFactory
-
-PwCalculation = CalculationFactory('quantumespresso.pw')
 
 
 def deep_copy(old):
@@ -80,7 +77,7 @@ def get_previous_node(old, node_class):
     :param old: Starting node from which to walk back on the chain
     :param node_class: Subclass of CalcJob in the chain
     """
-    remote = old.get_incoming(node_class=orm.RemoteData).first().node
+    remote = old.get_incoming(node_class=orm.RemoteData, link_label_filter='parent_folder').first().node
     new = remote.get_incoming(node_class=node_class).first().node
 
     return new
@@ -0,0 +1,250 @@
+"""Helpers for the driver generated by `Z2packCalculation`.
+
+This module is copied next to the driver and imported by it on the computer running z2pack.
+It is not imported by the plugin, as it requires `z2pack` to be installed.
+"""
+import hashlib
+import os
+import subprocess
+
+import numpy as np
+import z2pack
+from z2pack.system import OverlapSystem
+
+# Miller indices are encoded in a single integer to match the plane waves of two kpoints
+_MILLER_OFFSET = 2**20
+_MILLER_RANGE = 2**21
+
+
+def get_kpt_key(kpt):
+    """Return a hashable key identifying a list of kpoints."""
+    return tuple(tuple(float(x) for x in np.round(k, 10)) for k in kpt)
+
+
+class CachedOverlapSystem(OverlapSystem):
+    """Keep in memory the overlap matrices computed by `system`, so that every line is computed only once."""
+    def __init__(self, system):
+        self.system = system
+        self.cache = {}
+
+    def get_mmn(self, kpt):
+        key = get_kpt_key(kpt)
+        if key not in self.cache:
+            self.cache[key] = [np.array(mmn) for mmn in self.system.get_mmn(kpt)]
+
+        return self.cache[key]
+
+
+class StoredOverlapSystem(OverlapSystem):
+    """Store on disk the overlap matrices computed by `system`, to share them between calculations.
+
+    The matrices of a line are saved in the `path` folder under a hash of `key` and of the kpoints of the line.
+    When the size of the store exceeds `max_size` bytes, the least recently used entries are removed.
+    """
+    def __init__(self, system, path, key, max_size):
+        self.system = system
+        self.path = path
+        self.key = key
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # Created in the meantime by another calculation
+                pass
+
+    def get_filename(self, kpt):
+        digest = hashlib.sha256((self.key + repr(get_kpt_key(kpt))).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.npy')
+
+    def get_mmn(self, kpt):
+        filename = self.get_filename(kpt)
+        try:
+            mmn = np.load(filename)
+        except (IOError, OSError, ValueError):
+            mmn = None
+
+        if mmn is not None:
+            self.hits += 1
+            os.utime(filename, None)
+            return list(mmn)
+
+        self.misses += 1
+        mmn = self.system.get_mmn(kpt)
+
+        # Write to a temporary file first, so that other calculations never read a partial entry
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'wb') as handle:
+            np.save(handle, np.array(mmn))
+        os.rename(tmp, filename)
+        self.evict()
+
+        return mmn
+
+    def evict(self):
+        """Remove the least recently used entries until the size of the store is below `max_size`."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.npy'):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, filename in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            size -= entry_size
+
+
+class BandWindowSystem(OverlapSystem):
+    """Restrict the overlap matrices computed by `system` to the bands from `first` to `last` (1-based, included)."""
+    def __init__(self, system, first, last):
+        self.system = system
+        self.bands = slice(first - 1, last)
+
+    def get_mmn(self, kpt):
+        return [mmn[self.bands, self.bands] for mmn in self.system.get_mmn(kpt)]
+
+
+def read_qe_wfc(filename):
+    """Read a wavefunction file `wfc*.dat` (or `wfc*.hdf5`) written by pw.x.
+
+    Binary files are memory-mapped, so that only the bands that are used are actually read from disk.
+
+    :return: tuple with the Miller indices `(igwx, 3)` of the plane waves and the coefficients `(nbnd, npol, igwx)`.
+    """
+    if filename.endswith('.hdf5'):
+        return _read_qe_wfc_hdf5(filename)
+
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    # Fortran unformatted records: every record is enclosed by two 4-byte markers with its size
+    offsets = []
+    offset = 0
+    for _ in range(4):
+        size = int(np.frombuffer(data, dtype='<i4', count=1, offset=offset)[0])
+        offsets.append(offset + 4)
+        offset += size + 8
+
+    gamma_only = np.frombuffer(data, dtype='<i4', count=1, offset=offsets[0] + 32)[0]
+    if gamma_only:
+        raise ValueError('Gamma-only wavefunctions are not supported: `{}`.'.format(filename))
+
+    _, igwx, npol, nbnd = np.frombuffer(data, dtype='<i4', count=4, offset=offsets[1])
+    mill = np.frombuffer(data, dtype='<i4', count=3 * igwx, offset=offsets[3]).reshape(igwx, 3)
+
+    record = 16 * npol * igwx
+    evc = np.ndarray(
+        shape=(nbnd, npol, igwx), dtype='<c16', buffer=data, offset=offset + 4, strides=(record + 8, 16 * igwx, 16)
+        )
+
+    return mill, evc
+
+
+def _read_qe_wfc_hdf5(filename):
+    """Read a wavefunction file written by pw.x compiled with HDF5 (see `read_qe_wfc`)."""
+    import h5py
+
+    with h5py.File(filename, 'r') as handle:
+        if handle.attrs['gamma_only'] in (1, b'.TRUE.', '.TRUE.'):
+            raise ValueError('Gamma-only wavefunctions are not supported: `{}`.'.format(filename))
+        npol = int(handle.attrs['npol'])
+        mill = np.array(handle['MillerIndices'])
+        evc = np.array(handle['evc'])
+
+    evc = evc[:, ::2] + 1j * evc[:, 1::2]
+
+    return mill, evc.reshape(evc.shape[0], npol, -1)
+
+
+def get_miller_keys(mill):
+    """Encode every row of Miller indices in a single integer."""
+    mill = np.asarray(mill, dtype=np.int64) + _MILLER_OFFSET
+    return (mill[:, 0] * _MILLER_RANGE + mill[:, 1]) * _MILLER_RANGE + mill[:, 2]
+
+
+def get_overlap(mill_a, evc_a, mill_b, evc_b, shift=(0, 0, 0)):
+    """Return the overlap matrix `<u_ma|u_nb>` of the periodic parts of two sets of wavefunctions.
+
+    The wavefunctions of `b` are the ones at `k_b + shift`, with `shift` a reciprocal lattice vector in crystal
+    coordinates: `c_{k+G}(G') = c_k(G' + G)`.
+    """
+    keys_b = get_miller_keys(np.asarray(mill_b) - np.asarray(shift))
+    _, idx_a, idx_b = np.intersect1d(get_miller_keys(mill_a), keys_b, assume_unique=True, return_indices=True)
+
+    return np.tensordot(np.conj(evc_a[:, :, idx_a]), evc_b[:, :, idx_b], axes=([1, 2], [1, 2]))
+
+
+class PythonOverlapSystem(z2pack.fp.System):
+    """First-principles system computing the overlap matrices directly from the wavefunctions of pw.x.
+
+    Only the nscf calculation is run by `command`: the overlaps are computed from the plane-wave coefficients
+    read from `save_dir`, without running pw2wannier90.x and wannier90.x.
+    The augmentation charges are not included, so only norm-conserving pseudopotentials are supported.
+
+    :param save_dir: path of the save directory of pw.x, relative to the build folder.
+    :param exclude_bands: list of bands (1-based) excluded from the overlaps.
+    :param num_bands: number of bands included in the overlaps, after the excluded ones are removed.
+    :param prune: if `True` the wavefunction files are removed once read.
+    """
+    def __init__(self, save_dir, exclude_bands=None, num_bands=None, prune=False, **kwargs):
+        kwargs.setdefault('mmn_path', 'aiida.mmn')
+        super(PythonOverlapSystem, self).__init__(**kwargs)
+        self.save_dir = self._to_abspath(save_dir)
+        self.exclude_bands = set(exclude_bands or [])
+        self.num_bands = num_bands
+        self.prune = prune
+
+    def read_wfc(self, ik):
+        """Return the Miller indices and the coefficients of the included bands of the `ik`-th kpoint (1-based)."""
+        filename = os.path.join(self.save_dir, 'wfc{}.dat'.format(ik))
+        if not os.path.exists(filename):
+            filename = os.path.join(self.save_dir, 'wfc{}.hdf5'.format(ik))
+        mill, evc = read_qe_wfc(filename)
+
+        bands = [n for n in range(evc.shape[0]) if n + 1 not in self.exclude_bands][:self.num_bands]
+        mill, evc = np.array(mill), evc[bands]
+        if self.prune:
+            os.remove(filename)
+
+        return mill, evc
+
+    def get_mmn(self, kpt):
+        num_kpoints = len(kpt) - 1
+
+        self._create_input(kpt)
+        subprocess.call(self._command, cwd=self._build_folder, shell=True, executable=self._executable)
+
+        wfcs = [self.read_wfc(ik) for ik in range(1, num_kpoints + 1)]
+        # The last point of the line is the first one translated by a reciprocal lattice vector
+        shift = np.round(np.array(kpt[-1]) - np.array(kpt[0])).astype(int)
+
+        mmn = []
+        for i in range(num_kpoints):
+            mill_a, evc_a = wfcs[i]
+            mill_b, evc_b = wfcs[(i + 1) % num_kpoints]
+            mmn.append(get_overlap(mill_a, evc_a, mill_b, evc_b, shift if i == num_kpoints - 1 else (0, 0, 0)))
+
+        return mmn
+
+
+def get_convergence_report(result):
+    """Return the convergence report of a surface calculation in the format of the `output_parameters`."""
+    report = result.convergence_report
+
+    return {
+        'GapCheck': {key: report['surface']['GapCheck'][key] for key in ('PASSED', 'FAILED')},
+        'MoveCheck': {key: report['surface']['MoveCheck'][key] for key in ('PASSED', 'FAILED')},
+        'PosCheck': {key: report['line']['PosCheck'][key] for key in ('PASSED', 'FAILED', 'MISSING')},
+    }
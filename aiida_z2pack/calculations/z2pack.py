@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import hashlib
+import json
 import os
 import six
 
@@ -8,8 +10,9 @@ from aiida.engine import CalcJob
 from aiida.plugins import CalculationFactory
 from aiida.common import datastructures, exceptions
 
-from .utils import prepare_nscf, prepare_overlap, prepare_wannier90, prepare_z2pack
-from .utils import merge_dict_input_to_root, recursive_get_linked_node
+from .utils import prepare_nscf, prepare_overlap, prepare_wannier90, prepare_z2pack, estimate_z2pack_cost
+from .utils import merge_dict_input_to_root, recursive_get_linked_node, get_root_parent
+from .utils.parallelization import get_num_bands
 
 from aiida_quantumespresso.calculations import _lowercase_dict
 
@@ -38,10 +41,15 @@ class Z2packCalculation(CalcJob):
     _OUTPUT_Z2PACK_FILE = 'z2pack_aiida.out'
     _OUTPUT_SAVE_FILE = 'save.json'
     _OUTPUT_RESULT_FILE = 'results.json'
+    _OUTPUT_WINDOW_SAVE_FILE = 'save_window_{}.json'
+    _HELPERS_FILE = 'z2pack_helpers.py'
+    _NNKP_CACHE_FOLDER = 'nnkp_cache'
 
     _INPUT_W90_FILE = _SEEDNAME + '.win'
     _OUTPUT_W90_FILE = _SEEDNAME + '.wout'
 
+    _INPUT_HR_FILE = _SEEDNAME + '_hr.dat'
+
     _INPUT_OVERLAP_FILE = 'aiida.pw2wan.in'
     _OUTPUT_OVERLAP_FILE = 'aiida.pw2wan.out'
 
@@ -54,21 +62,24 @@ class Z2packCalculation(CalcJob):
     _DEFAULT_GAP_TOLERANCE = 0.3
     _DEFAULT_MOVE_TOLERANCE = 0.3
     _DEFAULT_POS_TOLERANCE = 0.01
+    _DEFAULT_BACKEND = 'fp'
+    _DEFAULT_OVERLAP_STORE_MAX_SIZE = 1024  # MB
+    _DEFAULT_OVERLAP_ENGINE = 'pw2wannier90'
 
     _blocked_keywords_pw = PwCalculation._blocked_keywords
-    _blocked_keywords_overlap = [
+    # Tuples, so that the input generators can't modify them: `spinors` is added by `prepare_wannier90` if needed
+    _blocked_keywords_overlap = (
         ('INPUTPP', 'outdir', _OUTPUT_SUBFOLDER),
         ('INPUTPP', 'prefix', _PREFIX),
         ('INPUTPP', 'seedname', _SEEDNAME),
         ('INPUTPP', 'write_amn', False),
         ('INPUTPP', 'write_mmn', True),
-    ]
-    _blocked_keywords_wannier90 = [
+    )
+    _blocked_keywords_wannier90 = (
         ('length_unit', 'ang'),
-        # ('spinors', True),
         ('num_iter', 0),
         ('use_bloch_phases', True),
-    ]
+    )
 
     @classmethod
     def define(cls, spec):
@@ -99,6 +110,12 @@ class Z2packCalculation(CalcJob):
             help='Dict: Input parameters for the wannier code (wannier90).'
             )
 
+        spec.input(
+            'wannier90_folder', valid_type=orm.RemoteData,
+            required=False,
+            help='Output of a Wannier90 calculation with `write_hr=True`, providing the tight-binding model for the `tb` backend.'
+            )
+
         spec.input(
             'pw_settings', valid_type=orm.Dict,
             required=False,
@@ -184,6 +201,18 @@ class Z2packCalculation(CalcJob):
             )
         # yapf: enable
 
+    @classmethod
+    def estimate_cost(cls, z2pack_settings, timings=None, num_cores=1):
+        """
+        Estimate lower and upper bounds for the number of lines, k-points and core-hours of a calculation.
+        :param z2pack_settings: `Dict` or dictionary with the z2pack settings.
+        :param timings: optional dictionary with the per-stage timings in seconds.
+        :param num_cores: number of cores used by each pw.x/pw2wannier90.x call.
+        """
+        if isinstance(z2pack_settings, orm.Dict):
+            z2pack_settings = z2pack_settings.get_dict()
+        return estimate_z2pack_cost(cls, z2pack_settings, timings=timings, num_cores=num_cores)
+
     def prepare_for_submission(self, folder):
         self.inputs.metadata.options.parser_name = 'z2pack.z2pack'
         self.inputs.metadata.options.output_filename = self._OUTPUT_Z2PACK_FILE
@@ -237,12 +266,6 @@ class Z2packCalculation(CalcJob):
         elif parent_type == PwCalculation:
             self._set_inputs_from_parent_scf()
 
-        pw_dct = _lowercase_dict(self.inputs.pw_parameters.get_dict(),
-                                       'pw_dct')
-        sys = pw_dct['system']
-        if sys.get('noncolin', False) and sys.get('lspinorb', False):
-            self._blocked_keywords_wannier90.append(('spinors', True))
-
         try:
             settings = _lowercase_dict(self.inputs.z2pack_settings.get_dict(),
                                        'z2pack_settings')
@@ -250,13 +273,30 @@ class Z2packCalculation(CalcJob):
             raise exceptions.InputValidationError(
                 'Must provide `z2pack_settings` input for `scf` calculation.')
         symlink = settings.get('parent_folder_symlink', False)
+        if symlink and settings.get('prune_wavefunctions', False):
+            raise exceptions.InputValidationError(
+                '`prune_wavefunctions` would remove the files of the parent folder with `parent_folder_symlink`.')
         self.restart_mode = settings.get('restart_mode', True)
+        window_save_files = [
+            self._OUTPUT_WINDOW_SAVE_FILE.format(n) for n in range(len(settings.get('band_windows', [])))
+            ]
+        calcinfo.retrieve_list.extend(window_save_files)
         ptr = calcinfo.remote_symlink_list if symlink else calcinfo.remote_copy_list
 
+        backend = settings.get('backend', self._DEFAULT_BACKEND).lower()
+        if backend not in ('fp', 'tb'):
+            raise exceptions.InputValidationError('`backend` must be either `fp` or `tb`.')
+        # The first-principles calculations are needed also by the `tb` backend to check the lines closest to a gap closing
+        self.use_dft = backend == 'fp' or settings.get('dft_check_lines', 0) > 0
+
+        if backend == 'tb':
+            self._set_tb_model(settings, calcinfo)
+
         if parent_type == PwCalculation:
-            prepare_nscf(self, folder)
-            prepare_overlap(self, folder)
-            prepare_wannier90(self, folder)
+            if self.use_dft:
+                prepare_nscf(self, folder)
+                prepare_overlap(self, folder)
+                prepare_wannier90(self, folder)
         elif parent_type == Z2packCalculation:
             if self.restart_mode:
                 calcinfo.remote_copy_list.append(
@@ -265,24 +305,104 @@ class Z2packCalculation(CalcJob):
                         os.path.join(rpath, self._OUTPUT_SAVE_FILE),
                         self._OUTPUT_SAVE_FILE,
                     ))
-
-            calcinfo.remote_copy_list.extend(
-                [(uuid, os.path.join(rpath, inp), inp) for inp in inputs]
-                )
+                # The windows added since the parent calculation start from scratch
+                retrieved = parent.creator.outputs.retrieved.list_object_names()
+                calcinfo.remote_copy_list.extend(
+                    [(uuid, os.path.join(rpath, name), name) for name in window_save_files if name in retrieved]
+                    )
+
+            if self.use_dft:
+                calcinfo.remote_copy_list.extend(
+                    [(uuid, os.path.join(rpath, inp), inp) for inp in inputs]
+                    )
+                # Only the lines whose .win file is written again (same k-points and cell) hit the parent cache
+                outputs = parent.creator.outputs
+                if 'output_parameters' in outputs and 'nnkp_cache' in outputs.output_parameters.get_dict():
+                    calcinfo.remote_copy_list.append(
+                        (uuid, os.path.join(rpath, self._NNKP_CACHE_FOLDER), self._NNKP_CACHE_FOLDER)
+                        )
         else:
             raise exceptions.ValidationError(
                 'parent node must be either from a PWscf or a Z2pack calculation.'
                 )
 
-        parent_files = [self._PSEUDO_SUBFOLDER, self._OUTPUT_SUBFOLDER]
-        ptr.extend(
-            [(uuid, os.path.join(rpath, fname), fname) for fname in parent_files]
-            )
+        if self.use_dft:
+            ptr.extend(
+                [(uuid, os.path.join(rpath, src), dst) for src, dst in self._get_parent_files(settings, folder)]
+                )
 
         prepare_z2pack(self, folder)
 
         return calcinfo
 
+    def _get_parent_files(self, settings, folder):
+        """Return the list of `(source, destination)` paths to be staged from the parent folder.
+
+        With `parent_folder_staging='minimal'` only the pseudopotentials and the files of the save directory read by
+        the nscf calculations (the xml data file and the charge density) are staged.
+        """
+        staging = settings.get('parent_folder_staging', 'full')
+        if staging == 'full':
+            return [(fname, fname) for fname in [self._PSEUDO_SUBFOLDER, self._OUTPUT_SUBFOLDER]]
+        if staging != 'minimal':
+            raise exceptions.InputValidationError('`parent_folder_staging` must be either `full` or `minimal`.')
+
+        save = os.path.join(self._OUTPUT_SUBFOLDER, self._PREFIX + '.save')
+        folder.get_subfolder(save, create=True)
+
+        return [
+            (self._PSEUDO_SUBFOLDER, self._PSEUDO_SUBFOLDER),
+            (os.path.join(save, 'data-file-schema.xml'), os.path.join(save, 'data-file-schema.xml')),
+            (os.path.join(save, 'charge-density*'), save),
+            ]
+
+    def _get_overlap_store_key(self):
+        """Return the key identifying the overlaps of this calculation in the `overlap_store`.
+
+        The overlaps of a line depend, besides its kpoints, only on the scf calculation at the root of the chain of
+        parent calculations and on the bands included in the Wannier90 calculation.
+        """
+        scf = get_root_parent(self, orm.CalcJobNode)
+        w90_params = _lowercase_dict(self.inputs.wannier90_parameters.get_dict(), 'wannier90_parameters')
+        key = [scf.uuid, get_num_bands(self.inputs.pw_parameters.get_dict())]
+        key += [w90_params.get(name, None) for name in ('num_bands', 'exclude_bands', 'spinors')]
+
+        return hashlib.md5(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def _set_tb_model(self, settings, calcinfo):
+        """Copy the Wannier90 tight-binding model and set the number of occupied bands used by the `tb` backend."""
+        if 'wannier90_folder' in self.inputs:
+            w90_folder = self.inputs.wannier90_folder
+        else:
+            if self.inputs.parent_folder.creator.process_class != Z2packCalculation:
+                raise exceptions.InputValidationError('The `tb` backend requires the `wannier90_folder` input.')
+            w90_folder = recursive_get_linked_node(
+                self.inputs.parent_folder.creator, 'wannier90_folder', Z2packCalculation)
+
+        calcinfo.remote_copy_list.append((
+            w90_folder.computer.uuid,
+            os.path.join(w90_folder.get_remote_path(), self._INPUT_HR_FILE),
+            self._INPUT_HR_FILE
+            ))
+
+        if 'tb_bands' in settings:
+            self.tb_bands = settings['tb_bands']
+            return
+
+        w90_params = _lowercase_dict(w90_folder.creator.inputs.parameters.get_dict(), 'wannier90_parameters')
+        # On restarts the parent is a previous z2pack calculation: the electrons are counted by the scf at the root
+        scf = get_root_parent(self, orm.CalcJobNode)
+        if 'exclude_bands' in w90_params or scf.process_class != PwCalculation:
+            raise exceptions.InputValidationError(
+                'Can\'t determine the number of occupied Wannier bands: set `tb_bands` in the `z2pack_settings`.')
+
+        out_params = scf.outputs.output_parameters.get_dict()
+        n_el = int(round(out_params['number_of_electrons']))
+        if out_params.get('non_colinear_calculation', out_params.get('spin_orbit_calculation', False)):
+            self.tb_bands = n_el
+        else:
+            self.tb_bands = n_el // 2
+
     def _set_inputs_from_parent_scf(self):
         parent = self.inputs.parent_folder
         calc   = parent.creator
@@ -308,7 +428,11 @@ class Z2packCalculation(CalcJob):
             if label in self.inputs:
                 continue
             # old = calc.get_incoming(link_label_filter=label).first().node
-            old = recursive_get_linked_node(calc, label, Z2packCalculation)
+            try:
+                old = recursive_get_linked_node(calc, label, Z2packCalculation)
+            except AttributeError:
+                # The DFT codes are not used by calculations with the `tb` backend
+                continue
             setattr(self.inputs, label, old)
 
         merge_dict_input_to_root(
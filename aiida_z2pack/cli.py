@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Command line interface for `aiida-z2pack`."""
+from __future__ import absolute_import
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+
+@click.group('aiida-z2pack')
+def cmd_root():
+    """Command line interface for aiida-z2pack."""
+
+
+@cmd_root.group('cache')
+def cmd_cache():
+    """Inspect and evict entries of the z2pack result cache."""
+
+
+@cmd_cache.command('list')
+@decorators.with_dbenv()
+def cmd_cache_list():
+    """List the cached z2pack workchains."""
+    from aiida_z2pack.workchains.cache import CACHE_EXTRA_KEY, list_cache_entries
+
+    nodes = list_cache_entries()
+    if not nodes:
+        echo.echo_info('The cache is empty.')
+        return
+
+    for node in nodes:
+        echo.echo('{}  {}<{}>  {}'.format(
+            node.get_extra(CACHE_EXTRA_KEY), node.process_label, node.pk, node.ctime.strftime('%Y-%m-%d %H:%M:%S')))
+
+
+@cmd_cache.command('clear')
+@click.argument('hashes', nargs=-1)
+@click.option('-a', '--all', 'clear_all', is_flag=True, help='Evict all the entries of the cache.')
+@decorators.with_dbenv()
+def cmd_cache_clear(hashes, clear_all):
+    """Evict the entries with the given HASHES (or hash prefixes) from the cache."""
+    from aiida_z2pack.workchains.cache import clear_cache_entries
+
+    if not hashes and not clear_all:
+        echo.echo_critical('Specify the HASHES to evict or use `--all`.')
+
+    count = clear_cache_entries(None if clear_all else list(hashes))
+
+    echo.echo_success('Evicted {} cache entries.'.format(count))
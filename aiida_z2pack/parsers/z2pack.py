@@ -1,12 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import json
+from aiida import orm
 from aiida.common import exceptions
 from aiida.parsers.parser import Parser
-from aiida.plugins import DataFactory, CalculationFactory
-
-Dict              = DataFactory('dict')
-Z2packCalculation = CalculationFactory('z2pack.z2pack')
 
 
 class Z2packParser(Parser):
@@ -41,13 +38,9 @@ class Z2packParser(Parser):
         with out_folder.open(pc._OUTPUT_Z2PACK_FILE) as f:
             out_file = f.readlines()
 
-        gap_f   = len(data['convergence_report']['GapCheck']['FAILED'])
-        move_f  = len(data['convergence_report']['MoveCheck']['FAILED'])
-        pos_f   = len(data['convergence_report']['PosCheck']['FAILED'])
-        pos_m   = len(data['convergence_report']['PosCheck']['MISSING'])
-        success = not any([gap_f, move_f, pos_f, pos_m])
-
-        data['Tests_passed'] = success
+        data['Tests_passed'] = self.get_tests_passed(data['convergence_report'])
+        for window in data.get('band_windows', []):
+            window['Tests_passed'] = self.get_tests_passed(window['convergence_report'])
 
 
         #out_file = out_file.split("\n")
@@ -62,7 +55,17 @@ class Z2packParser(Parser):
         data['wall_time_seconds'] =  wall_time_seconds
         data['z2pack_version'] =  z2pack_version
 
-        self.out('output_parameters', Dict(dict=data))
+        self.out('output_parameters', orm.Dict(dict=data))
+
+    @staticmethod
+    def get_tests_passed(convergence_report):
+        """Return `True` if none of the convergence checks of a surface calculation failed."""
+        gap_f   = len(convergence_report['GapCheck']['FAILED'])
+        move_f  = len(convergence_report['MoveCheck']['FAILED'])
+        pos_f   = len(convergence_report['PosCheck']['FAILED'])
+        pos_m   = len(convergence_report['PosCheck']['MISSING'])
+
+        return not any([gap_f, move_f, pos_f, pos_m])
 
     def exit(self, exit_code):
         """Log the exit message of the give exit code with level `ERROR` and return the exit code.
@@ -2,14 +2,33 @@
 from __future__ import absolute_import
 from aiida import orm
 from aiida.common import AttributeDict
+from aiida.common.links import LinkType
 from aiida.plugins import WorkflowFactory, CalculationFactory
 from aiida.engine import ToContext, while_, if_, BaseRestartWorkChain, process_handler, ProcessHandlerReport
 
 from six.moves import range
 
-PwCalculation = CalculationFactory('quantumespresso.pw')
-Z2packCalculation = CalculationFactory('z2pack.z2pack')
-PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+from ..calculations.utils.parallelization import get_num_bands, get_num_mpiprocs
+# Needed at class definition by `_process_class` and the exit codes of the process handlers
+from ..calculations.z2pack import Z2packCalculation
+from ..calculations.utils.utils import deep_update
+from .cache import CACHE_EXTRA_KEY, get_cached_node, get_z2pack_cache_hash
+from .cost import attach_cost_output, is_budget_exhausted
+
+
+def get_nscf_num_bands(pw_parameters, n_occ, n_bnd, buffer):
+    """Return the number of bands to be set in the nscf calculations, or `None` if `nbnd` must not be changed.
+
+    :param pw_parameters: dictionary of the pw.x parameters of the nscf calculations.
+    :param n_occ: number of occupied bands.
+    :param n_bnd: number of bands of the scf calculation, the upper limit of the result.
+    :param buffer: number of empty bands above the occupied ones. If negative, or if `nbnd` is given in the
+                   `pw_parameters`, `nbnd` is not changed.
+    """
+    if buffer < 0 or get_num_bands(pw_parameters) is not None:
+        return None
+
+    return min(n_occ + buffer, n_bnd)
 
 
 class Z2packBaseWorkChain(BaseRestartWorkChain):
@@ -20,6 +39,7 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
     @classmethod
     def define(cls, spec):
         # yapf: disable
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         super().define(spec)
 
         # SCF INPUTS ###########################################################
@@ -52,6 +72,14 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
                 'If specified, will not run the scf calculation and start straight from z2pack.'
                 )
             )
+        spec.input(
+            'use_cache', valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help=(
+                'If `True`, return the outputs of a previous workchain run on the same structure, pseudos, parameters '
+                'and z2pack settings instead of launching new calculations, and tag this workchain for later reuse.'
+                )
+            )
 
         #Z2pack inputs ###########################################################
         spec.input(
@@ -64,6 +92,35 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
             default=lambda: orm.Float(1E-4),
             help='Stop the restart iterations when `min_neighbour_distance` becomes smaller than this threshold.'
             )
+        spec.input(
+            'nscf_bands_buffer', valid_type=orm.Int,
+            default=lambda: orm.Int(4),
+            help=(
+                'When the wannier90 parameters are guessed, compute in the nscf calculations only the occupied bands plus '
+                'this number of empty bands. If negative, or if `nbnd` is given in the `pw_parameters`, the number of '
+                'bands is not changed.'
+                )
+            )
+        spec.input(
+            'max_core_hours', valid_type=orm.Float,
+            required=False,
+            help='Stop launching calculations and return partial results once the calculations of this workchain used this many core-hours.'
+            )
+        spec.input(
+            'max_kpoints', valid_type=orm.Int,
+            required=False,
+            help='Stop launching calculations and return partial results once this many k-points have been computed.'
+            )
+        spec.input(
+            'max_projected_core_hours', valid_type=orm.Float,
+            required=False,
+            help='Do not restart the calculation if the worst-case projected cost of the restart exceeds this budget.'
+            )
+        spec.input(
+            'cost_timings', valid_type=orm.Dict,
+            required=False,
+            help='Per-stage timings in seconds used to calibrate the cost model (see `Z2packCalculation.estimate_cost`).'
+            )
         spec.expose_inputs(
             Z2packCalculation, namespace='z2pack',
             exclude=('parent_folder', 'pw_code'),
@@ -74,17 +131,22 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
 
         spec.outline(
             cls.setup,
-            if_(cls.should_do_scf)(
-                cls.run_scf,
-                cls.inspect_scf,
+            if_(cls.is_cached)(
+                cls.results_from_cache,
+            ).else_(
+                if_(cls.should_do_scf)(
+                    cls.run_scf,
+                    cls.inspect_scf,
+                    ),
+                cls.setup_z2pack,
+                while_(cls.should_run_process)(
+                    cls.prepare_process,
+                    cls.run_process,
+                    cls.inspect_process
+                    ),
+                cls.results,
+                cls.store_cache,
                 ),
-            cls.setup_z2pack,
-            while_(cls.should_run_process)(
-                cls.prepare_process,
-                cls.run_process,
-                cls.inspect_process
-                ),
-            cls.results
             )
 
         spec.expose_outputs(Z2packCalculation)
@@ -93,6 +155,11 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
             required=False,
             help='Auto-setted w90parameters.'
             )
+        spec.output(
+            'cost', valid_type=orm.Dict,
+            required=False,
+            help='Breakdown of the core-hours and k-points spent by the calculations launched by this workchain.'
+            )
         spec.exit_code(101, 'ERROR_UNRECOVERABLE_FAILURE', message='Can\'t recover. Aborting!')
         spec.exit_code(111, 'ERROR_SUB_PROCESS_FAILED_STARTING_SCF',
             message='the starting scf PwBaseWorkChain sub process failed')
@@ -104,6 +171,10 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
             message='Position of largest gap between WCCs varies too much between neighboring lines.')
         spec.exit_code(231, 'ERROR_FAILED_SAVEFILE_TWICE',
             message='The calculation failed to produce the savefile for a restart twice.')
+        spec.exit_code(241, 'ERROR_PROJECTED_COST_EXCEEDED',
+            message='The projected cost of the restart exceeds `max_projected_core_hours`.')
+        spec.exit_code(251, 'ERROR_BUDGET_EXHAUSTED',
+            message='The `max_core_hours`/`max_kpoints` budget was used up before any z2pack calculation was run.')
         # yapf: enable
 
     def setup(self):
@@ -117,12 +188,92 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
             self.ctx.current_MND = Z2packCalculation._DEFAULT_MIN_NEIGHBOUR_DISTANCE
 
         self.ctx.restart = False
+        self.ctx.budget_exhausted = False
 
         self.ctx.MND_threshold = self.inputs.min_neighbour_distance_threshold_minimum.value
         self.ctx.MND_scale_factor = self.inputs.min_neighbour_distance_scale_factor.value
 
+    def is_cached(self):
+        """Check if the result of this workchain is already available in the cache."""
+        if not self.inputs.use_cache.value:
+            return False
+
+        cache_hash = self._get_cache_hash()
+        if cache_hash is None:
+            self.report('Can\'t compute the cache hash when restarting from a z2pack calculation. Ignoring cache.')
+            return False
+
+        self.ctx.cache_hash = cache_hash
+        self.ctx.cached_node = get_cached_node(cache_hash)
+
+        return self.ctx.cached_node is not None
+
+    def results_from_cache(self):
+        """Attach the outputs of the cached workchain."""
+        node = self.ctx.cached_node
+        self.report('cache hit for hash `{}`: reusing outputs of {}<{}>'.format(
+            self.ctx.cache_hash, node.process_label, node.pk))
+
+        for link in node.get_outgoing(link_type=LinkType.RETURN).all():
+            self.out(link.link_label, link.node)
+
+    def store_cache(self):
+        """Tag the workchain with the cache hash, so that its outputs can be reused.
+
+        Only the results of converged calculations are stored: the loop must have finished and not have been stopped
+        by the `min_neighbour_distance` threshold or by the `max_core_hours`/`max_kpoints` budget.
+        """
+        if 'cache_hash' not in self.ctx:
+            return
+
+        if not self.ctx.is_finished or self.ctx.budget_exhausted:
+            self.report('The z2pack calculation did not converge: the result is not stored in the cache.')
+            return
+
+        self.node.set_extra(CACHE_EXTRA_KEY, self.ctx.cache_hash)
+
+    def _get_cache_hash(self):
+        """Compute the content hash of the inputs, or `None` if the parent folder is not from an scf calculation."""
+        PwCalculation = CalculationFactory('quantumespresso.pw')
+        if 'parent_folder' in self.inputs:
+            calc = self.inputs.parent_folder.creator
+            if not issubclass(calc.process_class, PwCalculation):
+                return None
+            pseudos = calc.get_incoming(link_label_filter='pseudos%').all()
+            pseudos = {name[9:]: upf for upf, _, name in pseudos}
+            pw_parameters = calc.inputs.parameters.get_dict()
+            kpoints = calc.inputs.kpoints
+        elif 'scf' in self.inputs:
+            pseudos = dict(self.inputs.scf.pw.pseudos)
+            pw_parameters = self.inputs.scf.pw.parameters.get_dict()
+            kpoints = self.inputs.scf.get('kpoints', self.inputs.scf.get('kpoints_distance', None))
+        else:
+            return None
+
+        if 'pw_parameters' in self.inputs.z2pack:
+            deep_update(pw_parameters, self.inputs.z2pack.pw_parameters.get_dict())
+
+        parameters = {'pw': pw_parameters}
+        if 'wannier90_parameters' in self.inputs.z2pack:
+            parameters['wannier90'] = self.inputs.z2pack.wannier90_parameters.get_dict()
+
+        defaults = {
+            'pos_tol': Z2packCalculation._DEFAULT_POS_TOLERANCE,
+            'gap_tol': Z2packCalculation._DEFAULT_GAP_TOLERANCE,
+            'move_tol': Z2packCalculation._DEFAULT_MOVE_TOLERANCE,
+            'num_lines': Z2packCalculation._DEFAULT_NUM_LINES,
+            'min_neighbour_dist': Z2packCalculation._DEFAULT_MIN_NEIGHBOUR_DISTANCE,
+            'iterator': Z2packCalculation._DEFAULT_ITERATOR,
+        }
+
+        return get_z2pack_cache_hash(
+            self.inputs.structure, pseudos, parameters, self.inputs.z2pack.z2pack_settings.get_dict(), defaults,
+            kpoints=kpoints, wannier90_folder=self.inputs.z2pack.get('wannier90_folder', None)
+            )
+
     def should_do_scf(self):
         """Check if the `scf` calculation should be performed or the parent folder should be taken from the inputs."""
+        PwCalculation = CalculationFactory('quantumespresso.pw')
         if 'parent_folder' in self.inputs:
             if 'scf' in self.inputs:
                 self.report(
@@ -141,6 +292,7 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
 
     def run_scf(self):
         """Run the `scf` calculation."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         inputs = AttributeDict(
             self.exposed_inputs(PwBaseWorkChain, namespace='scf'))
         inputs.pw.structure = self.inputs.structure
@@ -170,10 +322,14 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
 
         Same behaviour as the BaseRestartWorkChain from the qe plugin.
         Also stop the iterations if the `min_neighbour_distance` convergence parameter drops below the set
-        threshold level.
+        threshold level, or if the `max_core_hours`/`max_kpoints` budget is used up.
         """
-        return super().should_run_process(
-        ) and self.ctx.current_MND >= self.ctx.MND_threshold
+        if not super().should_run_process() or self.ctx.current_MND < self.ctx.MND_threshold:
+            return False
+
+        self.ctx.budget_exhausted = is_budget_exhausted(self)
+
+        return not self.ctx.budget_exhausted
 
     def setup_z2pack(self):
         """Prepare the inputs for the z2pack CalcJob."""
@@ -182,6 +338,7 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
         inputs.pw_code = self.inputs.pw_code
         inputs.parent_folder = self.ctx.parent_folder
         inputs.z2pack_settings = inputs.z2pack_settings.get_dict()
+        self.ctx.inputs = inputs
 
         if not self.ctx.restart:
             if 'wannier90_parameters' not in inputs:
@@ -194,8 +351,6 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
                     inputs.wannier90_parameters = self._autoset_wannier90_paremters(
                     )
 
-        self.ctx.inputs = inputs
-
     def prepare_process(self):
         """Prepare the inputs for a loop restart calculation."""
         self.ctx.inputs.z2pack_settings[
@@ -208,6 +363,36 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
                 remote = self.ctx.parent_folder
             self.ctx.inputs.parent_folder = remote
 
+            if 'max_projected_core_hours' in self.inputs:
+                return self._check_projected_cost()
+
+    def results(self):
+        """Attach the outputs of the last calculation and the cost breakdown."""
+        attach_cost_output(self)
+
+        if not self.ctx.children:
+            self.report('No z2pack calculation was run within the budget.')
+            return self.exit_codes.ERROR_BUDGET_EXHAUSTED
+
+        return super().results()
+
+    def _check_projected_cost(self):
+        """Return an exit code if the worst-case projected cost of the next calculation exceeds the budget."""
+        timings = self.inputs.cost_timings.get_dict() if 'cost_timings' in self.inputs else None
+        resources = self.ctx.inputs['metadata']['options']['resources']
+        num_cores = get_num_mpiprocs(resources, self.inputs.pw_code.computer)
+
+        cost = Z2packCalculation.estimate_cost(self.ctx.inputs.z2pack_settings, timings=timings, num_cores=num_cores)
+        projected = cost['core_hours'][1]
+        budget = self.inputs.max_projected_core_hours.value
+
+        self.report('projected cost of the restart: {:.1f}-{:.1f} core-hours, {}-{} k-points'.format(
+            *cost['core_hours'], *cost['kpoints']))
+
+        if projected > budget:
+            self.report('projected cost {:.1f} exceeds the budget of {:.1f} core-hours'.format(projected, budget))
+            return self.exit_codes.ERROR_PROJECTED_COST_EXCEEDED
+
     def inspect_process(self):
         """Check the outputs of the calculation."""
         self.ctx.inputs.z2pack_settings['restart_mode'] = True
@@ -215,7 +400,11 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
         return super().inspect_process()
 
     def _autoset_wannier90_paremters(self):
-        """If not given, set the number of wannier functions and band as all the bands up to the valence one. Ignore the rest."""
+        """If not given, set the number of wannier functions and band as all the bands up to the valence one. Ignore the rest.
+
+        Unless disabled by `nscf_bands_buffer`, also reduce the bands computed by the nscf calculations to the occupied
+        ones plus a buffer of empty bands that keeps the Davidson diagonalization stable.
+        """
         self.report(
             'Required w90 parameters are missing. Guessing them from the output of the scf calculation.'
         )
@@ -229,10 +418,13 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
             n_el /= 2
         n_el = int(n_el)
 
+        n_bnd = self._set_nscf_bands(n_el, n_bnd)
+
         w90_params = {}
         w90_params['num_wann'] = n_el
         w90_params['num_bands'] = n_el
-        w90_params['exclude_bands'] = [*list(range(n_el + 1, n_bnd + 1))]
+        if n_bnd > n_el:
+            w90_params['exclude_bands'] = [*list(range(n_el + 1, n_bnd + 1))]
 
         res = orm.Dict(dict=w90_params)
 
@@ -240,6 +432,23 @@ class Z2packBaseWorkChain(BaseRestartWorkChain):
 
         return res
 
+    def _set_nscf_bands(self, n_occ, n_bnd):
+        """Set `nbnd` of the nscf calculations to `n_occ` plus `nscf_bands_buffer`, capped at the scf `n_bnd`.
+
+        :return: the number of bands computed by the nscf calculations.
+        """
+        pw_parameters = self.ctx.inputs.get('pw_parameters', orm.Dict(dict={})).get_dict()
+
+        nbnd = get_nscf_num_bands(pw_parameters, n_occ, n_bnd, self.inputs.nscf_bands_buffer.value)
+        if nbnd is None:
+            return get_num_bands(pw_parameters) or n_bnd
+
+        pw_parameters.setdefault('SYSTEM', {})['nbnd'] = nbnd
+        self.ctx.inputs.pw_parameters = orm.Dict(dict=pw_parameters)
+        self.report('computing {} bands out of {} in the nscf calculations'.format(nbnd, n_bnd))
+
+        return nbnd
+
     def report_error_handled(self, calculation, action):
         """Report an action taken for a calculation that has failed.
 
@@ -0,0 +1,184 @@
+"""Content-hash cache for the results of z2pack workchains.
+
+A finished `Z2packBaseWorkChain` launched with `use_cache=True` is tagged with the extra `CACHE_EXTRA_KEY`, whose
+value is a hash of everything that determines the physical result: the normalized structure, the pseudopotentials,
+the scf k-point sampling, the merged pw/wannier90 parameters, the Wannier model of the `tb` backend and the z2pack
+convergence settings.
+A later workchain with the same hash returns the outputs of the tagged one instead of launching new jobs.
+The calcfunctions used to explore k-space are deterministic and are covered by the built-in AiiDA caching.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+
+from aiida import orm
+
+CACHE_EXTRA_KEY = 'z2pack_cache_hash'
+
+# Keys that only affect how a calculation is run, not its result.
+_IGNORED_PW_PARAMETERS = (
+    'calculation', 'restart_mode', 'max_seconds', 'verbosity', 'disk_io', 'wf_collect', 'outdir', 'prefix',
+    'pseudo_dir', 'tprnfor', 'tstress'
+)
+_IGNORED_Z2PACK_SETTINGS = (
+    'mpi_command', 'npools', 'parent_folder_symlink', 'parent_folder_staging', 'prune_wavefunctions', 'restart_mode',
+    'prepend_code', 'pw_in_command', 'overlap_store', 'overlap_store_max_size'
+)
+
+_PRECISION = 6
+
+
+def _normalize(value):
+    """Recursively lowercase dictionary keys and round floats, so that equivalent inputs give the same hash.
+
+    Floats are rounded to significant digits rather than decimals, so that small thresholds like `conv_thr` are kept.
+    """
+    if isinstance(value, dict):
+        return {str(k).lower(): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, float):
+        return float('{:.{}g}'.format(value, _PRECISION))
+    return value
+
+
+def get_structure_fingerprint(structure):
+    """Return a representation of a structure independent of the order of its sites and of lattice translations.
+
+    :param structure: aiida.orm.StructureData.
+
+    :return: dictionary with the rounded cell and the sorted list of sites in wrapped fractional coordinates.
+    """
+    import numpy as np
+
+    cell = np.array(structure.cell)
+    kinds = {kind.name: kind for kind in structure.kinds}
+
+    sites = []
+    for site in structure.sites:
+        kind = kinds[site.kind_name]
+        frac = np.linalg.solve(cell.T, np.array(site.position))
+        frac = np.round(frac, _PRECISION) % 1.0
+        sites.append([
+            list(kind.symbols),
+            [round(w, _PRECISION) for w in kind.weights],
+            round(kind.mass, _PRECISION),
+            [round(x, _PRECISION) for x in frac],
+        ])
+
+    return {
+        'cell': np.round(cell, _PRECISION).tolist(),
+        'pbc': list(structure.pbc),
+        'sites': sorted(sites),
+    }
+
+
+def get_kpoints_fingerprint(kpoints):
+    """Return a representation of the k-point sampling of an scf calculation.
+
+    :param kpoints: aiida.orm.KpointsData with a mesh or an explicit list, or aiida.orm.Float with the
+                    `kpoints_distance` used to build the mesh.
+
+    :return: dictionary with the rounded mesh and offset, list of k-points or distance.
+    """
+    if isinstance(kpoints, orm.Float):
+        return {'distance': _normalize(kpoints.value)}
+
+    try:
+        mesh, offset = kpoints.get_kpoints_mesh()
+    except AttributeError:
+        return {'kpoints': _normalize(kpoints.get_kpoints().tolist())}
+
+    return {'mesh': list(mesh), 'offset': _normalize(list(offset))}
+
+
+def get_z2pack_cache_hash(
+    structure, pseudos, parameters, z2pack_settings, defaults=None, kpoints=None, wannier90_folder=None
+    ):
+    """Compute the content hash identifying the result of a z2pack calculation.
+
+    :param structure: aiida.orm.StructureData of the system.
+    :param pseudos: mapping of kind names onto `UpfData` nodes.
+    :param parameters: dictionary of the merged input parameters (e.g. `{'pw': {...}, 'wannier90': {...}}`).
+    :param z2pack_settings: dictionary of the z2pack settings.
+    :param defaults: optional dictionary of default z2pack settings, so that explicit defaults and missing
+                     keys give the same hash.
+    :param kpoints: optional k-point sampling of the scf calculation (see `get_kpoints_fingerprint`).
+    :param wannier90_folder: optional aiida.orm.RemoteData with the Wannier Hamiltonian of the `tb` backend.
+
+    :return: hexadecimal sha256 digest.
+    """
+    params = _normalize(parameters)
+    for namelist in params.get('pw', {}).values():
+        if isinstance(namelist, dict):
+            for key in _IGNORED_PW_PARAMETERS:
+                namelist.pop(key, None)
+
+    settings = _normalize(defaults or {})
+    settings.update(_normalize(z2pack_settings))
+    for key in _IGNORED_Z2PACK_SETTINGS:
+        settings.pop(key, None)
+
+    content = {
+        'structure': get_structure_fingerprint(structure),
+        'pseudos': {kind: upf.md5 for kind, upf in pseudos.items()},
+        'parameters': params,
+        'z2pack_settings': settings,
+        'kpoints': None if kpoints is None else get_kpoints_fingerprint(kpoints),
+        'wannier90_folder': None if wannier90_folder is None else wannier90_folder.uuid,
+    }
+
+    string = json.dumps(content, sort_keys=True)
+
+    return hashlib.sha256(string.encode('utf-8')).hexdigest()
+
+
+def _get_query(cache_hash=None):
+    """Return a QueryBuilder for the finished-ok workflow nodes tagged with a cache hash."""
+    filters = {
+        'attributes.exit_status': 0,
+        'extras': {
+            'has_key': CACHE_EXTRA_KEY
+        },
+    }
+    if cache_hash is not None:
+        filters['extras.{}'.format(CACHE_EXTRA_KEY)] = cache_hash
+
+    qb = orm.QueryBuilder()
+    qb.append(orm.WorkflowNode, filters=filters, tag='workflow')
+    qb.order_by({'workflow': {'ctime': 'desc'}})
+
+    return qb
+
+
+def get_cached_node(cache_hash):
+    """Return the most recent finished workflow node tagged with `cache_hash`, or `None` if there is none."""
+    result = _get_query(cache_hash).first()
+
+    if result is None:
+        return None
+
+    return result[0]
+
+
+def list_cache_entries():
+    """Return the list of cached workflow nodes, most recent first."""
+    return [node for node, in _get_query().all()]
+
+
+def clear_cache_entries(cache_hashes=None):
+    """Evict entries from the cache by removing the hash extra. The nodes themselves are not deleted.
+
+    :param cache_hashes: optional list of hashes (or hash prefixes) to evict. If `None` evict all entries.
+
+    :return: the number of evicted nodes.
+    """
+    count = 0
+    for node in list_cache_entries():
+        value = node.get_extra(CACHE_EXTRA_KEY)
+        if cache_hashes is not None and not any(value.startswith(h) for h in cache_hashes):
+            continue
+        node.delete_extra(CACHE_EXTRA_KEY)
+        count += 1
+
+    return count
@@ -3,7 +3,7 @@ from __future__ import absolute_import
 from aiida import orm
 from aiida.common import AttributeDict
 from aiida.plugins import WorkflowFactory
-from aiida.engine import WorkChain, ToContext, if_, while_, append_
+from aiida.engine import WorkChain, ToContext, if_, while_
 
 from aiida_quantumespresso.calculations import _lowercase_dict
 from aiida_quantumespresso.utils.mapping import prepare_process_inputs
@@ -11,18 +11,17 @@ from aiida_quantumespresso.utils.mapping import prepare_process_inputs
 # yapf: disable
 from .functions import (
     generate_cubic_grid, get_kpoint_grid_dimensionality,
-    get_crossing_and_lowgap_points, merge_crossing_results,
-    merge_chern_results
+    get_crossing_and_lowgap_points, update_crossing_results,
+    merge_chern_results, get_interpolated_bands, confirm_crossings,
+    generate_chern_spheres, get_lowgap_points_from_scf
     )
-from six.moves import range
+from .cost import attach_cost_output, get_cost_breakdown, is_budget_exhausted
+from .sharding import submit_bands, get_bands_workchains, collect_bands
+from ..calculations.utils.parallelization import apply_pw_parallelization
 # yapf: enable
 
 # Z2packCalculation   = CalculationFactory('z2pack.z2pack')
 
-PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
-PwRelaxWorkChain = WorkflowFactory('quantumespresso.pw.relax')
-Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
-
 
 def deep_copy(old):
     """Recursively copy nested dictionaries."""
@@ -36,11 +35,22 @@ def deep_copy(old):
     return res
 
 
+def get_called_processes(node, process_label):
+    """Return the processes with label `process_label` called directly by `node`, in order of creation.
+
+    The loops of the workchains keep only the last process in the context, so that the checkpoints do not grow with
+    the iterations, and recover the full history from the provenance.
+    """
+    return sorted((called for called in node.called if called.process_label == process_label), key=lambda n: n.pk)
+
+
 class FindCrossingsWorkChain(WorkChain):
     """Workchain to find bands crossing in the Brillouin Zone at generic positions using a series of quantum espresso bands calculations."""
     @classmethod
     def define(cls, spec):
         # yapf: disable
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+        PwRelaxWorkChain = WorkflowFactory('quantumespresso.pw.relax')
         super().define(spec)
 
         # INPUTS ############################################################################
@@ -117,6 +127,60 @@ class FindCrossingsWorkChain(WorkChain):
             default=orm.Float(0.0025),
             help='kpoints ith gap < `gap_threshold` are considered possible crossings.'
             )
+        spec.input(
+            'band_pairs', valid_type=orm.List,
+            required=False,
+            help='Indexes (0-based) of the lower band of the pairs of adjacent bands whose crossings are searched. '
+                 'By default only the highest valence band is used.'
+            )
+        spec.input(
+            'seed_from_scf', valid_type=orm.Bool,
+            default=orm.Bool(True),
+            help='If no `starting_kpoints` are given, start from the minima of the gap interpolated from the scf mesh.'
+            )
+        spec.input(
+            'kpoints_per_job', valid_type=orm.Int,
+            required=False,
+            help='If given, split the kpoints of the bands calculations in chunks of this size run concurrently.'
+            )
+        spec.input(
+            'exclude_found_crossings', valid_type=orm.Bool,
+            default=orm.Bool(False),
+            help='If `True`, skip the grid points within a grid step from the crossings already found.'
+            )
+        spec.input(
+            'max_core_hours', valid_type=orm.Float,
+            required=False,
+            help='Stop launching calculations and return partial results once the calculations of this workchain used this many core-hours.'
+            )
+        spec.input(
+            'max_kpoints', valid_type=orm.Int,
+            required=False,
+            help='Stop launching calculations and return partial results once this many k-points have been computed.'
+            )
+        spec.input_namespace(
+            'wannier',
+            required=False, populate_defaults=False,
+            help='If specified, search the crossings on the bands interpolated from a Wannier Hamiltonian.'
+            )
+        spec.input(
+            'wannier.hamiltonian', valid_type=orm.SinglefileData,
+            help='The `_hr.dat` file of a Wannier90 calculation.'
+            )
+        spec.input(
+            'wannier.num_occupied_bands', valid_type=orm.Int,
+            help='Number of occupied Wannier bands.'
+            )
+        spec.input(
+            'wannier.confirm_crossings', valid_type=orm.Bool,
+            default=orm.Bool(True),
+            help='If `True`, compute the bands of the crossings found on the interpolated bands with a DFT bands calculation.'
+            )
+        spec.input(
+            'wannier.confirm_gap_threshold', valid_type=orm.Float,
+            default=orm.Float(0.05),
+            help='Crossings with a DFT gap larger than this threshold are discarded.'
+            )
 
         # OUTLINE ############################################################################
         spec.outline(
@@ -133,19 +197,33 @@ class FindCrossingsWorkChain(WorkChain):
                 ),
             cls.setup_bands_loop,
             if_(cls.should_do_first_bands)(
-                cls.first_bands_step,
-                cls.inspect_bands,
+                if_(cls.should_interpolate)(
+                    cls.interpolate_bands,
+                ).else_(
+                    cls.first_bands_step,
+                    cls.inspect_bands,
+                    ),
             ).else_(
                 cls.start_from_scf
                 ),
             cls.analyze_bands,
             while_(cls.should_find_zero_gap)(
                 cls.setup_grid,
-                cls.run_bands,
-                cls.inspect_bands,
-                cls.analyze_bands,
+                if_(cls.should_run_grid)(
+                    if_(cls.should_interpolate)(
+                        cls.interpolate_bands,
+                    ).else_(
+                        cls.run_bands,
+                        cls.inspect_bands,
+                        ),
+                    cls.analyze_bands,
+                    ),
                 cls.stepper
                 ),
+            if_(cls.should_confirm_crossings)(
+                cls.run_confirm_crossings,
+                cls.inspect_confirm_crossings,
+                ),
             cls.results
             )
 
@@ -162,6 +240,10 @@ class FindCrossingsWorkChain(WorkChain):
             required=False,
             help='The structure produced by the relax calculation.'
             )
+        spec.output('cost', valid_type=orm.Dict,
+            required=False,
+            help='Breakdown of the core-hours and k-points spent by the calculations launched by this workchain.'
+            )
 
         # ERRORS ############################################################################
         spec.exit_code(312, 'ERROR_SUB_PROCESS_FAILED_RELAX',
@@ -170,6 +252,8 @@ class FindCrossingsWorkChain(WorkChain):
             message='the scf PwBaseWorkChain sub process failed')
         spec.exit_code(332, 'ERROR_SUB_PROCESS_FAILED_BANDS',
             message='the bands PwBaseWorkChain sub process failed')
+        spec.exit_code(342, 'ERROR_SUB_PROCESS_FAILED_CONFIRM',
+            message='the PwBaseWorkChain sub process confirming the crossings failed')
         # yapf: enable
 
     def setup(self):
@@ -183,6 +267,7 @@ class FindCrossingsWorkChain(WorkChain):
 
     def run_relax(self):
         """Run the PwRelaxWorkChain to run a relax PwCalculation."""
+        PwRelaxWorkChain = WorkflowFactory('quantumespresso.pw.relax')
         inputs = AttributeDict(
             self.exposed_inputs(PwRelaxWorkChain, namespace='relax'))
         inputs.structure = self.ctx.current_structure
@@ -222,6 +307,7 @@ class FindCrossingsWorkChain(WorkChain):
 
     def run_scf(self):
         """Run the PwBaseWorkChain in scf mode on the primitive cell of (optionally relaxed) input structure."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         inputs = AttributeDict(
             self.exposed_inputs(PwBaseWorkChain, namespace='scf'))
         inputs.clean_workdir = self.inputs.clean_workdir
@@ -256,6 +342,7 @@ class FindCrossingsWorkChain(WorkChain):
 
     def setup_bands_loop(self):
         """Perform initial setup for bands calculation loop."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         self.ctx.iteration = 0
         # self.ctx.max_iteration = self.inputs.max_iter
         if 'bands' in self.inputs:
@@ -289,7 +376,8 @@ class FindCrossingsWorkChain(WorkChain):
         else:
             self.ctx.dim = orm.Int(3)
 
-        self.ctx.found_crossings = []
+        self.ctx.lowgap_points = None
+        self.ctx.merged_crossings = None
         self.ctx.do_loop = True
         self.ctx.flag = False
 
@@ -306,6 +394,19 @@ class FindCrossingsWorkChain(WorkChain):
         )
         self.ctx.bands = self.ctx.workchain_scf.outputs.output_band
 
+        if not self.inputs.seed_from_scf.value:
+            return
+
+        seeds = get_lowgap_points_from_scf(self.ctx.bands, self.inputs.get('band_pairs', None))
+        gaps = seeds.get_array('gaps')
+        if not len(gaps):
+            self.report('Can\'t unfold the scf gap on the full kpoint mesh. Analyzing the scf bands directly.')
+            return
+
+        self.report('`{}` low-gap centers interpolated from the scf mesh (lowest estimated gap {:.4f} eV).'.format(
+            len(gaps), gaps.min()))
+        self.ctx.seeds = seeds
+
     def first_bands_step(self):
         """Do a bandcalculation using the kpoints provided in `starting_kpoints`."""
         self.ctx.iteration += 1
@@ -313,88 +414,105 @@ class FindCrossingsWorkChain(WorkChain):
         inputs = AttributeDict(deep_copy(self.ctx.inputs))
         inputs.kpoints = self.inputs.starting_kpoints
 
-        try:
-            kpt = inputs.kpoints.get_kpoints()
-        except:
-            kpt = inputs.kpoints.get_kpoints_mesh(print_list=True)
-        nkpt = len(kpt)
-        if 'settings' in inputs.pw:
-            settings = inputs.pw.settings.get_dict()
-            if 'cmdline' in settings:
-                ptr = settings['cmdline']
-                npools = None
-                if '-npools' in ptr:
-                    i = ptr.index('-npools')
-                    npools = int(ptr[i + 1])
-                elif '-nk' in ptr:
-                    i = ptr.index('-nk')
-                    npools = int(ptr[i + 1])
-
-                if not npools is None and npools > nkpt:
-                    self.report('WARNING: npools={} > nkpt={}'.format(
-                        npools, nkpt))
-                    for n in range(nkpt, 0, -1):
-                        if npools % n == 0:
-                            ptr[i + 1] = str(n)
-                            self.report('... reducing npools to {}.'.format(n))
-                            break
-
-                inputs.pw.settings = settings
-
-        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
-        running = self.submit(PwBaseWorkChain, **inputs)
+        submit_bands(self, inputs)
 
         self.report(
             'launching PwBaseWorkChain<{}> in {} mode, iteration {}'.format(
-                running.pk, 'bands', self.ctx.iteration))
+                ', '.join(str(node.pk) for node in get_bands_workchains(self)), 'bands', self.ctx.iteration))
 
-        return ToContext(workchain_bands=append_(running))
+    def set_parallelization(self, inputs):
+        """Set the pools/diagonalization flags of a bands calculation according to its number of kpoints."""
+        try:
+            nkpt = len(inputs.kpoints.get_kpoints())
+        except AttributeError:
+            nkpt = len(inputs.kpoints.get_kpoints_mesh(print_list=True))
+
+        layout = apply_pw_parallelization(inputs, nkpt)
+        if layout is not None:
+            self.report('Running {} kpoints with cmdline {}.'.format(nkpt, inputs.pw['settings']['cmdline']))
+
+    def should_interpolate(self):
+        """Determine if the bands should be interpolated from a Wannier Hamiltonian instead of computed by DFT."""
+        return 'wannier' in self.inputs
+
+    def interpolate_bands(self):
+        """Interpolate the bands from the Wannier Hamiltonian on the current kpoints."""
+        self.ctx.iteration += 1
+        if 'current_kpoints' in self.ctx:
+            kpoints = self.ctx.current_kpoints
+        else:
+            kpoints = self.inputs.starting_kpoints
+
+        res = get_interpolated_bands(
+            self.ctx.current_structure, self.inputs.wannier.hamiltonian, kpoints,
+            self.inputs.wannier.num_occupied_bands)
+
+        self.report('Interpolated bands from the Wannier Hamiltonian, iteration {}'.format(self.ctx.iteration))
+
+        self.ctx.bands = res['output_band']
 
     def should_find_zero_gap(self):
-        """Limit iterations over kpoints meshes."""
-        return self.ctx.do_loop
+        """Limit iterations over kpoints meshes and stop when the budget is used up."""
+        return self.ctx.do_loop and not is_budget_exhausted(self)
 
     def setup_grid(self):
         """Loop step to setup the new kpoint grid."""
         distance = orm.Float(self.ctx.current_kpoints_distance)
+        kwargs = {}
+        if self.inputs.exclude_found_crossings.value and len(self.ctx.merged_crossings.get_array('crossings')):
+            kwargs['exclude'] = self.ctx.merged_crossings
+
         self.ctx.current_kpoints = generate_cubic_grid(
-            self.ctx.current_structure, self.ctx.found_crossings[-1], distance,
-            self.ctx.dim)
+            self.ctx.current_structure, self.ctx.lowgap_points, distance,
+            self.ctx.dim, **kwargs)
+
+        if not isinstance(self.ctx.current_kpoints, orm.KpointsData):
+            self.report('All the grid points are close to crossings already found. iteration <{}>'.format(
+                self.ctx.iteration))
+            self.ctx.do_loop = False
+
+    def should_run_grid(self):
+        """Check if the grid has points left to compute."""
+        return self.ctx.do_loop
 
     def run_bands(self):
         """Run the band calculation."""
         self.ctx.iteration += 1
-        inputs = self.ctx.inputs
+        inputs = AttributeDict(deep_copy(self.ctx.inputs))
         inputs.kpoints = self.ctx.current_kpoints
 
-        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
-        running = self.submit(PwBaseWorkChain, **inputs)
+        submit_bands(self, inputs)
 
         self.report(
             'launching PwBaseWorkChain<{}> in {} mode, iteration {}'.format(
-                running.pk, 'bands', self.ctx.iteration))
-
-        return ToContext(workchain_bands=append_(running))
+                ', '.join(str(node.pk) for node in get_bands_workchains(self)), 'bands', self.ctx.iteration))
 
     def inspect_bands(self):
         """Verify that the PwBaseWorkChain for the bands run finished successfully."""
-        workchain = self.ctx.workchain_bands[self.ctx.iteration - 1]
+        workchain, bands = collect_bands(self)
 
-        if not workchain.is_finished_ok:
+        if workchain is not None:
             self.report(
                 'scf PwBaseWorkChain failed with exit status {}'.format(
                     workchain.exit_status))
             return self.exit_codes.ERROR_SUB_PROCESS_FAILED_BANDS
 
-        self.ctx.bands = workchain.outputs.output_band
+        self.ctx.bands = bands
 
     def analyze_bands(self):
         """Extract kpoints with gap lower than the gap threshold."""
-        bands = self.ctx.bands
+        if 'seeds' in self.ctx:
+            res = self.ctx.seeds
+            del self.ctx.seeds
+        else:
+            bands = self.ctx.bands
 
-        self.report('Analyzing bands results for BandsData<{}>'.format(
-            bands.pk))
-        res = get_crossing_and_lowgap_points(bands, self.inputs.gap_threshold)
+            self.report('Analyzing bands results for BandsData<{}>'.format(
+                bands.pk))
+            kwargs = {}
+            if 'band_pairs' in self.inputs:
+                kwargs['band_pairs'] = self.inputs.band_pairs
+            res = get_crossing_and_lowgap_points(bands, self.inputs.gap_threshold, **kwargs)
 
         pinned = res.get_array('pinned')
         found = res.get_array('found')
@@ -409,7 +527,14 @@ class FindCrossingsWorkChain(WorkChain):
                 format(self.ctx.iteration))
             self.ctx.do_loop = False
 
-        self.ctx.found_crossings.append(res)
+        self.ctx.lowgap_points = res
+
+        # Fold the new crossings into the ones found so far
+        if n_found or self.ctx.merged_crossings is None:
+            kwargs = {}
+            if self.ctx.merged_crossings is not None:
+                kwargs['crossings'] = self.ctx.merged_crossings
+            self.ctx.merged_crossings = update_crossing_results(self.ctx.current_structure, res, **kwargs)
 
     def stepper(self):
         """Perform the loop step operation of modifying the thresholds."""
@@ -426,28 +551,78 @@ class FindCrossingsWorkChain(WorkChain):
             self.report('Kpoints distance reduced to `{}`'.format(
                 self.ctx.current_kpoints_distance))
 
+    def merge_crossings(self):
+        """Return the crossings found in all the iterations, merged after every `analyze_bands`."""
+        if 'crossings' not in self.ctx:
+            self.ctx.crossings = self.ctx.merged_crossings
+
+        return self.ctx.crossings
+
+    def should_confirm_crossings(self):
+        """Determine if the crossings found on the interpolated bands should be checked by a DFT calculation."""
+        if not self.should_interpolate() or not self.inputs.wannier.confirm_crossings.value:
+            return False
+        if is_budget_exhausted(self):
+            return False
+
+        return len(self.merge_crossings().get_array('crossings')) > 0
+
+    def run_confirm_crossings(self):
+        """Run a bands calculation on the crossings found on the interpolated bands."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+        kpoints = orm.KpointsData()
+        kpoints.set_cell_from_structure(self.ctx.current_structure)
+        kpoints.set_kpoints(self.ctx.crossings.get_array('crossings'))
+
+        inputs = AttributeDict(deep_copy(self.ctx.inputs))
+        inputs.kpoints = kpoints
+        self.set_parallelization(inputs)
+
+        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
+        running = self.submit(PwBaseWorkChain, **inputs)
+
+        self.report('launching PwBaseWorkChain<{}> in {} mode to confirm {} crossings'.format(
+            running.pk, 'bands', len(kpoints.get_kpoints())))
+
+        return ToContext(workchain_confirm=running)
+
+    def inspect_confirm_crossings(self):
+        """Keep only the crossings confirmed by the DFT bands calculation."""
+        workchain = self.ctx.workchain_confirm
+
+        if not workchain.is_finished_ok:
+            self.report(
+                'confirm PwBaseWorkChain failed with exit status {}'.format(
+                    workchain.exit_status))
+            return self.exit_codes.ERROR_SUB_PROCESS_FAILED_CONFIRM
+
+        n_old = len(self.ctx.crossings.get_array('crossings'))
+        self.ctx.crossings = confirm_crossings(
+            self.ctx.crossings, workchain.outputs.output_band, self.inputs.wannier.confirm_gap_threshold)
+        self.report('{}/{} crossings confirmed by PwBaseWorkChain<{}>'.format(
+            len(self.ctx.crossings.get_array('crossings')), n_old, workchain.pk))
+
     def results(self):
         """Output the results for the workchain and handles possible faliures."""
-        calculation = self.ctx.workchain_bands[self.ctx.iteration - 1]
-
-        found = merge_crossing_results(
-            structure=self.ctx.current_structure,
-            **{
-                'found_{}'.format(n): array
-                for n, array in enumerate(self.ctx.found_crossings)
-            })
+        found = self.merge_crossings()
 
         n_found = len(found.get_array('crossings'))
         if self.ctx.flag and not n_found:
+            if self.should_interpolate():
+                last = 'interpolated bands'
+            else:
+                last = 'PwBaseWorkChain<{}>'.format(
+                    ', '.join(str(node.pk) for node in get_bands_workchains(self)))
             self.report(
-                'WARNING: No crossing found. Reached the minimum kpoints distance {}: last ran PwBaseWorkChain<{}>'
-                .format(self.ctx.min_kpoints_distance, calculation.pk))
+                'WARNING: No crossing found. Reached the minimum kpoints distance {}: last ran {}'
+                .format(self.ctx.min_kpoints_distance, last))
         if not self.ctx.do_loop and not n_found:
             self.report(
                 'WARNING: No crossing found. Did not find any low-gap points to continue loop. iteration <{}>'
                 .format(self.ctx.iteration))
 
         self.out('crossings', found)
+        attach_cost_output(self)
 
         self.report('FINISHED')
 
@@ -457,6 +632,8 @@ class Z2pack3DChernWorkChain(WorkChain):
     @classmethod
     def define(cls, spec):
         # yapf: disable
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         super().define(spec)
 
         # INPUTS ############################################################################
@@ -476,7 +653,22 @@ class Z2pack3DChernWorkChain(WorkChain):
         spec.input(
             'sphere_radius', valid_type=orm.Float,
             default=orm.Float(0.005),
-            help='Radius for the sphere of kpoints.'
+            help='Radius for the sphere of kpoints (maximum radius if `adaptive_sphere_radius` is `True`).'
+            )
+        spec.input(
+            'adaptive_sphere_radius', valid_type=orm.Bool,
+            default=orm.Bool(False),
+            help='If `True`, choose the radius of every sphere from the distance to the nearest crossing.'
+            )
+        spec.input(
+            'min_sphere_radius', valid_type=orm.Float,
+            default=orm.Float(0.001),
+            help='Minimum radius of the spheres if `adaptive_sphere_radius` is `True`.'
+            )
+        spec.input(
+            'group_crossings_distance', valid_type=orm.Float,
+            required=False,
+            help='Crossings closer than this distance (crystal coordinates) are wrapped in one sphere measuring their net chirality.'
             )
         spec.input(
             'scf_parent_folder', valid_type=orm.RemoteData,
@@ -488,6 +680,18 @@ class Z2pack3DChernWorkChain(WorkChain):
             default=orm.Bool(False),
             help='If `True`, work directories of all called calculation will be cleaned at the end of execution.'
             )
+        spec.input(
+            'max_core_hours', valid_type=orm.Float,
+            required=False,
+            help='Stop launching calculations and return partial results once the calculations of this workchain used this many core-hours. '
+                 'The remaining core-hours are the budget of the crossings search, unless `find.max_core_hours` is given.'
+            )
+        spec.input(
+            'max_kpoints', valid_type=orm.Int,
+            required=False,
+            help='Stop launching calculations and return partial results once this many k-points have been computed. '
+                 'The remaining k-points are the budget of the crossings search, unless `find.max_kpoints` is given.'
+            )
 
         spec.expose_inputs(
             FindCrossingsWorkChain, namespace='find',
@@ -545,6 +749,11 @@ class Z2pack3DChernWorkChain(WorkChain):
             'output_parameters', valid_type=orm.Dict,
             help='Dict resulting from a z2pack calculation.'
             )
+        spec.output(
+            'cost', valid_type=orm.Dict,
+            required=False,
+            help='Breakdown of the core-hours and k-points spent by the calculations launched by this workchain.'
+            )
         spec.expose_outputs(
             FindCrossingsWorkChain, namespace='find',
             exclude=('scf_remote_folder', ),
@@ -601,6 +810,14 @@ class Z2pack3DChernWorkChain(WorkChain):
         inputs.structure = self.ctx.current_structure
         inputs.code = self.inputs.pw_code
 
+        # The crossings search shares the budget of this workchain, unless it was given its own
+        if 'max_core_hours' in self.inputs or 'max_kpoints' in self.inputs:
+            cost = get_cost_breakdown(self.node)
+            if 'max_core_hours' in self.inputs and 'max_core_hours' not in inputs:
+                inputs.max_core_hours = orm.Float(max(self.inputs.max_core_hours.value - cost['core_hours'], 0.))
+            if 'max_kpoints' in self.inputs and 'max_kpoints' not in inputs:
+                inputs.max_kpoints = orm.Int(max(self.inputs.max_kpoints.value - cost['kpoints'], 0))
+
         running = self.submit(FindCrossingsWorkChain, **inputs)
 
         self.report('launching FindCrossingsWorkChain<{}>'.format(running.pk))
@@ -655,6 +872,7 @@ class Z2pack3DChernWorkChain(WorkChain):
 
     def run_scf(self):
         """Run the `scf` calculation."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         inputs = AttributeDict(
             self.exposed_inputs(PwBaseWorkChain, namespace='scf'))
         inputs.pw.structure = self.ctx.current_structure
@@ -686,6 +904,7 @@ class Z2pack3DChernWorkChain(WorkChain):
 
     def prepare_z2pack(self):
         """Prepare the inputs for the z2pack calculations."""
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         inputs = AttributeDict(
             self.exposed_inputs(Z2packBaseWorkChain, namespace='z2pack_base'))
         inputs.pw_code = self.inputs.pw_code
@@ -694,9 +913,21 @@ class Z2pack3DChernWorkChain(WorkChain):
 
         self.ctx.inputs = inputs
         self.ctx.iteration = 0
-        self.ctx.max_iteration = len(self.ctx.crossings)
 
-        self.ctx.workchain_z2pack = []
+        if self.inputs.adaptive_sphere_radius.value or 'group_crossings_distance' in self.inputs:
+            self.ctx.spheres_node = generate_chern_spheres(
+                self.ctx.crossings_node, self.inputs.sphere_radius, self.inputs.min_sphere_radius,
+                self.inputs.adaptive_sphere_radius, self.inputs.get('group_crossings_distance', orm.Float(0.))
+                )
+            self.ctx.centers = self.ctx.spheres_node.get_array('crossings')
+            self.ctx.radii = self.ctx.spheres_node.get_array('radii').tolist()
+            self.report('computing the chirality of {} crossings with {} spheres'.format(
+                len(self.ctx.crossings), len(self.ctx.centers)))
+        else:
+            self.ctx.spheres_node = self.ctx.crossings_node
+            self.ctx.centers = self.ctx.crossings
+            self.ctx.radii = [self.ctx.radius] * len(self.ctx.crossings)
+        self.ctx.max_iteration = len(self.ctx.centers)
 
     def should_do_alltogheter(self):
         """Check if the z2pack calculations can be run concurrently."""
@@ -714,13 +945,14 @@ class Z2pack3DChernWorkChain(WorkChain):
 
     def run_z2pack_all(self):
         """Launch the z2pack calculations all togheter."""
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         # yapf: disable
         old = self.ctx.inputs.z2pack.z2pack_settings.get_dict()
-        for cross in self.ctx.crossings:
+        for cross, radius in zip(self.ctx.centers, self.ctx.radii):
             old.update({
                 'dimension_mode': '3D',
                 'invariant': 'Chern',
-                'surface': 'z2pack.shape.Sphere(center=({0[0]:11.7f}, {0[1]:11.7f}, {0[2]:11.7f}), radius={1})'.format(cross, self.ctx.radius)
+                'surface': 'z2pack.shape.Sphere(center=({0[0]:11.7f}, {0[1]:11.7f}, {0[2]:11.7f}), radius={1})'.format(cross, radius)
             })
             self.ctx.inputs.z2pack.z2pack_settings = orm.Dict(dict=old)
 
@@ -730,11 +962,11 @@ class Z2pack3DChernWorkChain(WorkChain):
                 'launching Z2packBaseWorkChain<{}> on center {}'.format(
                     running.pk, cross))
 
-            self.to_context(workchain_z2pack=append_(running))
+            self.to_context(**{'workchain_z2pack_{}'.format(running.pk): running})
 
     def inspect_z2pack_all(self):
         """Verify that the Z2packBaseWorkChain finished successfully."""
-        for workchain in self.ctx.workchain_z2pack:
+        for workchain in get_called_processes(self.node, 'Z2packBaseWorkChain'):
             if not workchain.is_finished_ok:
                 self.report(
                     'Z2packBaseWorkChain failed with exit status {}'.format(
@@ -742,20 +974,22 @@ class Z2pack3DChernWorkChain(WorkChain):
                 return self.exit_codes.ERROR_SUB_PROCESS_FAILED_Z2PACK
 
     def do_z2pack_one(self):
-        """Loop check for running z2pack calculations 1by1."""
-        return self.ctx.iteration < self.ctx.max_iteration
+        """Loop check for running z2pack calculations 1by1, stopping when the budget is used up."""
+        return self.ctx.iteration < self.ctx.max_iteration and not is_budget_exhausted(self)
 
     def run_z2pack_one(self):
         """Launch the z2pack calculations one at a time."""
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         # yapf: disable
-        cross = self.ctx.crossings[self.ctx.iteration]
+        cross = self.ctx.centers[self.ctx.iteration]
+        radius = self.ctx.radii[self.ctx.iteration]
         self.ctx.iteration += 1
 
         old = self.ctx.inputs.z2pack.z2pack_settings.get_dict()
         old.update({
             'dimension_mode':'3D',
             'invariant':'Chern',
-            'surface':'z2pack.shape.Sphere(center=({0[0]:11.7f}, {0[1]:11.7f}, {0[2]:11.7f}), radius={1})'.format(cross, self.ctx.radius)
+            'surface':'z2pack.shape.Sphere(center=({0[0]:11.7f}, {0[1]:11.7f}, {0[2]:11.7f}), radius={1})'.format(cross, radius)
             })
         self.ctx.inputs.z2pack.z2pack_settings = orm.Dict(dict=old)
 
@@ -763,12 +997,12 @@ class Z2pack3DChernWorkChain(WorkChain):
 
         self.report('launching Z2packBaseWorkChain<{}> on center {}'.format(running.pk, cross))
 
-        return ToContext(workchain_z2pack=append_(running))
+        return ToContext(workchain_z2pack=running)
         # yapf: enable
 
     def inspect_z2pack_one(self):
         """Verify that the FindCrossingsWorkChain finished successfully."""
-        workchain = self.ctx.workchain_z2pack[-1]
+        workchain = self.ctx.workchain_z2pack
 
         if not workchain.is_finished_ok:
             self.report(
@@ -779,12 +1013,13 @@ class Z2pack3DChernWorkChain(WorkChain):
     def results(self):
         """Output the workchain results."""
         res = merge_chern_results(
-            crossings=self.ctx.crossings_node,
+            crossings=self.ctx.spheres_node,
             **{
                 'z2calcOut_{}'.format(n): calc.outputs.output_parameters
-                for n, calc in enumerate(self.ctx.workchain_z2pack)
+                for n, calc in enumerate(get_called_processes(self.node, 'Z2packBaseWorkChain'))
             })
 
         self.out('output_parameters', res)
+        attach_cost_output(self)
 
         self.report('FINISHED')
@@ -0,0 +1,115 @@
+"""Accounting of the computational cost of the calculations launched by the workchains."""
+from __future__ import absolute_import
+from aiida import orm
+from aiida.engine import calcfunction
+
+from ..calculations.utils.parallelization import get_num_mpiprocs
+
+
+def _get_num_kpoints(node):
+    """Return the number of k-points computed by a `CalcJobNode`.
+
+    For `PwCalculation` this is the size of the `kpoints` input, for `Z2packCalculation` the lower bound given by
+    the cost model, as the actual number of lines is not known from the outputs.
+    """
+    if 'kpoints' in node.inputs:
+        kpoints = node.inputs.kpoints
+        try:
+            return len(kpoints.get_kpoints())
+        except AttributeError:
+            mesh, _ = kpoints.get_kpoints_mesh()
+            return mesh[0] * mesh[1] * mesh[2]
+
+    if 'z2pack_settings' in node.inputs:
+        try:
+            return node.process_class.estimate_cost(node.inputs.z2pack_settings)['kpoints'][0]
+        except Exception:  # pylint: disable=broad-except
+            return 0
+
+    return 0
+
+
+def get_calcjob_cost(node):
+    """Return the core-hours and number of k-points spent by a `CalcJobNode`.
+
+    The wall time is taken from the scheduler (`last_job_info`) and, if not available, from the `wall_time_seconds`
+    key of the `output_parameters`. Calculations that did not run yet cost nothing.
+    """
+    seconds = None
+    job_info = node.get_last_job_info()
+    if job_info is not None:
+        seconds = getattr(job_info, 'wallclock_time_seconds', None)
+    if seconds is None:
+        try:
+            seconds = node.outputs.output_parameters['wall_time_seconds']
+        except (AttributeError, KeyError):
+            seconds = 0
+
+    resources = node.get_option('resources') or {}
+    num_mpiprocs = get_num_mpiprocs(resources, node.computer)
+
+    return seconds * num_mpiprocs / 3600., _get_num_kpoints(node)
+
+
+def get_cost_breakdown(process_node):
+    """Sum the cost of all the calculations called, directly or not, by a process.
+
+    :param process_node: the `ProcessNode` of the calling workchain.
+
+    :return: dictionary with the total `core_hours` and `kpoints`, and their breakdown by process label.
+    """
+    res = {'core_hours': 0., 'kpoints': 0, 'processes': {}}
+    for node in process_node.called_descendants:
+        if not isinstance(node, orm.CalcJobNode):
+            continue
+
+        core_hours, kpoints = get_calcjob_cost(node)
+
+        res['core_hours'] += core_hours
+        res['kpoints'] += kpoints
+
+        entry = res['processes'].setdefault(node.process_label, {'core_hours': 0., 'kpoints': 0, 'count': 0})
+        entry['core_hours'] += core_hours
+        entry['kpoints'] += kpoints
+        entry['count'] += 1
+
+    return res
+
+
+def is_budget_exhausted(workchain):
+    """Check the cost of the calculations launched by `workchain` against its `max_core_hours`/`max_kpoints` inputs.
+
+    :param workchain: a workchain instance defining the optional `max_core_hours` and `max_kpoints` inputs.
+
+    :return: `True` if any of the given budgets is used up.
+    """
+    inputs = workchain.inputs
+    if 'max_core_hours' not in inputs and 'max_kpoints' not in inputs:
+        return False
+
+    cost = get_cost_breakdown(workchain.node)
+
+    if 'max_core_hours' in inputs and cost['core_hours'] >= inputs.max_core_hours.value:
+        workchain.report('Budget of {} core-hours used up ({:.2f} spent). Stopping with partial results.'.format(
+            inputs.max_core_hours.value, cost['core_hours']))
+        return True
+
+    if 'max_kpoints' in inputs and cost['kpoints'] >= inputs.max_kpoints.value:
+        workchain.report('Budget of {} k-points used up ({} computed). Stopping with partial results.'.format(
+            inputs.max_kpoints.value, cost['kpoints']))
+        return True
+
+    return False
+
+
+@calcfunction
+def get_cost_report(breakdown):
+    """Return the cost breakdown of a workchain as an output node."""
+    return orm.Dict(dict=breakdown.get_dict())
+
+
+def attach_cost_output(workchain):
+    """Attach the cost breakdown of the calculations launched by `workchain` to its `cost` output."""
+    breakdown = orm.Dict(dict=get_cost_breakdown(workchain.node))
+
+    workchain.out('cost', get_cost_report(breakdown))
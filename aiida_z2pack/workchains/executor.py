@@ -0,0 +1,100 @@
+"""Process pool running the numerical kernels of the calcfunctions outside of the event loop of the daemon worker.
+
+The calcfunctions are still called from the workchain steps, so that their provenance is recorded as usual, but the
+heavy numerical part is submitted to a `concurrent.futures.ProcessPoolExecutor`. While waiting for the result the
+event loop of the worker keeps running, so that heartbeats and the other processes are not delayed.
+This requires a loop that can be entered again while running, as the one made reentrant by `nest_asyncio` in the
+aiida-core versions listed in `_TESTED_AIIDA_VERSIONS`: with any other loop (e.g. the tornado loop used before
+aiida-core v1.6) the kernels run inline.
+
+Note that while a step waits for a kernel the worker can run the steps of other processes and handle the RPCs it
+receives (e.g. `verdi process pause/kill`). The calling workchain is only checkpointed at the end of the step, so if
+it is interrupted the step is run again from its start when the process is reloaded.
+The number of processes of the pool is read from the `AIIDA_Z2PACK_KERNEL_WORKERS` environment variable:
+setting it to `0` runs the kernels inline.
+"""
+from __future__ import absolute_import
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+KERNEL_WORKERS_ENV = 'AIIDA_Z2PACK_KERNEL_WORKERS'
+_DEFAULT_KERNEL_WORKERS = 1
+# Range `[min, max)` of the aiida-core versions whose event loop is known to be reentrant
+_TESTED_AIIDA_VERSIONS = ((1, 6), (2, 0))
+
+_EXECUTOR = None
+
+
+def get_kernel_workers():
+    """Return the number of processes of the kernels pool."""
+    try:
+        return int(os.environ.get(KERNEL_WORKERS_ENV, _DEFAULT_KERNEL_WORKERS))
+    except ValueError:
+        return _DEFAULT_KERNEL_WORKERS
+
+
+def is_pool_supported():
+    """Return whether the installed aiida-core is one of the versions tested with the kernels pool."""
+    import aiida
+
+    version = tuple(int(part) for part in aiida.__version__.split('.')[:2])
+    return _TESTED_AIIDA_VERSIONS[0] <= version < _TESTED_AIIDA_VERSIONS[1]
+
+
+def get_kernel_executor():
+    """Return the process pool used to run the kernels, or `None` if the kernels must run inline."""
+    global _EXECUTOR  # pylint: disable=global-statement
+
+    workers = get_kernel_workers()
+    if workers <= 0 or not is_pool_supported():
+        return None
+
+    if _EXECUTOR is None:
+        # Forking a daemon worker would share its database connections and event loop with the children
+        _EXECUTOR = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    return _EXECUTOR
+
+
+def shutdown_kernel_executor():
+    """Shut down the process pool, if it was started."""
+    global _EXECUTOR  # pylint: disable=global-statement
+
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown()
+        _EXECUTOR = None
+
+
+def run_kernel(kernel, *args, **kwargs):
+    """Run `kernel(*args, **kwargs)` in the process pool and return its result.
+
+    If the event loop of the current thread is running, the result is waited for by entering it again. A running loop
+    that is not reentrant would be blocked by the wait as much as by the kernel itself, so the kernel runs inline.
+    The kernel runs inline also if the pool is broken (e.g. a process was killed).
+
+    :param kernel: picklable function defined at the module level.
+    """
+    executor = get_kernel_executor()
+    if executor is None:
+        return kernel(*args, **kwargs)
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    # Only the loops patched by `nest_asyncio` (as the ones of plumpy) can be entered again while running
+    if loop is not None and not getattr(loop, '_nest_patched', False):
+        return kernel(*args, **kwargs)
+
+    try:
+        future = executor.submit(kernel, *args, **kwargs)
+        if loop is None:
+            return future.result()
+        return loop.run_until_complete(asyncio.wrap_future(future, loop=loop))
+    except BrokenProcessPool:
+        shutdown_kernel_executor()
+        return kernel(*args, **kwargs)
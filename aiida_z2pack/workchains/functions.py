@@ -1,9 +1,10 @@
 """Collection of calcfunctions used by the workchains."""
 from __future__ import absolute_import
+import os
+from collections import OrderedDict
+
 import numpy as np
 from itertools import product
-from scipy.spatial import KDTree
-from sklearn.cluster import AgglomerativeClustering
 
 from aiida import orm
 from aiida.engine import calcfunction
@@ -11,6 +12,8 @@ from aiida.common.exceptions import InputValidationError
 from six.moves import range
 from six.moves import zip
 
+from .executor import run_kernel
+
 
 def recipr_base(base):
     """Generate reciprocal base basis vectors.
@@ -22,9 +25,101 @@ def recipr_base(base):
     return np.linalg.inv(base).T * 2 * np.pi
 
 
-def get_gap_array_from_PwCalc(calculation):
+# Maximum number of gap arrays kept in memory by `get_gap_array`
+_GAP_CACHE_SIZE = 8
+_GAP_CACHE = OrderedDict()
+
+
+def open_bands_array(bands_data):
+    """Return the `bands` array of a `BandsData` memory-mapped from the file in the repository.
+
+    If the file can't be mapped (e.g. the node is not stored or the repository is not on disk), the array is loaded.
+
+    :param bands_data: aiida.orm.BandsData node.
+    """
+    try:
+        with bands_data.open('bands.npy', mode='rb') as handle:
+            filename = os.fspath(handle.name)
+        return np.load(filename, mmap_mode='r')
+    except (AttributeError, TypeError, ValueError, OSError):
+        return bands_data.get_array('bands')
+
+
+def get_gap_array(bands_data, cb, vb):
+    """Get an array containing the difference in energy between the bands `cb` and `vb` of every k-point.
+
+    Only the two columns are read from the memory-mapped `bands` array. The gaps of stored nodes are cached and
+    shared by all the callers, hence the returned array is read-only.
+
+    :param bands_data: aiida.orm.BandsData node.
+    :param cb: index of the conduction band.
+    :param vb: index of the valence band.
+    """
+    return _get_cached_gaps(bands_data, (cb, vb), lambda bands: np.subtract(bands[:, cb], bands[:, vb]))
+
+
+def get_gap_arrays(bands_data, band_pairs):
+    """Get an array with the gaps of all the band pairs for every k-point.
+
+    The column of a pair `n` in `band_pairs` is the difference in energy between the bands `n + 1` and `n`.
+    All the columns needed are read in a single pass over the memory-mapped `bands` array. As for `get_gap_array`,
+    the returned array is cached and read-only.
+
+    :param bands_data: aiida.orm.BandsData node.
+    :param band_pairs: list with the indexes of the lower band of every pair of adjacent bands.
+
+    :return: np.array of shape `(num_kpoints, len(band_pairs))`.
+    """
+    band_pairs = tuple(int(n) for n in band_pairs)
+
+    def compute(bands):
+        columns = sorted(set(band_pairs) | set(n + 1 for n in band_pairs))
+        position = {col: i for i, col in enumerate(columns)}
+        selected = np.asarray(bands[:, columns])
+        upper = selected[:, [position[n + 1] for n in band_pairs]]
+        return upper - selected[:, [position[n] for n in band_pairs]]
+
+    return _get_cached_gaps(bands_data, ('pairs', ) + band_pairs, compute)
+
+
+def _get_cached_gaps(bands_data, key, compute):
+    """Return the gaps computed by `compute` from the memory-mapped bands of `bands_data`, caching stored nodes."""
+    key = (bands_data.uuid, ) + key
+    if bands_data.is_stored and key in _GAP_CACHE:
+        _GAP_CACHE.move_to_end(key)
+        return _GAP_CACHE[key]
+
+    bands = open_bands_array(bands_data)
+    gaps = compute(bands)
+    gaps.setflags(write=False)
+    del bands
+
+    if bands_data.is_stored:
+        _GAP_CACHE[key] = gaps
+        while len(_GAP_CACHE) > _GAP_CACHE_SIZE:
+            _GAP_CACHE.popitem(last=False)
+
+    return gaps
+
+
+def get_gap_array_from_PwCalc(calculation, band_pairs=None):
     """Get an array containing the difference in energy between valence and conduction bands.
 
+    :param calculation: aiida.orm.CalcJob node of a pw calculation.
+    :param band_pairs: optional list with the indexes of the lower band of the pairs of adjacent bands. If given,
+                       the gaps of all the pairs are returned as the columns of a 2D array.
+    """
+    if band_pairs is not None:
+        return get_gap_arrays(calculation.outputs.output_band, band_pairs)
+
+    vb = get_valence_band(calculation)
+
+    return get_gap_array(calculation.outputs.output_band, vb + 1, vb)
+
+
+def get_valence_band(calculation):
+    """Return the index of the highest valence band of a pw calculation.
+
     :param calculation: aiida.orm.CalcJob node of a pw calculation.
     """
     params = calculation.outputs.output_parameters
@@ -32,13 +127,71 @@ def get_gap_array_from_PwCalc(calculation):
     n_el = params['number_of_electrons']
     spin = params['spin_orbit_calculation']
 
-    cb = int(n_el) // (int(not spin) + 1)
-    vb = cb - 1
+    return int(n_el) // (int(not spin) + 1) - 1
+
+
+def get_pair_gap_array(calculation, pairs=None):
+    """Get an array with the gap of every k-point, computed for the band pair of the k-point.
+
+    :param calculation: aiida.orm.CalcJob node of a pw calculation.
+    :param pairs: optional np.array with the index of the lower band of the pair of every k-point. The pair `-1`
+                  (crossings merged from a search without `band_pairs`) stands for the valence band. If not given,
+                  the gap between valence and conduction bands is returned.
+    """
+    if pairs is None:
+        return get_gap_array_from_PwCalc(calculation)
+
+    pairs = np.where(pairs < 0, get_valence_band(calculation), pairs)
+    columns = np.unique(pairs)
+    gaps = get_gap_array_from_PwCalc(calculation, columns.tolist())
+
+    return gaps[np.arange(len(pairs)), np.searchsorted(columns, pairs)]
+
 
-    bands_data = calculation.outputs.output_band
-    bands = bands_data.get_bands()
+def get_mesh_points_in_spheres(mesh, offset, recipr, centers, radius, max_chunk_bytes=2**28):
+    """Return the points of a mesh within `radius` from any of the centers, without building the full mesh.
 
-    return bands[:, cb] - bands[:, vb]
+    Only the indexes inside the bounding box of every sphere are enumerated, in slabs along the first axis, so the
+    memory scales with the size of the spheres and not with the one of the mesh.
+
+    :param mesh: list of the number of points of the mesh along the reciprocal lattice vectors.
+    :param offset: list with the offset of the mesh in units of the mesh spacing.
+    :param recipr: np.array of reciprocal basis vector as rows.
+    :param centers: np.array of the centers of the spheres in crystal coordinates.
+    :param radius: radius of the spheres in cartesian units.
+    :param max_chunk_bytes: maximum size of the cartesian coordinates of a slab.
+
+    :return: np.array of the points in crystal coordinates, in the same order of `get_kpoints_mesh(print_list=True)`.
+    """
+    mesh = np.array(mesh, dtype=np.int64)
+    offset = np.array(offset, dtype=np.float)
+    centers = np.atleast_2d(centers)
+
+    # Half size of the box containing the sphere along every crystal coordinate
+    half = radius * np.linalg.norm(np.linalg.inv(recipr), axis=0)
+
+    found = [np.empty(0, dtype=np.int64)]
+    for center in centers:
+        low = np.maximum(np.floor((center - half) * mesh - offset).astype(np.int64), 0)
+        high = np.minimum(np.ceil((center + half) * mesh - offset).astype(np.int64), mesh - 1)
+        if np.any(high < low):
+            continue
+
+        size = high - low + 1
+        step = max(max_chunk_bytes // (24 * size[1] * size[2]), 1)
+        for start in range(low[0], high[0] + 1, step):
+            axes = [np.arange(start, min(start + step, high[0] + 1))]
+            axes += [np.arange(low[n], high[n] + 1) for n in (1, 2)]
+            idx = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+            dist = np.linalg.norm(np.dot((idx + offset) / mesh - center, recipr), axis=1)
+            idx = idx[dist <= radius]
+            found.append((idx[:, 0] * mesh[1] + idx[:, 1]) * mesh[2] + idx[:, 2])
+
+    # Removing the points shared by more spheres and sorting them as in the full mesh
+    found = np.unique(np.concatenate(found))
+    idx = np.stack([found // (mesh[1] * mesh[2]), (found // mesh[2]) % mesh[1], found % mesh[2]], axis=1)
+
+    return (idx + offset) / mesh
 
 
 @calcfunction
@@ -72,61 +225,37 @@ def crop_kpoints(structure, kpt_data, centers, radius):
             'Invalide shape {} for array `centers`. Expected (*,3)'.format(
                 centers.shape))
 
-    r = radius.value
     cell = np.array(structure.cell)
     recipr = recipr_base(cell)
+    mesh, offset = kpt_data.get_kpoints_mesh()
 
     try:
-        kpt_cryst = np.array(kpt_data.get_kpoints_mesh(print_list=True))
+        kpt_cryst = get_mesh_points_in_spheres(mesh, offset, recipr, centers, radius.value)
     except MemoryError:
         return orm.Bool(False)
-    kpt_cart = np.dot(kpt_cryst, recipr)
-
-    c_cryst = centers
-    c_cart = np.dot(c_cryst, recipr)
-
-    kpt_cart = KDTree(kpt_cart)
-    centers = KDTree(c_cart)
-
-    query = kpt_cart.query_ball_tree(centers, r=r)
-
-    where = [n for n, l in enumerate(query) if len(l)]
 
     new = orm.KpointsData()
-    new.set_kpoints(kpt_cryst[where])
+    new.set_kpoints(kpt_cryst)
 
     return new
 
 
-@calcfunction
-def generate_cubic_grid(structure, centers, distance, dim):
-    """Generate a cubic grids centered in `centers` of size `distance` and dimensionality `dim`.
+def get_cubic_grid_points(centers, distance, dim, npoints=5, exclude=None):
+    """Return the points of the cubic grids of lateral size `distance` centered in `centers`.
 
-    :param structure: aiida.orm.StructureData node  used to get the cell of the material.
-    :param centers: aiida.orm.ArrayData containing an array named `centers`.
-                    Each element of `centers` is used to generate a cubic grid around it.
-    :param distance: aiida.orm.Float indicating the lateral size of the cubic grid.
-    :param dim: aiida.orm.Int determining the dimensionality of the grid.
-                e.g.: dim=1 -> 5x1x1   dim = 2 -> 5x5x1   dim = 3 -> 5x5x5
+    The points of a grid closer than a grid step to the ones of the previous grids are skipped.
 
-    :return: aiida.orm.KpointsData containing the generated grids.
-    """
-    if not isinstance(structure, orm.StructureData):
-        raise InputValidationError(
-            'Invalide type {} for parameter `structure`'.format(
-                type(structure)))
-    if not isinstance(centers, orm.ArrayData):
-        raise InputValidationError(
-            'Invalide type {} for parameter `centers`'.format(type(centers)))
-    if not isinstance(distance, orm.Float):
-        raise InputValidationError(
-            'Invalide type {} for parameter `distance`'.format(type(distance)))
-
-    npoints = 5
+    :param centers: np.array of the centers of the grids in cartesian coordinates.
+    :param distance: lateral size of the grids.
+    :param dim: dimensionality of the grids.
+    :param npoints: number of points along every direction of the grids.
+    :param exclude: np.array of points in cartesian coordinates. The grid points within a grid step from them are
+                    skipped.
 
-    centers = centers.get_array('pinned')
-    dist = distance.value / (npoints - 1)
-    dim = dim.value
+    :return: np.array of the points in cartesian coordinates.
+    """
+    from scipy.spatial import KDTree, cKDTree
+    dist = distance / (npoints - 1)
 
     # yapf: disable
     l    = np.arange(-(npoints-1)//2, (npoints-1)//2 + 1) + ((npoints + 1)%2) * 0.5
@@ -150,18 +279,170 @@ def generate_cubic_grid(structure, centers, distance, dim):
 
         if len(attach):
             res = np.vstack((res, attach))
+    # yapf: enable
+
+    if exclude is not None and len(exclude) and len(res):
+        # Small tolerance to skip also the points at exactly a grid step
+        nearest, _ = cKDTree(exclude).query(res, distance_upper_bound=dist * 1.001)
+        res = res[np.isinf(nearest)]
+
+    return res
+
+
+@calcfunction
+def generate_cubic_grid(structure, centers, distance, dim, exclude=None):
+    """Generate a cubic grids centered in `centers` of size `distance` and dimensionality `dim`.
+
+    :param structure: aiida.orm.StructureData node  used to get the cell of the material.
+    :param centers: aiida.orm.ArrayData containing an array named `centers`.
+                    Each element of `centers` is used to generate a cubic grid around it.
+    :param distance: aiida.orm.Float indicating the lateral size of the cubic grid.
+    :param dim: aiida.orm.Int determining the dimensionality of the grid.
+                e.g.: dim=1 -> 5x1x1   dim = 2 -> 5x5x1   dim = 3 -> 5x5x5
+    :param exclude: aiida.orm.ArrayData containing an array named `crossings` in crystal coordinates.
+                    The grid points within a grid step from them are skipped.
+
+    :return: aiida.orm.KpointsData containing the generated grids, or aiida.orm.Bool(False) if all the points
+             were skipped.
+    """
+    if not isinstance(structure, orm.StructureData):
+        raise InputValidationError(
+            'Invalide type {} for parameter `structure`'.format(
+                type(structure)))
+    if not isinstance(centers, orm.ArrayData):
+        raise InputValidationError(
+            'Invalide type {} for parameter `centers`'.format(type(centers)))
+    if not isinstance(distance, orm.Float):
+        raise InputValidationError(
+            'Invalide type {} for parameter `distance`'.format(type(distance)))
+
+    if exclude is not None:
+        exclude = np.dot(exclude.get_array('crossings'), recipr_base(structure.cell))
+
+    res = run_kernel(get_cubic_grid_points, centers.get_array('pinned'), distance.value, dim.value, exclude=exclude)
+    if not len(res):
+        return orm.Bool(False)
 
     kpt = orm.KpointsData()
     kpt.set_cell_from_structure(structure)
     kpt.set_kpoints(res, cartesian=True)
 
     return kpt
-    # yapf: enable
+
+
+def get_lowgap_thresholds(min_gaps, kth_gaps, scale):
+    """Return the gap threshold of every center.
+
+    The threshold is obtained by shrinking `scale` by 2% until at most `lim` points of the neighbourhood of the
+    center are below `min_gap * scale`, with `1.0001` as the lowest scale.
+
+    :param min_gaps: np.array with the minimum gap in the neighbourhood of every center.
+    :param kth_gaps: np.array with the `lim + 1`-th smallest gap in the neighbourhood of every center (`inf` if
+                     there are less points).
+    :param scale: starting scale, either a float or a np.array with one value per center.
+
+    :return: np.array with the thresholds. The selected points are the ones with `gap < threshold`.
+    """
+    scale = np.broadcast_to(np.array(scale, dtype=np.float), min_gaps.shape).copy()
+    thresholds = min_gaps * 1.0001
+
+    # The shrinking stops at the first scale where at most `lim` points are selected, i.e. `threshold <= kth_gap`
+    pending = np.isfinite(scale) & (scale * 0.98 >= 1.0001)
+    while pending.any():
+        current = min_gaps * scale
+        done = pending & (current <= kth_gaps)
+        thresholds[done] = current[done]
+        scale *= 0.98
+        pending &= ~done & (scale * 0.98 >= 1.0001)
+
+    return thresholds
+
+
+def select_lowgap_points(query, gaps, lim, scale=None):
+    """Select the points with the lowest gap in the neighbourhood of every center.
+
+    :param query: list with the indexes of the points in the neighbourhood of every center.
+    :param gaps: np.array with the gap of all the points.
+    :param lim: maximum number of points selected for every center, unless they have the same gap within 0.01%.
+    :param scale: starting ratio between the highest gap selected and the minimum one. If `None` it is chosen
+                  to select the points with `gap < 0.25`.
+
+    :return: np.array with the unique indexes of the selected points.
+    """
+    query = [np.asarray(q, dtype=np.int) for q in query if len(q)]
+    if not query:
+        return np.array([], dtype=np.int)
+
+    # Padded layout of the neighbourhoods: one row per center
+    lengths = np.array([len(q) for q in query])
+    rows = np.repeat(np.arange(len(query)), lengths)
+    cols = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    flat = np.concatenate(query)
+    indexes = np.full((len(query), lengths.max()), -1, dtype=np.int)
+    indexes[rows, cols] = flat
+    padded = np.full(indexes.shape, np.inf)
+    padded[rows, cols] = gaps[flat]
+
+    min_gaps = padded.min(axis=1)
+    if lim < padded.shape[1]:
+        kth_gaps = np.partition(padded, lim, axis=1)[:, lim]
+    else:
+        kth_gaps = np.full(len(query), np.inf)
+
+    if scale is None:
+        with np.errstate(divide='ignore'):
+            scale = 0.25 / min_gaps
+
+    thresholds = get_lowgap_thresholds(min_gaps, kth_gaps, scale)
+
+    return np.unique(indexes[padded < thresholds[:, None]])
+
+
+def find_lowgap_points(kpt_cart, gaps, last_pinned, dist, gap_thr):
+    """Find the crossings and the low-gap points in the neighbourhood of the previous pinned centers.
+
+    :param kpt_cart: np.array of the k-points in cartesian coordinates.
+    :param gaps: np.array with the gap of all the k-points, with one column per band pair if 2D.
+    :param last_pinned: np.array of the centers of the grids in cartesian coordinates.
+    :param dist: lateral size of the grids (`200` if the k-points were not generated around pinned centers).
+    :param gap_thr: gap below which a point is considered a crossing.
+
+    :return: tuple with the lists of the indexes of the crossings and of the new pinned points of every pair.
+    """
+    from scipy.spatial import cKDTree
+    kpt_tree = cKDTree(kpt_cart)
+    query = kpt_tree.query_ball_point(last_pinned, r=dist * 1.74 / 2, workers=-1)  #~sqrt(3) / 2
+
+    # Limiting fermi velocity to ~ v_f[graphene] * 3
+    # GAP ~< dK * 10 / (#PT - 1)
+    pinned_thr = dist * 4.00
+
+    # Limiting number of new points per lowgap center based on distance between points
+    lim = max(-5 // np.log10(dist), 1) if dist < 1 else 200
+    if dist < 0.01:
+        lim = 1
+    scale = 2.5 if lim > 1 else 1.001
+    if dist == 200:
+        scale = None
+
+    # The neighbourhoods are shared by all the band pairs
+    where_found, where_pinned = [], []
+    for column in np.reshape(gaps, (len(gaps), -1)).T:
+        where = select_lowgap_points(query, column, int(lim), scale)
+        where_found.append(where[column[where] <= gap_thr])
+        where_pinned.append(where[(column[where] > gap_thr) & (column[where] < pinned_thr)])
+
+    return where_found, where_pinned
 
 
 @calcfunction
-def get_crossing_and_lowgap_points(bands_data, gap_threshold):
-    """Extract the low-gap points and crossings from the output of a `bands` calculation."""
+def get_crossing_and_lowgap_points(bands_data, gap_threshold, band_pairs=None):
+    """Extract the low-gap points and crossings from the output of a `bands` calculation.
+
+    If `band_pairs` (aiida.orm.List with the indexes of the lower band of pairs of adjacent bands) is given, the
+    points are searched for every pair: the `pinned` points of all pairs are joined and the pair of every `found`
+    point is stored in the `found_pairs` array.
+    """
     if not isinstance(bands_data, orm.BandsData):
         raise InputValidationError(
             'Invalide type {} for parameter `bands_data`'.format(
@@ -171,8 +452,10 @@ def get_crossing_and_lowgap_points(bands_data, gap_threshold):
             'Invalide type {} for parameter `gap_threshold`'.format(
                 type(gap_threshold)))
 
+    pairs = None if band_pairs is None else band_pairs.get_list()
+
     calculation = bands_data.creator
-    gaps = get_gap_array_from_PwCalc(calculation)
+    gaps = get_gap_array_from_PwCalc(calculation, pairs)
     kpt_cryst = bands_data.get_kpoints()
     kpt_cart = bands_data.get_kpoints(cartesian=True)
     gap_thr = gap_threshold.value
@@ -185,64 +468,286 @@ def get_crossing_and_lowgap_points(bands_data, gap_threshold):
         dist = 200
         last_pinned = np.array([[0., 0., 0.]])
 
-    centers = KDTree(last_pinned)
-    kpt_tree = KDTree(kpt_cart)
-    query = centers.query_ball_tree(kpt_tree, r=dist * 1.74 / 2)  #~sqrt(3) / 2
+    where_found, where_pinned = run_kernel(find_lowgap_points, kpt_cart, gaps, last_pinned, dist, gap_thr)
 
-    # Limiting fermi velocity to ~ v_f[graphene] * 3
-    # GAP ~< dK * 10 / (#PT - 1)
-    pinned_thr = dist * 4.00
+    res = orm.ArrayData()
+    res.set_array('pinned', kpt_cart[np.unique(np.concatenate(where_pinned))])
+    res.set_array('found', kpt_cryst[np.concatenate(where_found)])
+    if pairs is not None:
+        res.set_array('found_pairs', np.repeat(pairs, [len(where) for where in where_found]).astype(np.int))
 
-    # Limiting number of new points per lowgap center based on distance between points
-    lim = max(-5 // np.log10(dist), 1) if dist < 1 else 200
-    if dist < 0.01:
-        lim = 1
-    where_pinned = []
-    where_found = []
-    for n, q in enumerate(query):
-        q = np.array(q, dtype=np.int)
+    return res
 
-        if len(q) == 0:
-            continue
 
-        min_gap = gaps[q].min()
-
-        # Skipping points where the gap didn't move much between iterations
-        # _, i = kpt_tree.query(last_pinned[n])
-        # prev_min_gap = gaps[i]
-        # if min_gap / prev_min_gap > 0.95 and dist < 0.005:
-        #     continue
-
-        app = None
-        scale = 2.5 if lim > 1 else 1.001
-        if dist == 200:
-            scale = 0.25 / min_gap
-        while app is None or len(app) > lim:
-            app = np.where(gaps[q] < min_gap * scale)[0]
-            scale *= 0.98
-            if scale < 1.0001:
-                app = np.where(gaps[q] < min_gap * 1.0001)[0]
-                break
-        where_found.extend([q[i] for i in app if gaps[q[i]] <= gap_thr])
-        where_pinned.extend(
-            [q[i] for i in app if gap_thr < gaps[q[i]] < pinned_thr])
-
-    # Removing dupicates and avoid exception for empty list
-    where_pinned = np.array(where_pinned, dtype=np.int)
-    where_pinned = np.unique(where_pinned)
-    where_found = np.array(where_found, dtype=np.int)
-    where_found = np.unique(where_found)
+# Upsampling of the scf mesh used to look for the minima of the interpolated gap and maximum number of minima kept
+_SEED_UPSAMPLING = 4
+_SEED_MAX_CENTERS = 20
+
+
+def get_structure_rotations(structure, symprec=1.E-5):
+    """Return the rotations in direct crystal coordinates of the space group of a `StructureData`.
+
+    Only the identity is returned if `spglib` is not available.
+    """
+    try:
+        import spglib
+    except ImportError:
+        return np.eye(3, dtype=np.int)[None]
+
+    ase = structure.get_ase()
+    kinds = {name: n for n, name in enumerate(structure.get_kind_names())}
+    numbers = [kinds[site.kind_name] for site in structure.sites]
+    symmetry = spglib.get_symmetry((ase.cell, ase.get_scaled_positions(), numbers), symprec=symprec)
+
+    if symmetry is None:
+        return np.eye(3, dtype=np.int)[None]
+
+    return symmetry['rotations']
+
+
+def unfold_mesh_values(kpt_cryst, values, mesh, offset, rotations, tol=1.E-4):
+    """Unfold the values computed on the irreducible points of a Monkhorst-Pack mesh to the full mesh.
+
+    The values are assumed invariant under the rotations (in direct crystal coordinates) and time reversal.
+
+    :return: array with the shape of the mesh, or `None` if some point of the mesh can't be reached.
+    """
+    mesh = np.array(mesh, dtype=np.int)
+    offset = np.array(offset, dtype=np.float)
+    res = np.full(mesh, np.nan)
+
+    # Rotations act on the reciprocal crystal coordinates with the transpose; time reversal only where needed
+    rotations = np.asarray(rotations, dtype=np.int)
+    for sign in (1, -1):
+        for rot in rotations:
+            kpt = sign * np.dot(kpt_cryst, rot)
+            idx = kpt * mesh - offset
+            on_mesh = np.all(np.abs(idx - np.round(idx)) < tol, axis=1)
+            idx = np.mod(np.round(idx[on_mesh]).astype(np.int), mesh)
+            target = res[idx[:, 0], idx[:, 1], idx[:, 2]]
+            res[idx[:, 0], idx[:, 1], idx[:, 2]] = np.where(np.isnan(target), values[on_mesh], target)
+
+    if np.isnan(res).any():
+        return None
+
+    return res
+
+
+def fourier_upsample(values, factor):
+    """Interpolate a periodic function sampled on a regular mesh on a `factor` times denser mesh.
+
+    Axes with a single point are not upsampled.
+    """
+    values = np.asarray(values)
+    shape = np.array(values.shape)
+    new_shape = np.where(shape > 1, shape * factor, 1)
+
+    coeffs = np.fft.fftn(values)
+    new_coeffs = np.zeros(new_shape, dtype=np.complex)
+    idx = [np.mod(np.round(np.fft.fftfreq(n, 1. / n)).astype(np.int), m) for n, m in zip(shape, new_shape)]
+    new_coeffs[np.ix_(*idx)] = coeffs
+
+    return np.fft.ifftn(new_coeffs).real * new_shape.prod() / shape.prod()
+
+
+def find_periodic_minima(values):
+    """Return the indexes of the local minima of a periodic function sampled on a regular mesh."""
+    mask = np.ones(values.shape, dtype=bool)
+    steps = [(-1, 0, 1) if n > 1 else (0, ) for n in values.shape]
+    for shift in product(*steps):
+        if any(shift):
+            mask &= values <= np.roll(values, shift, axis=(0, 1, 2))
+
+    return np.argwhere(mask)
+
+
+@calcfunction
+def get_lowgap_points_from_scf(bands_data, band_pairs=None):
+    """Interpolate the gap of an scf calculation and use its minima as the starting low-gap points.
+
+    The gap on the irreducible kpoints is unfolded to the full mesh, Fourier-interpolated on a denser mesh and its
+    local minima (at most `_SEED_MAX_CENTERS`, lowest first) are returned as the `pinned` points.
+    If `band_pairs` (aiida.orm.List) is given, the smallest gap among the pairs is used.
+
+    :return: ArrayData with the `pinned` (cartesian) and `found` points in the format of
+        `get_crossing_and_lowgap_points` and the interpolated `gaps` of the pinned points.
+        No points are returned if the scf used an explicit list of kpoints or if the gap can not be unfolded on the
+        full mesh.
+    """
+    calculation = bands_data.creator
+
+    res = orm.ArrayData()
+    res.set_array('found', np.empty((0, 3)))
+
+    try:
+        mesh, offset = calculation.inputs.kpoints.get_kpoints_mesh()
+    except AttributeError:
+        grid = None
+    else:
+        if band_pairs is None:
+            gaps = get_gap_array_from_PwCalc(calculation)
+        else:
+            gaps = get_gap_array_from_PwCalc(calculation, band_pairs.get_list()).min(axis=1)
+        rotations = get_structure_rotations(calculation.inputs.structure)
+        grid = unfold_mesh_values(bands_data.get_kpoints(), gaps, mesh, offset, rotations)
+
+    if grid is None:
+        res.set_array('pinned', np.empty((0, 3)))
+        res.set_array('gaps', np.empty((0, )))
+        return res
+
+    fine = fourier_upsample(grid, _SEED_UPSAMPLING)
+    minima = find_periodic_minima(fine)
+    fine_gaps = fine[tuple(minima.T)]
+    order = np.argsort(fine_gaps)[:_SEED_MAX_CENTERS]
+
+    mesh = np.array(mesh)
+    kpt_cryst = (minima[order] + np.array(offset) * fine.shape / mesh) / fine.shape
+
+    kpt = orm.KpointsData()
+    kpt.set_cell(bands_data.cell)
+    kpt.set_kpoints(kpt_cryst)
+
+    res.set_array('pinned', kpt.get_kpoints(cartesian=True))
+    res.set_array('gaps', np.clip(fine_gaps[order], 0, None))
+
+    return res
+
+
+def parse_wannier_hr(content):
+    """Parse the content of a Wannier90 `_hr.dat` file.
+
+    :param content: string with the content of the file.
+
+    :return: tuple with the lattice vectors (nR, 3), their degeneracies (nR,) and the hoppings (nR, nwann, nwann).
+    """
+    lines = content.splitlines()
+    num_wann = int(lines[1])
+    nrpts = int(lines[2])
+    ndeg_lines = -(-nrpts // 15)
+
+    deg = np.array(' '.join(lines[3:3 + ndeg_lines]).split(), dtype=np.int)
+    data = np.array(' '.join(lines[3 + ndeg_lines:]).split(), dtype=np.float).reshape(-1, 7)
+
+    irpt = np.repeat(np.arange(nrpts), num_wann**2)
+    row = data[:, 3].astype(np.int) - 1
+    col = data[:, 4].astype(np.int) - 1
+
+    hoppings = np.zeros((nrpts, num_wann, num_wann), dtype=np.complex)
+    hoppings[irpt, row, col] = data[:, 5] + 1j * data[:, 6]
+
+    return data[::num_wann**2, :3].astype(np.int), deg, hoppings
+
+
+def interpolate_wannier_bands(kpt_cryst, rvec, deg, hoppings, max_chunk_bytes=2**28):
+    """Compute the eigenvalues of a Wannier Hamiltonian on a list of kpoints.
+
+    The Hamiltonians are built and diagonalized in batches, limiting the memory used by each batch.
+
+    :param kpt_cryst: np.array (nk, 3) of kpoints in crystal coordinates.
+    :param rvec: np.array (nR, 3) of lattice vectors in crystal coordinates.
+    :param deg: np.array (nR,) of degeneracies of the lattice vectors.
+    :param hoppings: np.array (nR, nwann, nwann) of the Hamiltonian matrix elements.
+    :param max_chunk_bytes: maximum size of the Hamiltonians of a batch.
+
+    :return: np.array (nk, nwann) of sorted eigenvalues.
+    """
+    kpt_cryst = np.array(kpt_cryst, dtype=np.float).reshape(-1, 3)
+    num_wann = hoppings.shape[1]
+    weighted = hoppings / deg[:, None, None]
+
+    chunk = max(1, max_chunk_bytes // (16 * num_wann**2))
+    res = np.empty((len(kpt_cryst), num_wann))
+    for start in range(0, len(kpt_cryst), chunk):
+        kpt = kpt_cryst[start:start + chunk]
+        phases = np.exp(2j * np.pi * np.dot(kpt, rvec.T))
+        ham_k = np.tensordot(phases, weighted, axes=(1, 0))
+        res[start:start + chunk] = np.linalg.eigvalsh(ham_k)
+
+    return res
+
+
+@calcfunction
+def get_interpolated_bands(structure, hamiltonian, kpoints, num_occupied_bands):
+    """Interpolate the bands of a Wannier Hamiltonian on a set of kpoints.
+
+    The outputs mimic the ones of a `PwCalculation`, so that the bands can be analyzed by
+    `get_crossing_and_lowgap_points`: every occupied Wannier band counts as one electron.
+
+    :param structure: aiida.orm.StructureData used to set the cell of the bands.
+    :param hamiltonian: aiida.orm.SinglefileData of a Wannier90 `_hr.dat` file.
+    :param kpoints: aiida.orm.KpointsData with the kpoints (list or mesh) where to interpolate the bands.
+    :param num_occupied_bands: aiida.orm.Int number of occupied Wannier bands.
+
+    :return: dictionary with the `output_band` BandsData and the `output_parameters` Dict.
+    """
+    if not isinstance(hamiltonian, orm.SinglefileData):
+        raise InputValidationError(
+            'Invalide type {} for parameter `hamiltonian`'.format(
+                type(hamiltonian)))
+    if not isinstance(kpoints, orm.KpointsData):
+        raise InputValidationError(
+            'Invalide type {} for parameter `kpoints`'.format(type(kpoints)))
+
+    with hamiltonian.open() as handle:
+        rvec, deg, hoppings = parse_wannier_hr(handle.read())
+
+    try:
+        kpt_cryst = kpoints.get_kpoints()
+    except AttributeError:
+        kpt_cryst = np.array(kpoints.get_kpoints_mesh(print_list=True))
+
+    eig = interpolate_wannier_bands(kpt_cryst, rvec, deg, hoppings)
+
+    bands = orm.BandsData()
+    bands.set_cell_from_structure(structure)
+    bands.set_kpoints(kpt_cryst)
+    bands.set_bands(eig, units='eV')
+
+    params = orm.Dict(dict={
+        'number_of_electrons': float(num_occupied_bands.value),
+        'spin_orbit_calculation': True,
+        })
+
+    return {'output_band': bands, 'output_parameters': params}
+
+
+@calcfunction
+def confirm_crossings(crossings, bands_data, gap_threshold):
+    """Keep only the crossings where the gap computed by a `bands` calculation is lower than `gap_threshold`.
+
+    :param crossings: aiida.orm.ArrayData with the `crossings` array in crystal coordinates, and optionally the
+                      `pairs` array with the band pair of every crossing.
+    :param bands_data: aiida.orm.BandsData computed on the crossings, in the same order.
+    :param gap_threshold: aiida.orm.Float threshold on the gap.
+
+    :return: aiida.orm.ArrayData with the confirmed `crossings` and their `gaps` (and `pairs`).
+    """
+    if not isinstance(bands_data, orm.BandsData):
+        raise InputValidationError(
+            'Invalide type {} for parameter `bands_data`'.format(
+                type(bands_data)))
+
+    # Every crossing is checked against the gap of its own band pair
+    pairs = crossings.get_array('pairs') if 'pairs' in crossings.get_arraynames() else None
+    gaps = get_pair_gap_array(bands_data.creator, pairs)
+    where = np.where(gaps < gap_threshold.value)[0]
 
     res = orm.ArrayData()
-    res.set_array('pinned', kpt_cart[where_pinned])
-    res.set_array('found', kpt_cryst[where_found])
+    res.set_array('crossings', crossings.get_array('crossings')[where])
+    res.set_array('gaps', gaps[where])
+    if pairs is not None:
+        res.set_array('pairs', pairs[where])
 
     return res
 
 
 @calcfunction
-def get_el_info(params):
-    """Extract the information about the number of electron and conduction and valence band indexes from the output of a pw calculation."""
+def get_el_info(params, band_pairs=None):
+    """Extract the information about the number of electron and conduction and valence band indexes from the output of a pw calculation.
+
+    The `band_pairs` analyzed (indexes of the lower band of pairs of adjacent bands) default to the valence band.
+    """
     if not isinstance(params, orm.Dict):
         raise InputValidationError(
             'Invalide type {} for parameter `params`'.format(type(params)))
@@ -254,6 +759,7 @@ def get_el_info(params):
     res['n_el'] = n_el
     res['cb'] = int(n_el) // (int(not spin) + 1)
     res['vb'] = res['cb'] - 1
+    res['band_pairs'] = [res['vb']] if band_pairs is None else band_pairs.get_list()
 
     return orm.Dict(dict=res)
 
@@ -275,36 +781,138 @@ def get_kpoint_grid_dimensionality(kpt_data):
     return orm.Int(dim)
 
 
-@calcfunction
-def merge_crossing_results(**kwargs):
-    """Merge the results of multiple call of `get_crossing_and_lowgap_points`."""
-    structure = kwargs.pop('structure')
-    cell = structure.cell
-    recipr = recipr_base(cell)
+# Distance (cartesian) below which two crossings are considered the same
+_CROSSINGS_MERGE_DISTANCE = 0.005
 
-    merge = np.empty((0, 3))
-    for array in kwargs.values():
-        found = array.get_array('found')
-        merge = np.vstack((merge, found))
 
+def cluster_crossings(merge, recipr, return_counts=False):
+    """Merge the crossings closer than `0.005` in cartesian coordinates into their average.
+
+    :param merge: np.array of the crossings in crystal coordinates.
+    :param recipr: np.array of reciprocal basis vector as rows.
+    :param return_counts: if `True`, return also the number of crossings merged in every one.
+
+    :return: np.array of the merged crossings in crystal coordinates.
+    """
+    from sklearn.cluster import AgglomerativeClustering
     new = []
+    counts = []
     if len(merge):
         merge = np.unique(merge, axis=0)
 
         if len(merge) > 1:
             merge_cart = np.dot(merge, recipr)
             aggl = AgglomerativeClustering(n_clusters=None,
-                                           distance_threshold=0.005,
+                                           distance_threshold=_CROSSINGS_MERGE_DISTANCE,
                                            linkage='average')
             res = aggl.fit(merge_cart)
 
             for n in np.unique(res.labels_):
                 w = np.where(res.labels_ == n)[0]
                 new.append(np.average(merge[w], axis=0))
+                counts.append(len(w))
         else:
             new = merge
+            counts = [1]
+
+    if return_counts:
+        return np.array(new), np.array(counts, dtype=np.int)
+    return np.array(new)
 
-    new = np.array(new)
+
+def fold_crossings(crossings, counts, found, recipr):
+    """Fold newly found crossings into a running set of merged crossings.
+
+    Only the new crossings are clustered. Every cluster closer than `0.005` (cartesian) to a crossing of the set is
+    averaged into it, weighted by the number of crossings already merged in both, the others are added to the set.
+
+    :param crossings: np.array of the merged crossings in crystal coordinates.
+    :param counts: np.array with the number of crossings merged in every one of `crossings`.
+    :param found: np.array of the new crossings in crystal coordinates.
+    :param recipr: np.array of reciprocal basis vector as rows.
+
+    :return: tuple with the updated `crossings` and `counts`.
+    """
+    crossings = np.array(crossings, dtype=np.float).reshape(-1, 3)
+    counts = np.array(counts, dtype=np.int)
+    new, new_counts = cluster_crossings(np.array(found).reshape(-1, 3), recipr, return_counts=True)
+
+    for point, count in zip(new, new_counts):
+        if len(crossings):
+            dist = np.linalg.norm(np.dot(crossings - point, recipr), axis=1)
+            nearest = np.argmin(dist)
+            if dist[nearest] < _CROSSINGS_MERGE_DISTANCE:
+                total = counts[nearest] + count
+                crossings[nearest] = (crossings[nearest] * counts[nearest] + point * count) / total
+                counts[nearest] = total
+                continue
+        crossings = np.vstack((crossings, point))
+        counts = np.append(counts, count)
+
+    return crossings, counts
+
+
+@calcfunction
+def update_crossing_results(structure, found, crossings=None):
+    """Fold the crossings of a call of `get_crossing_and_lowgap_points` into the ones merged so far.
+
+    If the crossings were searched for several band pairs (`found_pairs` array), the crossings of every pair are
+    merged separately and the pair of every merged crossing is stored in the `pairs` array.
+
+    :param structure: aiida.orm.StructureData used to get the cell of the material.
+    :param found: aiida.orm.ArrayData containing the new crossings in the array `found`.
+    :param crossings: aiida.orm.ArrayData output of a previous call, with the merged `crossings` and their `counts`.
+
+    :return: aiida.orm.ArrayData with the merged `crossings` and their `counts`.
+    """
+    recipr = recipr_base(structure.cell)
+
+    if crossings is None:
+        old, counts = np.empty((0, 3)), np.empty((0,), dtype=np.int)
+        old_names = []
+    else:
+        old, counts = crossings.get_array('crossings'), crossings.get_array('counts')
+        old_names = crossings.get_arraynames()
+    new = found.get_array('found')
+
+    res = orm.ArrayData()
+    if 'found_pairs' not in found.get_arraynames() and 'pairs' not in old_names:
+        new, counts = run_kernel(fold_crossings, old, counts, new, recipr)
+        res.set_array('crossings', new)
+        res.set_array('counts', counts)
+        return res
+
+    old_pairs = crossings.get_array('pairs') if 'pairs' in old_names else np.full(len(old), -1)
+    new_pairs = found.get_array('found_pairs') if len(new) else np.empty((0,), dtype=np.int)
+
+    merged, merged_counts, merged_pairs = [np.empty((0, 3))], [counts[:0]], [old_pairs[:0]]
+    for pair in np.unique(np.concatenate((old_pairs, new_pairs))):
+        select = old_pairs == pair
+        folded, folded_counts = run_kernel(fold_crossings, old[select], counts[select], new[new_pairs == pair], recipr)
+        merged.append(folded)
+        merged_counts.append(folded_counts)
+        merged_pairs.append(np.full(len(folded), pair, dtype=np.int))
+
+    res.set_array('crossings', np.vstack(merged))
+    res.set_array('counts', np.concatenate(merged_counts))
+    res.set_array('pairs', np.concatenate(merged_pairs))
+
+    return res
+
+
+@calcfunction
+def merge_crossing_results(**kwargs):
+    """Merge the results of multiple call of `get_crossing_and_lowgap_points`."""
+    structure = kwargs.pop('structure')
+    cell = structure.cell
+    recipr = recipr_base(cell)
+
+    merge = np.empty((0, 3))
+    for array in kwargs.values():
+        found = array.get_array('found')
+        merge = np.vstack((merge, found))
+
+    new = run_kernel(cluster_crossings, merge, recipr)
 
     res = orm.ArrayData()
     res.set_array('crossings', new)
@@ -312,17 +920,192 @@ def merge_crossing_results(**kwargs):
     return res
 
 
+# Fraction of the distance to the nearest crossing used as radius, so that neighbouring spheres never overlap
+_SPHERE_RADIUS_FRACTION = 0.4
+
+
+def get_chern_spheres(points, max_radius, min_radius=0., adaptive=True, group_distance=0.):
+    """Choose the spheres used to compute the chirality of band crossings.
+
+    Crossings closer than `group_distance` (crystal coordinates, periodic) are grouped in a single sphere, centered on
+    their mean position, that measures their net chirality.
+    With `adaptive`, the distance of every sphere from its edge to the nearest crossing not contained is reduced to
+    a fraction of the distance to that crossing, within `[min_radius, max_radius]`; otherwise it is `max_radius`.
+
+    :return: tuple with the `centers`, the `radii` of the spheres and the index of the sphere containing every point.
+    """
+    from scipy.spatial import cKDTree
+    points = np.array(points, dtype=float).reshape(-1, 3)
+    num = len(points)
+    wrapped = np.mod(points, 1.)
+    wrapped[wrapped >= 1.] = 0.
+    tree = cKDTree(wrapped, boxsize=1.)
+
+    groups = np.arange(num)
+    if group_distance > 0:
+        for i, j in sorted(tree.query_pairs(group_distance)):
+            groups[groups == groups[j]] = groups[i]
+    _, groups = np.unique(groups, return_inverse=True)
+
+    centers = []
+    radii = []
+    for n in range(groups.max() + 1 if num else 0):
+        members = np.where(groups == n)[0]
+        delta = points[members] - points[members[0]]
+        delta -= np.round(delta)
+        center = points[members[0]] + delta.mean(axis=0)
+        extent = np.linalg.norm(delta - delta.mean(axis=0), axis=1).max()
+
+        radius = max_radius
+        if adaptive and len(members) < num:
+            query = np.mod(center, 1.)
+            query[query >= 1.] = 0.
+            dist, idx = tree.query(query, k=min(num, len(members) + 1))
+            nearest = min(d for d, i in zip(np.atleast_1d(dist), np.atleast_1d(idx)) if i not in members)
+            radius = min(max(_SPHERE_RADIUS_FRACTION * (nearest - extent), min_radius), max_radius)
+
+        centers.append(center)
+        radii.append(extent + radius)
+
+    return np.array(centers).reshape(-1, 3), np.array(radii), groups
+
+
+@calcfunction
+def generate_chern_spheres(crossings, max_radius, min_radius, adaptive, group_distance):
+    """Return the spheres used by the Chern calculations on the crossings (see `get_chern_spheres`).
+
+    :return: ArrayData with the sphere `crossings` (centers), `radii` and the `groups` index of every crossing.
+    """
+    centers, radii, groups = get_chern_spheres(
+        crossings.get_array('crossings'), max_radius.value, min_radius.value, adaptive.value, group_distance.value
+        )
+
+    res = orm.ArrayData()
+    res.set_array('crossings', centers)
+    res.set_array('radii', radii)
+    res.set_array('groups', groups)
+
+    return res
+
+
 @calcfunction
 def merge_chern_results(**kwargs):
-    """Merge the results of multiple calls of `Z2packBaseWorkChain`."""
+    """Merge the results of multiple calls of `Z2packBaseWorkChain`.
+
+    If fewer results than crossings are given (e.g. the budget was used up), only the computed crossings are kept.
+    """
     crossings = kwargs.pop('crossings')
-    crossings = crossings.get_array('crossings')
+    arrays = {name: crossings.get_array(name) for name in crossings.get_arraynames()}
+    crossings = arrays['crossings']
 
     cherns = []
     for param in kwargs.values():
         cherns.append(round(param['invariant']['Chern'], ndigits=5))
+    crossings = crossings[:len(cherns)]
 
     res = {'crossings': crossings, 'cherns': cherns}
+    if 'radii' in arrays:
+        res['radii'] = arrays['radii'][:len(cherns)].tolist()
+        res['groups'] = arrays['groups'].tolist()
+
+    return orm.Dict(dict=res)
+
+
+# Values of the reduced coordinate of the time-reversal invariant planes and the labels used for them
+Z2_PLANE_VALUES = ((0.0, '0'), (0.5, 'half'))
+
+
+def get_z2_plane_label(direction, value):
+    """Return the label of the plane `k_direction = value` (e.g. `k3_half` for `k_3 = 0.5`)."""
+    return 'k{}_{}'.format(direction + 1, dict(Z2_PLANE_VALUES)[value])
+
+
+def get_z2_plane_surface(direction, value):
+    """Return the z2pack surface spanning half of the time-reversal invariant plane `k_direction = value`."""
+    point = [None] * 3
+    point[direction] = str(value)
+    point[(direction + 1) % 3] = 't1/2'
+    point[(direction + 2) % 3] = 't2'
+
+    return 'lambda t1,t2: [{}, {}, {}]'.format(*point)
+
+
+def get_equivalent_directions(rotations):
+    """Group the reciprocal directions whose TRIM planes are mapped onto each other by the point group.
+
+    The normal of the plane `k_i = c` transforms as the `i`-th column of the rotation `W` in crystal coordinates:
+    if it is `+-e_j`, the planes `k_i = c` and `k_j = c` are equivalent for both `c = 0` and `c = 0.5`.
+
+    :param rotations: rotations of the space group in direct crystal coordinates (e.g. from `spglib`).
+
+    :return: list with the representative (smallest equivalent) direction of each direction.
+    """
+    representative = [0, 1, 2]
+
+    def find(i):
+        while representative[i] != i:
+            i = representative[i]
+        return i
+
+    for rot in np.asarray(rotations, dtype=int):
+        for i in range(3):
+            nonzero = np.nonzero(rot[:, i])[0]
+            if len(nonzero) == 1 and abs(rot[nonzero[0], i]) == 1:
+                first, second = sorted([find(i), find(nonzero[0])])
+                representative[second] = first
+
+    return [find(i) for i in range(3)]
+
+
+def compute_z2_indices(plane_z2):
+    """Compute the strong and weak Z2 indices from the Z2 invariants of the time-reversal invariant planes.
+
+    :param plane_z2: dictionary mapping `(direction, value)` of the computed planes to their Z2 invariant.
+
+    :return: dictionary with the `strong_index`, the `weak_indices` (`None` for the directions whose `k_i = 0.5` plane
+        was not computed) and whether the strong indices from the different directions are `consistent`.
+    """
+    strong = []
+    for direction in range(3):
+        if (direction, 0.0) in plane_z2 and (direction, 0.5) in plane_z2:
+            strong.append((plane_z2[(direction, 0.0)] + plane_z2[(direction, 0.5)]) % 2)
+    if not strong:
+        raise InputValidationError('The Z2 of both the `k_i = 0` and `k_i = 0.5` planes is needed along one direction.')
+
+    weak = [plane_z2.get((direction, 0.5), None) for direction in range(3)]
+
+    res = {
+        'strong_index': strong[0],
+        'weak_indices': weak,
+        'consistent': len(set(strong)) == 1,
+    }
+    if None not in weak:
+        res['z2_index'] = '({}; {}{}{})'.format(strong[0], *weak)
+
+    return res
+
+
+@calcfunction
+def merge_z2_results(equivalences, **kwargs):
+    """Merge the results of the `Z2packBaseWorkChain` on the time-reversal invariant planes.
+
+    :param equivalences: `Dict` mapping the label of every plane skipped by symmetry to the label of the computed one.
+    :param kwargs: `output_parameters` of the calculations, labelled by plane (see `get_z2_plane_label`).
+    """
+    plane_z2 = {}
+    planes = {}
+    for direction in range(3):
+        for value, _ in Z2_PLANE_VALUES:
+            label = get_z2_plane_label(direction, value)
+            source = equivalences.get_dict().get(label, label)
+            if source not in kwargs:
+                continue
+            plane_z2[(direction, value)] = int(kwargs[source]['invariant']['Z2']) % 2
+            planes[label] = plane_z2[(direction, value)]
+
+    res = compute_z2_indices(plane_z2)
+    res['planes'] = planes
+    res['equivalent_planes'] = equivalences.get_dict()
 
     return orm.Dict(dict=res)
 
@@ -404,12 +1187,20 @@ def analyze_kpt_cross(bands_data, old_data, gap_threshold):
 
     gap_thr = gap_threshold.value
     calculation = bands_data.creator
-    gaps = get_gap_array_from_PwCalc(calculation)
     kpt_cryst = bands_data.get_kpoints()
 
+    # The 7 points of the cross of every point not yet skipped are checked against the gap of its band pair
+    names = old_data.get_arraynames()
+    pairs = old_data.get_array('pairs') if 'pairs' in names else None
+    if pairs is not None:
+        active = old_data.get_array('skips') == 0 if 'skips' in names else np.ones(len(pairs), dtype=bool)
+        gaps = get_pair_gap_array(calculation, np.repeat(pairs[active], 7))
+    else:
+        gaps = get_pair_gap_array(calculation)
+
     res = orm.ArrayData()
 
-    gaps = np.array(gaps).reshape(-1, 7)
+    gaps = gaps.reshape(-1, 7)
 
     min_pos = np.argmin(gaps, axis=1)
     min_gap = np.min(gaps, axis=1)
@@ -438,6 +1229,8 @@ def analyze_kpt_cross(bands_data, old_data, gap_threshold):
     res.set_array('skips', skips)
     res.set_array('kpoints', kpt)
     res.set_array('gaps', gaps)
+    if pairs is not None:
+        res.set_array('pairs', pairs)
 
     return res
 
@@ -469,5 +1262,9 @@ def finilize_cross_results(cross_data, gap_threshold):
     res.set_array('cr_gaps', gaps[w1])
     res.set_array('low_gap', low_gap)
     res.set_array('cr_lg', gaps[w2])
+    if 'pairs' in cross_data.get_arraynames():
+        pairs = cross_data.get_array('pairs')
+        res.set_array('pairs', pairs[w1])
+        res.set_array('lg_pairs', pairs[w2])
 
     return res
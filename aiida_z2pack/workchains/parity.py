@@ -13,10 +13,6 @@ from aiida_quantumespresso.utils.mapping import prepare_process_inputs
 from six.moves import zip
 from six.moves import range
 
-PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
-BandsxCalculation = CalculationFactory('quantumespresso.bandsx')
-Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
-
 
 @calcfunction
 def generate_bands_input_parameters() -> orm.Dict:
@@ -110,6 +106,8 @@ class Z2QSHworkchain(WorkChain):
     @classmethod
     def define(cls, spec):
         # yapf: disable
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         super().define(spec)
 
         # INPUTS ############################################################################
@@ -269,6 +267,7 @@ class Z2QSHworkchain(WorkChain):
 
     def run_scf(self):
         """Run the PwBaseWorkChain in scf mode on the input structure."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         inputs = AttributeDict(
             self.exposed_inputs(PwBaseWorkChain, namespace='scf'))
         inputs.clean_workdir = self.inputs.clean_workdir
@@ -333,6 +332,7 @@ class Z2QSHworkchain(WorkChain):
 
     def calculate_trim_wf(self):
         """Launch a pw_bands calculation on the TRIM points for the structure."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         self.report(
             'Using parities at TRIM points to calculatte Z2 invariant.')
         kpoints = generate_trim(self.ctx.current_structure,
@@ -371,6 +371,7 @@ class Z2QSHworkchain(WorkChain):
 
     def calculate_trim_parity(self):
         """Run a BandsxCalculation to get the wf parities."""
+        BandsxCalculation = CalculationFactory('quantumespresso.bandsx')
         params = generate_bands_input_parameters()
 
         inputs = {
@@ -431,6 +432,7 @@ class Z2QSHworkchain(WorkChain):
 
     def prepare_z2pack(self):
         """Prepare the inputs for the z2ack calculation."""
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         self.report('Using z2pack to calculatte Z2 invariant.')
         inputs = AttributeDict(
             self.exposed_inputs(Z2packBaseWorkChain, namespace='z2pack_base'))
@@ -448,6 +450,7 @@ class Z2QSHworkchain(WorkChain):
 
     def run_z2pack(self):
         """Launch the Z2packBaseWorkChain for the z2pack calculation."""
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
         running = self.submit(Z2packBaseWorkChain, **self.ctx.inputs)
 
         self.report(
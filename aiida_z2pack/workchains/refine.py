@@ -7,13 +7,11 @@ from aiida.common import AttributeDict
 from aiida.plugins import WorkflowFactory
 from aiida.engine import WorkChain, while_, if_, ToContext
 
-from aiida_quantumespresso.utils.mapping import prepare_process_inputs
-
 from .functions import (generate_kpt_cross, analyze_kpt_cross,
                         finilize_cross_results)
 from six.moves import zip
-
-PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+from .cost import attach_cost_output, is_budget_exhausted
+from .sharding import submit_bands, get_bands_workchains, collect_bands
 
 
 class RefineCrossingsPosition(WorkChain):
@@ -21,6 +19,7 @@ class RefineCrossingsPosition(WorkChain):
     @classmethod
     def define(cls, spec):
         # yapf: disable
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         super().define(spec)
 
         # INPUTS ############################################################################
@@ -77,6 +76,21 @@ class RefineCrossingsPosition(WorkChain):
             help=
             'kpoints with gap < `gap_threshold` are considered possible crossings.'
         )
+        spec.input(
+            'kpoints_per_job', valid_type=orm.Int,
+            required=False,
+            help='If given, split the kpoints of the bands calculations in chunks of this size run concurrently.'
+            )
+        spec.input(
+            'max_core_hours', valid_type=orm.Float,
+            required=False,
+            help='Stop launching calculations and return partial results once the calculations of this workchain used this many core-hours.'
+            )
+        spec.input(
+            'max_kpoints', valid_type=orm.Int,
+            required=False,
+            help='Stop launching calculations and return partial results once this many k-points have been computed.'
+            )
 
         # OUTLINE ############################################################################
         spec.outline(
@@ -110,6 +124,12 @@ class RefineCrossingsPosition(WorkChain):
             required=True,
             help='The array containing a list of bands crossing found as rows.'
         )
+        spec.output(
+            'cost',
+            valid_type=orm.Dict,
+            required=False,
+            help='Breakdown of the core-hours and k-points spent by the calculations launched by this workchain.'
+        )
 
         # ERRORS ############################################################################
         spec.exit_code(322,
@@ -131,7 +151,7 @@ class RefineCrossingsPosition(WorkChain):
         self.ctx.step = self.inputs.step_size
         self.ctx.gap_thr = self.inputs.gap_threshold
 
-        self.ctx.current_kpt = [self.inputs.crossings]
+        self.ctx.current_kpt = self.inputs.crossings
         self.ctx.skip_kpt = [0] * ncross
 
     def do_scf(self):
@@ -140,6 +160,7 @@ class RefineCrossingsPosition(WorkChain):
 
     def setup_scf(self):
         """Set the inputs for the `scf` calculation."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         if 'parent_folder' in self.inputs:
             self.report('IGNORING `parent_folder` input.')
 
@@ -154,6 +175,7 @@ class RefineCrossingsPosition(WorkChain):
 
     def run_scf(self):
         """Run the scf calculation."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         running = self.submit(PwBaseWorkChain, **self.ctx.inputs)
 
         self.report('launching PwBaseWorkChain<{}>'.format(running.pk))
@@ -179,7 +201,7 @@ class RefineCrossingsPosition(WorkChain):
 
     def do_loop(self):
         """Check whether to stop the loop."""
-        return not all(self.ctx.skip_kpt) and self.ctx.counter < 50
+        return not all(self.ctx.skip_kpt) and self.ctx.counter < 50 and not is_budget_exhausted(self)
 
     def setup_kpt(self):
         """Create the cross grid for the calculation."""
@@ -187,7 +209,7 @@ class RefineCrossingsPosition(WorkChain):
         app = dict(list(zip(unique, counts)))
         self.report('Starting iteration number <{:3d}> for {}/{} kpts'.format(
             self.ctx.counter, app[0], self.ctx.ncross))
-        curr_kpt = self.ctx.current_kpt[-1]
+        curr_kpt = self.ctx.current_kpt
         self.ctx.kpt_data = generate_kpt_cross(self.inputs.structure, curr_kpt,
                                                self.ctx.step)
 
@@ -195,6 +217,7 @@ class RefineCrossingsPosition(WorkChain):
 
     def setup_bands(self):
         """Set the inputs for the `bands` calculation."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
         inputs = AttributeDict(
             self.exposed_inputs(PwBaseWorkChain, namespace='bands'))
 
@@ -211,43 +234,41 @@ class RefineCrossingsPosition(WorkChain):
         inputs.pw.parameters['CONTROL']['calculation'] = 'bands'
         inputs.pw.parameters['SYSTEM']['nosym'] = True
 
-        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
-
         self.ctx.inputs = inputs
 
     def run_bands(self):
         """Run the bands calculation."""
-        running = self.submit(PwBaseWorkChain, **self.ctx.inputs)
-
-        self.report('launching PwBaseWorkChain<{}>'.format(running.pk))
+        submit_bands(self, self.ctx.inputs)
 
-        return ToContext(workchain_bands=running)
+        self.report('launching PwBaseWorkChain<{}>'.format(
+            ', '.join(str(node.pk) for node in get_bands_workchains(self))))
 
     def inspect_bands(self):
         """Verify that the PwBaseWorkChain finished successfully."""
-        workchain = self.ctx.workchain_bands
+        workchain, bands = collect_bands(self)
 
-        if not workchain.is_finished_ok:
+        if workchain is not None:
             self.report('PwBaseWorkChain failed with exit status {}'.format(
                 workchain.exit_status))
             return self.exit_codes.ERROR_SUB_PROCESS_FAILED_BANDS
 
-        self.ctx.bands = workchain.outputs.output_band
+        self.ctx.bands = bands
 
     def analyze_bands(self):
         """Determine next set of origin point for cross search."""
-        result = analyze_kpt_cross(self.ctx.bands, self.ctx.current_kpt[-1],
+        result = analyze_kpt_cross(self.ctx.bands, self.ctx.current_kpt,
                                    self.ctx.gap_thr)
 
-        self.ctx.current_kpt.append(result)
+        self.ctx.current_kpt = result
 
         self.ctx.skip_kpt = result.get_array('skips')
 
     def results(self):
         """Output the workchain results."""
-        res = finilize_cross_results(self.ctx.current_kpt[-1],
+        res = finilize_cross_results(self.ctx.current_kpt,
                                      self.ctx.gap_thr)
 
         self.out('crossings', res)
+        attach_cost_output(self)
 
         self.report('FINISHED')
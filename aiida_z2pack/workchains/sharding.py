@@ -0,0 +1,137 @@
+"""Splitting of the k-points of large bands calculations over concurrent `PwBaseWorkChain`."""
+from __future__ import absolute_import
+import numpy as np
+
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import calcfunction
+from aiida.plugins import WorkflowFactory
+
+from aiida_quantumespresso.utils.mapping import prepare_process_inputs
+
+from ..calculations.utils.parallelization import apply_pw_parallelization
+
+
+@calcfunction
+def split_kpoints(kpoints, size):
+    """Split the k-points of a `KpointsData` in chunks of at most `size` points, keeping their order.
+
+    :param kpoints: aiida.orm.KpointsData with an explicit list of k-points.
+    :param size: aiida.orm.Int maximum number of k-points of every chunk.
+
+    :return: dictionary of aiida.orm.KpointsData with labels `kpoints_<n>`.
+    """
+    kpt = kpoints.get_kpoints()
+    nchunks = -(-len(kpt) // size.value)
+
+    res = {}
+    for n, chunk in enumerate(np.array_split(kpt, nchunks)):
+        new = orm.KpointsData()
+        try:
+            new.set_cell(kpoints.cell)
+        except AttributeError:
+            pass
+        new.set_kpoints(chunk)
+        res['kpoints_{}'.format(n)] = new
+
+    return res
+
+
+@calcfunction
+def concatenate_bands(kpoints, **kwargs):
+    """Concatenate the bands computed on the chunks of `kpoints` made by `split_kpoints`.
+
+    The outputs mimic the ones of a `PwCalculation` run on the full `kpoints`, that is also an input so that its
+    creator can be reached from the bands as done by the analysis functions.
+
+    :param kpoints: aiida.orm.KpointsData that was split in chunks.
+    :param kwargs: the `output_band` (`bands_<n>`) and `output_parameters` (`parameters_<n>`) of every chunk.
+
+    :return: dictionary with the concatenated `output_band` and the `output_parameters` of the first chunk.
+    """
+    nchunks = len([key for key in kwargs if key.startswith('bands_')])
+    chunks = [kwargs['bands_{}'.format(n)] for n in range(nchunks)]
+
+    bands = orm.BandsData()
+    bands.set_kpointsdata(kpoints)
+    bands.set_bands(np.concatenate([chunk.get_bands() for chunk in chunks], axis=-2), units=chunks[0].units)
+
+    return {
+        'output_band': bands,
+        'output_parameters': orm.Dict(dict=kwargs['parameters_0'].get_dict()),
+        }
+
+
+def submit_bands(workchain, inputs, key='workchain_bands'):
+    """Submit the `PwBaseWorkChain` for `inputs`, splitting its k-points in chunks of `kpoints_per_job` if given.
+
+    The chunks run concurrently and are added to the context of `workchain` as `<key>_<n>`.
+
+    :param workchain: the calling workchain, with an optional `kpoints_per_job` input.
+    :param inputs: AttributeDict with the inputs of the `PwBaseWorkChain`, before `prepare_process_inputs`.
+    :param key: prefix of the context keys.
+    """
+    PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+
+    kpoints = inputs.kpoints
+    chunks = [kpoints]
+    if 'kpoints_per_job' in workchain.inputs:
+        try:
+            nkpt = len(kpoints.get_kpoints())
+        except AttributeError:
+            nkpt = 0
+        if nkpt > workchain.inputs.kpoints_per_job.value:
+            res = split_kpoints(kpoints, workchain.inputs.kpoints_per_job)
+            chunks = [res['kpoints_{}'.format(n)] for n in range(len(res))]
+
+    for n in range(workchain.ctx.get('{}_shards'.format(key), 0)):
+        workchain.ctx.pop('{}_{}'.format(key, n), None)
+    workchain.ctx['{}_kpoints'.format(key)] = kpoints
+    workchain.ctx['{}_shards'.format(key)] = len(chunks)
+
+    for n, chunk in enumerate(chunks):
+        shard = AttributeDict(inputs)
+        shard.pw = dict(inputs.pw)
+        shard.kpoints = chunk
+
+        try:
+            nkpt = len(chunk.get_kpoints())
+        except AttributeError:
+            nkpt = len(chunk.get_kpoints_mesh(print_list=True))
+        layout = apply_pw_parallelization(shard, nkpt)
+        if layout is not None:
+            workchain.report('Running {} kpoints with cmdline {}.'.format(nkpt, shard.pw['settings']['cmdline']))
+
+        running = workchain.submit(PwBaseWorkChain, **prepare_process_inputs(PwBaseWorkChain, shard))
+        if len(chunks) > 1:
+            workchain.report('launching PwBaseWorkChain<{}> on chunk {}/{} of {} kpoints'.format(
+                running.pk, n + 1, len(chunks), nkpt))
+
+        workchain.to_context(**{'{}_{}'.format(key, n): running})
+
+
+def get_bands_workchains(workchain, key='workchain_bands'):
+    """Return the `PwBaseWorkChain` submitted by the last call of `submit_bands`."""
+    return [workchain.ctx['{}_{}'.format(key, n)] for n in range(workchain.ctx['{}_shards'.format(key)])]
+
+
+def collect_bands(workchain, key='workchain_bands'):
+    """Return the bands computed by the `PwBaseWorkChain` submitted by `submit_bands`, concatenating the chunks.
+
+    :return: tuple with the first failed `PwBaseWorkChain` (`None` if all finished ok) and the `BandsData`.
+    """
+    running = get_bands_workchains(workchain, key)
+    for node in running:
+        if not node.is_finished_ok:
+            return node, None
+
+    if len(running) == 1:
+        return None, running[0].outputs.output_band
+
+    kwargs = {}
+    for n, node in enumerate(running):
+        kwargs['bands_{}'.format(n)] = node.outputs.output_band
+        kwargs['parameters_{}'.format(n)] = node.outputs.output_parameters
+    res = concatenate_bands(kpoints=workchain.ctx['{}_kpoints'.format(key)], **kwargs)
+
+    return None, res['output_band']
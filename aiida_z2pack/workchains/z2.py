@@ -0,0 +1,241 @@
+"""`Z2pack3DZ2WorkChain` workchain definition."""
+from __future__ import absolute_import
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.plugins import WorkflowFactory
+from aiida.engine import WorkChain, ToContext, if_
+
+from aiida_quantumespresso.utils.mapping import prepare_process_inputs
+
+from .functions import (
+    Z2_PLANE_VALUES, get_z2_plane_label, get_z2_plane_surface, get_equivalent_directions, get_structure_rotations,
+    merge_z2_results
+    )
+from .cost import attach_cost_output
+
+
+class Z2pack3DZ2WorkChain(WorkChain):
+    """Workchain to compute the strong and weak Z2 indices of a 3D system using z2pack.
+
+    The Z2 invariant is computed on the six time-reversal invariant planes `k_i = 0` and `k_i = 0.5`, all starting
+    from the same scf calculation and running concurrently.
+    The strong index is `Z2(k_i = 0) + Z2(k_i = 0.5)` (mod 2) and the weak indices are `Z2(k_i = 0.5)`.
+    """
+    @classmethod
+    def define(cls, spec):
+        # yapf: disable
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
+        super().define(spec)
+
+        # INPUTS ############################################################################
+        spec.input(
+            'pw_code', valid_type=orm.Code,
+            help='The code for pw calculations.'
+            )
+        spec.input(
+            'structure', valid_type=orm.StructureData,
+            help='The inputs structure.'
+            )
+        spec.input(
+            'scf_parent_folder', valid_type=orm.RemoteData,
+            required=False,
+            help='The remote_folder of an scf calculation to be used by z2pack.'
+            )
+        spec.input(
+            'weak_indices', valid_type=orm.Bool,
+            default=lambda: orm.Bool(True),
+            help='If `False`, only the `k_3 = 0` and `k_3 = 0.5` planes needed by the strong index are computed.'
+            )
+        spec.input(
+            'use_symmetry', valid_type=orm.Bool,
+            default=lambda: orm.Bool(True),
+            help='If `True`, the planes equivalent by symmetry to an already computed one are skipped.'
+            )
+        spec.input(
+            'clean_workdir', valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='If `True`, work directories of all called calculation will be cleaned at the end of execution.'
+            )
+
+        spec.expose_inputs(
+            PwBaseWorkChain, namespace='scf',
+            exclude=('clean_workdir', 'pw.structure', 'pw.code'),
+            namespace_options={
+                'required':False, 'populate_defaults':False,
+                'help': 'Inputs for the `PwBaseWorkChain` scf calculation.'
+                }
+            )
+        spec.expose_inputs(
+            Z2packBaseWorkChain, namespace='z2pack_base',
+            exclude=('clean_workdir', 'structure', 'parent_folder', 'pw_code', 'scf'),
+            namespace_options={
+                'help': 'Inputs for the `Z2packBaseWorkChain`.'
+                }
+            )
+
+        # OUTLINE ############################################################################
+        spec.outline(
+            cls.setup,
+            if_(cls.should_do_scf)(
+                cls.run_scf,
+                cls.inspect_scf
+                ),
+            cls.setup_planes,
+            cls.run_planes,
+            cls.inspect_planes,
+            cls.results
+            )
+
+        # OUTPUTS ############################################################################
+        spec.output(
+            'output_parameters', valid_type=orm.Dict,
+            help='Dict with the strong and weak Z2 indices and the Z2 invariant of every plane.'
+            )
+        spec.output('scf_remote_folder', valid_type=orm.RemoteData,
+            required=False,
+            help='The remote folder produced by the scf calculation.'
+            )
+        spec.output(
+            'cost', valid_type=orm.Dict,
+            required=False,
+            help='Breakdown of the core-hours and k-points spent by the calculations launched by this workchain.'
+            )
+
+        # ERRORS ############################################################################
+        spec.exit_code(322, 'ERROR_SUB_PROCESS_FAILED_SCF',
+            message='the scf PwBaseWorkChain sub process failed')
+        spec.exit_code(323, 'ERROR_SUB_PROCESS_FAILED_Z2PACK',
+            message='the Z2packBaseWorkChain sub process failed')
+        spec.exit_code(333, 'ERROR_INVALID_INPUT',
+            message='Must provide either `scf` namelist or `scf_parent_folder` RemoteData as input.')
+        # yapf: enable
+
+    def setup(self):
+        """Define the current structure in the context to be the input structure."""
+        self.report('STARTING Z2pack3DZ2WorkChain')
+        self.ctx.current_structure = self.inputs.structure
+
+        if 'scf' not in self.inputs and 'scf_parent_folder' not in self.inputs:
+            return self.exit_codes.ERROR_INVALID_INPUT
+
+    def should_do_scf(self):
+        """Determine if the `scf` calculation should be run or use the parent folder given as input."""
+        if 'scf_parent_folder' in self.inputs:
+            if 'scf' in self.inputs:
+                self.report('WARNING: both `scf` and `scf_parent_folder` input ports specfied. `scf` will be ignored')
+
+            self.ctx.remote_scf = self.inputs.scf_parent_folder
+            return False
+
+        return True
+
+    def run_scf(self):
+        """Run the `scf` calculation shared by the z2pack calculations on all the planes."""
+        PwBaseWorkChain = WorkflowFactory('quantumespresso.pw.base')
+        inputs = AttributeDict(self.exposed_inputs(PwBaseWorkChain, namespace='scf'))
+        inputs.clean_workdir = self.inputs.clean_workdir
+        inputs.pw.structure = self.ctx.current_structure
+        inputs.pw.code = self.inputs.pw_code
+
+        inputs.pw.parameters = inputs.pw.parameters.get_dict()
+        inputs.pw.parameters.setdefault('CONTROL', {})
+        inputs.pw.parameters['CONTROL']['calculation'] = 'scf'
+
+        inputs = prepare_process_inputs(PwBaseWorkChain, inputs)
+        running = self.submit(PwBaseWorkChain, **inputs)
+
+        self.report('launching PwBaseWorkChain<{}> for starting scf'.format(running.pk))
+
+        return ToContext(workchain_scf=running)
+
+    def inspect_scf(self):
+        """Inspect the result of the starting scf `PwBaseWorkChain`."""
+        workchain = self.ctx.workchain_scf
+
+        if not workchain.is_finished_ok:
+            self.report('Starting scf PwBaseWorkChain failed with exit status {}'.format(workchain.exit_status))
+            return self.exit_codes.ERROR_SUB_PROCESS_FAILED_SCF
+
+        self.ctx.remote_scf = workchain.outputs.remote_folder
+        self.out('scf_remote_folder', self.ctx.remote_scf)
+
+    def setup_planes(self):
+        """Choose the planes to compute, skipping the ones equivalent by symmetry to a computed one."""
+        if self.inputs.weak_indices.value:
+            directions = [0, 1, 2]
+        else:
+            # The strong index is fixed by the two planes along a single direction
+            directions = [2]
+
+        representative = [0, 1, 2]
+        if self.inputs.use_symmetry.value:
+            representative = get_equivalent_directions(get_structure_rotations(self.ctx.current_structure))
+
+        self.ctx.planes = []
+        equivalences = {}
+        for direction in directions:
+            for value, _ in Z2_PLANE_VALUES:
+                label = get_z2_plane_label(direction, value)
+                source = representative[direction]
+                if source != direction and source in directions:
+                    equivalences[label] = get_z2_plane_label(source, value)
+                    self.report('skipping plane `{}` equivalent by symmetry to `{}`'.format(label, equivalences[label]))
+                    continue
+                self.ctx.planes.append((direction, value))
+
+        self.ctx.equivalences = equivalences
+
+    def run_planes(self):
+        """Launch concurrently the `Z2packBaseWorkChain` on all the planes."""
+        Z2packBaseWorkChain = WorkflowFactory('z2pack.base')
+        inputs = AttributeDict(self.exposed_inputs(Z2packBaseWorkChain, namespace='z2pack_base'))
+        inputs.clean_workdir = self.inputs.clean_workdir
+        inputs.pw_code = self.inputs.pw_code
+        inputs.structure = self.ctx.current_structure
+        inputs.parent_folder = self.ctx.remote_scf
+
+        settings = inputs.z2pack.z2pack_settings.get_dict()
+        if settings.pop('parent_folder_symlink', False):
+            self.report('WARNING: `parent_folder_symlink` ignored, as the planes share the same scf folder.')
+
+        for direction, value in self.ctx.planes:
+            settings.update({
+                'dimension_mode': '3D',
+                'invariant': 'Z2',
+                'surface': get_z2_plane_surface(direction, value),
+                })
+            inputs.z2pack.z2pack_settings = orm.Dict(dict=settings)
+
+            label = get_z2_plane_label(direction, value)
+            running = self.submit(Z2packBaseWorkChain, **inputs)
+
+            self.report('launching Z2packBaseWorkChain<{}> on plane `{}`'.format(running.pk, label))
+
+            self.to_context(**{'plane_{}'.format(label): running})
+
+    def inspect_planes(self):
+        """Verify that the Z2packBaseWorkChain on all the planes finished successfully."""
+        for direction, value in self.ctx.planes:
+            label = get_z2_plane_label(direction, value)
+            workchain = self.ctx['plane_{}'.format(label)]
+            if not workchain.is_finished_ok:
+                self.report('Z2packBaseWorkChain on plane `{}` failed with exit status {}'.format(
+                    label, workchain.exit_status))
+                return self.exit_codes.ERROR_SUB_PROCESS_FAILED_Z2PACK
+
+    def results(self):
+        """Output the workchain results."""
+        planes = {}
+        for direction, value in self.ctx.planes:
+            label = get_z2_plane_label(direction, value)
+            planes[label] = self.ctx['plane_{}'.format(label)].outputs.output_parameters
+
+        res = merge_z2_results(equivalences=orm.Dict(dict=self.ctx.equivalences), **planes)
+        if not res['consistent']:
+            self.report('WARNING: the strong index differs between the directions: check the convergence.')
+
+        self.out('output_parameters', res)
+        attach_cost_output(self)
+
+        self.report('FINISHED')
@@ -0,0 +1,73 @@
+"""Tests for the estimate of the cost of a z2pack calculation."""
+from __future__ import absolute_import
+import pytest
+
+from aiida.common import exceptions
+
+from aiida_z2pack.calculations.utils.cost_model import estimate_z2pack_cost, get_max_num_lines, parse_iterator
+
+
+class Defaults(object):
+    """Default z2pack settings, as the ones of the `Z2packCalculation`."""
+    _DEFAULT_NUM_LINES = 11
+    _DEFAULT_MIN_NEIGHBOUR_DISTANCE = 0.01
+    _DEFAULT_ITERATOR = 'range(8, 41, 2)'
+    _DEFAULT_POS_TOLERANCE = 0.01
+
+
+def test_parse_iterator():
+    """Test the conversion of the `iterator` setting in the number of k-points per line."""
+    assert parse_iterator('range(8, 13, 2)') == [8, 10, 12]
+    assert parse_iterator('range(4)') == [0, 1, 2, 3]
+    assert parse_iterator('[4, 6]') == [4, 6]
+    assert parse_iterator((4, 6)) == [4, 6]
+
+    with pytest.raises(exceptions.InputValidationError):
+        parse_iterator('np.arange(8, 13)')
+
+
+def test_max_num_lines():
+    """Test that the lines are bisected until their distance is not larger than `min_neighbour_dist`."""
+    assert get_max_num_lines(1, 0.01) == 1
+    assert get_max_num_lines(3, 0.5) == 3
+    assert get_max_num_lines(3, 0.2) == 9
+    assert get_max_num_lines(11, 0.01) == 161
+
+
+def test_cost_bounds():
+    """Test the bounds given by `num_lines`, `iterator`, `min_neighbour_dist` and `pos_tol`."""
+    settings = {'num_lines': 3, 'min_neighbour_dist': 0.2, 'iterator': [4, 6, 8], 'pos_tol': 0.01}
+    res = estimate_z2pack_cost(Defaults, settings)
+    assert res['lines'] == (3, 9)
+    assert res['kpoints_per_line'] == (4, 8)
+    assert res['calls'] == (6, 27)
+    assert res['kpoints'] == (30, 162)
+
+    # Without `pos_tol` every line stops at the first step of the iterator
+    res = estimate_z2pack_cost(Defaults, dict(settings, pos_tol=None))
+    assert res['kpoints_per_line'] == (4, 4)
+    assert res['calls'] == (3, 9)
+    assert res['kpoints'] == (12, 36)
+
+    res = estimate_z2pack_cost(Defaults, {'NUM_LINES': 3, 'min_neighbour_dist': 0.2, 'iterator': 'range(8, 41, 2)'})
+    assert res['kpoints_per_line'] == (8, 40)
+    assert res['calls'] == (6, 9 * 17)
+
+    res = estimate_z2pack_cost(Defaults, {})
+    assert res['lines'] == (11, 161)
+
+    with pytest.raises(exceptions.InputValidationError):
+        estimate_z2pack_cost(Defaults, {'iterator': []})
+
+
+def test_cost_core_hours():
+    """Test the core-hours computed from the per-stage timings and the number of cores."""
+    settings = {'num_lines': 3, 'min_neighbour_dist': 0.2, 'iterator': [4, 6, 8]}
+    timings = {'nscf_per_kpoint': 3., 'overlap_per_kpoint': 1., 'wannier90_per_call': 2., 'overhead_per_call': 8.}
+
+    res = estimate_z2pack_cost(Defaults, settings, timings=timings, num_cores=36)
+    assert res['core_hours'] == pytest.approx((1.8, 9.18))
+
+    # The stages not given keep the default timings
+    res = estimate_z2pack_cost(Defaults, settings, timings={'nscf_per_kpoint': 0.})
+    assert res['core_hours'] == pytest.approx(((30 * 2. + 6 * 6.) / 3600., (162 * 2. + 27 * 6.) / 3600.))
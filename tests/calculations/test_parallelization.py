@@ -0,0 +1,21 @@
+"""Tests for the automatic pw.x parallelization layout."""
+from __future__ import absolute_import
+
+from aiida_z2pack.calculations.utils.parallelization import get_pw_parallelization, set_parallelization_cmdline
+
+
+def test_pw_parallelization():
+    """Test the choice of pools, diagonalization groups and ranks."""
+    assert get_pw_parallelization(7, 48) == {'npools': 6, 'ndiag': 1, 'num_mpiprocs': 48}
+    assert get_pw_parallelization(10, 48, num_bands=200) == {'npools': 8, 'ndiag': 4, 'num_mpiprocs': 48}
+    assert get_pw_parallelization(1, 64, num_bands=20) == {'npools': 1, 'ndiag': 1, 'num_mpiprocs': 64}
+    assert get_pw_parallelization(7, 30) == {'npools': 6, 'ndiag': 1, 'num_mpiprocs': 30}
+
+
+def test_parallelization_cmdline():
+    """Test that explicit flags are kept unless there are more pools than kpoints."""
+    cmdline, _ = set_parallelization_cmdline(['-nk', '4'], 6, 32)
+    assert cmdline == ['-nk', '4']
+
+    cmdline, _ = set_parallelization_cmdline(['-npools', '16', '-nd', '4', '-x'], 6, 32)
+    assert cmdline == ['-x', '-nk', '4', '-nd', '1']
@@ -260,3 +260,237 @@ def test_nested_restart(
     assert test['SYSTEM']['nbnd'] == 50
     assert test['SYSTEM']['lspinorb'] == True
 
+
+def test_nscf_bands_buffer(
+    aiida_profile, generate_calc_job, fixture_sandbox, remote, pw_parameters, z2pack_settings, inputs
+    ):
+    """Test that the `nbnd` chosen for the nscf calculations is written in their input file."""
+    parameters = dict(pw_parameters)
+    parameters['SYSTEM'] = dict(parameters['SYSTEM'], nbnd=12)
+
+    inputs['parent_folder'] = remote
+    inputs['pw_parameters'] = orm.Dict(dict=parameters)
+    inputs['z2pack_settings'] = orm.Dict(dict=z2pack_settings)
+
+    process = generate_calc_job('z2pack.z2pack', inputs)
+    process.prepare_for_submission(fixture_sandbox)
+
+    with fixture_sandbox.open('aiida.nscf.in') as handle:
+        content = handle.read()
+    assert 'nbnd = 12' in content
+
+
+def test_tb_backend(
+    aiida_profile, generate_calc_job, fixture_sandbox, fixture_localhost, generate_remote_data,
+    remote, z2pack_settings, inputs, tmpdir
+    ):
+    """Test that the `tb` backend copies only the Wannier Hamiltonian and does not prepare DFT inputs."""
+    w90_remote = generate_remote_data(
+        fixture_localhost, str(tmpdir.mkdir('w90')),
+        'wannier90.wannier90',
+        extras_root=[({'write_hr': True}, 'parameters')]
+        )
+
+    z2pack_settings.update({'backend': 'tb', 'tb_bands': 4})
+    inputs.pop('pw_code')
+    inputs['parent_folder'] = remote
+    inputs['wannier90_folder'] = w90_remote
+    inputs['z2pack_settings'] = orm.Dict(dict=z2pack_settings)
+
+    process   = generate_calc_job('z2pack.z2pack', inputs)
+    calc_info = process.prepare_for_submission(fixture_sandbox)
+
+    assert calc_info.remote_copy_list == [
+        (w90_remote.computer.uuid, os.path.join(w90_remote.get_remote_path(), 'aiida_hr.dat'), 'aiida_hr.dat')
+        ]
+    assert fixture_sandbox.get_content_list() == ['z2pack_aiida.py']
+
+    with open(fixture_sandbox.get_abs_path('z2pack_aiida.py'), 'r') as f:
+        written_input = f.read()
+    assert 'z2pack.tb.System(model, bands=4)' in written_input
+    assert 'z2pack.fp.System' not in written_input
+
+
+def test_tb_backend_restart(
+    aiida_profile, generate_calc_job, fixture_code, fixture_sandbox, fixture_localhost, generate_remote_data,
+    generate_structure, generate_upf_data, z2pack_settings, tmpdir
+    ):
+    """Test that a restart of a `tb` calculation takes the Wannier model and the occupied bands from its parents."""
+    from aiida.common.links import LinkType
+
+    remote_scf = generate_remote_data(
+        fixture_localhost, str(tmpdir.mkdir('scf')),
+        'quantumespresso.pw',
+        extras_root=[
+            ({'CONTROL': {'calculation': 'scf'}, 'SYSTEM': {'ecutwfc': 30.0}}, 'parameters'),
+            (generate_structure(), 'structure'),
+            (generate_upf_data('Si'), 'pseudos__Si'),
+            ]
+        )
+    remote_scf.store()
+    output_parameters = orm.Dict(dict={'number_of_electrons': 8.0, 'spin_orbit_calculation': False})
+    output_parameters.add_incoming(remote_scf.creator, link_type=LinkType.CREATE, link_label='output_parameters')
+    output_parameters.store()
+
+    w90_remote = generate_remote_data(
+        fixture_localhost, str(tmpdir.mkdir('w90')),
+        'wannier90.wannier90',
+        extras_root=[({'write_hr': True}, 'parameters')]
+        )
+    w90_remote.store()
+
+    z2pack_settings['backend'] = 'tb'
+    remote_1 = generate_remote_data(
+        fixture_localhost, str(tmpdir.mkdir('remote_1')),
+        'z2pack.z2pack',
+        extras_root=[
+            (z2pack_settings, 'z2pack_settings'),
+            (remote_scf, 'parent_folder'),
+            (w90_remote, 'wannier90_folder'),
+            ]
+        )
+    remote_1.store()
+    retrieved = orm.FolderData()
+    retrieved.add_incoming(remote_1.creator, link_type=LinkType.CREATE, link_label='retrieved')
+    retrieved.store()
+
+    inputs = {
+        'code': fixture_code('z2pack.z2pack'),
+        'parent_folder': remote_1,
+        'metadata': {
+            'options': get_default_options()
+        }
+    }
+
+    process   = generate_calc_job('z2pack.z2pack', inputs)
+    calc_info = process.prepare_for_submission(fixture_sandbox)
+
+    assert (
+        w90_remote.computer.uuid, os.path.join(w90_remote.get_remote_path(), 'aiida_hr.dat'), 'aiida_hr.dat'
+        ) in calc_info.remote_copy_list
+    assert 'wannier90_folder' not in process.inputs
+    assert process.tb_bands == 4
+
+
+def test_minimal_staging(aiida_profile, generate_calc_job, fixture_sandbox, remote, z2pack_settings, inputs):
+    """Test that with `parent_folder_staging='minimal'` only the files needed by the nscf are staged."""
+    z2pack_settings['parent_folder_staging'] = 'minimal'
+    inputs['parent_folder'] = remote
+    inputs['z2pack_settings'] = orm.Dict(dict=z2pack_settings)
+
+    process   = generate_calc_job('z2pack.z2pack', inputs)
+    calc_info = process.prepare_for_submission(fixture_sandbox)
+
+    rpath = remote.get_remote_path()
+    save  = os.path.join('./out/', 'aiida.save')
+    expected = [
+        (remote.computer.uuid, os.path.join(rpath, './pseudo/'), './pseudo/'),
+        (remote.computer.uuid, os.path.join(rpath, save, 'data-file-schema.xml'), os.path.join(save, 'data-file-schema.xml')),
+        (remote.computer.uuid, os.path.join(rpath, save, 'charge-density*'), save),
+        ]
+
+    assert sorted(calc_info.remote_copy_list) == sorted(expected)
+    assert os.path.isdir(fixture_sandbox.get_abs_path(save))
+
+
+def test_band_windows(aiida_profile, generate_calc_job, fixture_sandbox, remote, z2pack_settings, inputs):
+    """Test that `band_windows` ships the helpers module and retrieves one save file per window."""
+    z2pack_settings['band_windows'] = [[1, 4], [3, 4]]
+    inputs['parent_folder'] = remote
+    inputs['z2pack_settings'] = orm.Dict(dict=z2pack_settings)
+
+    process   = generate_calc_job('z2pack.z2pack', inputs)
+    calc_info = process.prepare_for_submission(fixture_sandbox)
+
+    assert 'z2pack_helpers.py' in fixture_sandbox.get_content_list()
+    assert 'save_window_0.json' in calc_info.retrieve_list
+    assert 'save_window_1.json' in calc_info.retrieve_list
+
+    with fixture_sandbox.open('z2pack_aiida.py') as handle:
+        content = handle.read()
+    assert 'system = CachedOverlapSystem(system)' in content
+    assert 'BandWindowSystem(system, 3, 4)' in content
+
+
+def test_python_engine_pseudos(
+    aiida_profile, generate_calc_job, fixture_sandbox, fixture_localhost, generate_remote_data,
+    generate_upf_data, generate_structure, remote, pw_parameters, z2pack_settings, inputs, tmpdir
+    ):
+    """Test that the `python` overlap engine accepts only norm-conserving pseudopotentials of the root scf."""
+    from aiida.common import exceptions
+
+    z2pack_settings['overlap_engine'] = 'python'
+    inputs['z2pack_settings'] = orm.Dict(dict=z2pack_settings)
+    inputs['wannier90_parameters'] = orm.Dict(dict={'num_bands': 8})
+
+    inputs['parent_folder'] = remote
+    process = generate_calc_job('z2pack.z2pack', inputs)
+    with pytest.raises(exceptions.InputValidationError, match='norm-conserving'):
+        process.prepare_for_submission(fixture_sandbox)
+
+    remote_nc = generate_remote_data(
+        fixture_localhost, str(tmpdir.mkdir('scf_nc')),
+        'quantumespresso.pw',
+        extras_root=[
+            (pw_parameters, 'parameters'),
+            (generate_structure(), 'structure'),
+            (generate_upf_data('Si_nc'), 'pseudos__Si'),
+            ]
+        )
+    inputs['parent_folder'] = remote_nc
+    process = generate_calc_job('z2pack.z2pack', inputs)
+    process.prepare_for_submission(fixture_sandbox)
+
+    with fixture_sandbox.open('z2pack_aiida.py') as handle:
+        content = handle.read()
+    assert 'PythonOverlapSystem(' in content
+
+
+def test_input_generation_stateless(
+    aiida_profile, generate_calc_job, fixture_localhost, generate_remote_data,
+    generate_upf_data, generate_structure, z2pack_settings, inputs, tmpdir
+    ):
+    """Test that the input files do not depend on the calculations prepared before in the same interpreter."""
+    from aiida.common.folders import SandboxFolder
+
+    blocked_overlap   = Z2packCalculation._blocked_keywords_overlap
+    blocked_wannier90 = Z2packCalculation._blocked_keywords_wannier90
+
+    def get_inputs(soc, name):
+        """Prepare a calculation and return the content of its input files."""
+        system = {'ecutrho': 240.0, 'ecutwfc': 30.0}
+        if soc:
+            system.update({'noncolin': True, 'lspinorb': True})
+        remote = generate_remote_data(
+            fixture_localhost, str(tmpdir.mkdir(name)),
+            'quantumespresso.pw',
+            extras_root=[
+                ({'CONTROL': {'calculation': 'scf'}, 'SYSTEM': system}, 'parameters'),
+                (generate_structure(), 'structure'),
+                (generate_upf_data('Si'), 'pseudos__Si'),
+                ]
+            )
+        calc_inputs = dict(inputs)
+        calc_inputs['parent_folder'] = remote
+        calc_inputs['z2pack_settings'] = orm.Dict(dict=z2pack_settings)
+
+        process = generate_calc_job('z2pack.z2pack', calc_inputs)
+        with SandboxFolder() as folder:
+            process.prepare_for_submission(folder)
+            content = {}
+            for name in ['aiida.pw2wan.in', 'aiida.win']:
+                with folder.open(name) as handle:
+                    content[name] = handle.read()
+
+        return content
+
+    no_soc   = get_inputs(False, 'no_soc')
+    with_soc = get_inputs(True, 'with_soc')
+
+    assert 'spinors' in with_soc['aiida.win']
+    assert 'spinors' not in no_soc['aiida.win']
+    assert get_inputs(False, 'no_soc_again') == no_soc
+    assert get_inputs(True, 'with_soc_again') == with_soc
+
+    assert Z2packCalculation._blocked_keywords_overlap == blocked_overlap
+    assert Z2packCalculation._blocked_keywords_wannier90 == blocked_wannier90
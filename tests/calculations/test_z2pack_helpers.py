@@ -0,0 +1,135 @@
+"""Tests for the helpers module shipped with the z2pack driver."""
+from __future__ import absolute_import
+import os
+
+import numpy as np
+
+from aiida_z2pack.calculations.utils.z2pack_helpers import BandWindowSystem, StoredOverlapSystem, get_overlap, read_qe_wfc
+from aiida_z2pack.calculations.utils.z2pack_helpers import PythonOverlapSystem
+
+
+class DummySystem(object):
+    """Overlap system returning random matrices and counting its calls."""
+    def __init__(self, num_bands=4):
+        """Set the number of bands of the overlap matrices."""
+        self.num_bands = num_bands
+        self.calls = 0
+
+    def get_mmn(self, kpt):
+        """Return random overlap matrices between the consecutive points of the line `kpt`."""
+        self.calls += 1
+        return [np.random.rand(self.num_bands, self.num_bands) for _ in range(len(kpt) - 1)]
+
+
+def test_overlap_store(tmpdir):
+    """Test that the overlaps are shared through the store and that the least recently used are evicted."""
+    path = str(tmpdir.join('store'))
+    line_a = [[0, 0, t] for t in np.linspace(0, 1, 5)]
+    line_b = [[0.5, 0, t] for t in np.linspace(0, 1, 5)]
+
+    first = StoredOverlapSystem(DummySystem(), path, 'key', 10**6)
+    mmn = first.get_mmn(line_a)
+    first.get_mmn(line_b)
+
+    second = StoredOverlapSystem(DummySystem(), path, 'key', 10**6)
+    assert np.allclose(second.get_mmn(line_a), mmn)
+    assert (second.hits, second.misses, second.system.calls) == (1, 0, 0)
+
+    other = StoredOverlapSystem(DummySystem(), path, 'other_key', 10**6)
+    other.get_mmn(line_a)
+    assert other.misses == 1
+
+    # Room for a single entry: only the last computed line is kept
+    entry_size = os.path.getsize(first.get_filename(line_a))
+    small = StoredOverlapSystem(DummySystem(), path, 'small', entry_size)
+    small.get_mmn(line_a)
+    os.utime(small.get_filename(line_a), (0, 0))
+    small.get_mmn(line_b)
+    assert os.listdir(path) == [os.path.basename(small.get_filename(line_b))]
+
+
+def test_band_window_system():
+    """Test that the overlaps are restricted to the bands of the window."""
+    system = BandWindowSystem(DummySystem(num_bands=6), 2, 4)
+    assert all(mmn.shape == (3, 3) for mmn in system.get_mmn([[0, 0, 0], [0, 0, 0.5], [0, 0, 1]]))
+
+
+def write_qe_wfc(filename, mill, evc):
+    """Write a wavefunction file in the binary format of pw.x."""
+    nbnd, npol, igwx = evc.shape
+
+    def record(handle, *arrays):
+        data = b''.join(np.asarray(array).tobytes() for array in arrays)
+        marker = np.array([len(data)], dtype='<i4').tobytes()
+        handle.write(marker + data + marker)
+
+    with open(filename, 'wb') as handle:
+        record(handle, np.array([1], '<i4'), np.zeros(3), np.array([1, 0], '<i4'), np.ones(1))
+        record(handle, np.array([igwx, igwx, npol, nbnd], '<i4'))
+        record(handle, np.eye(3))
+        record(handle, np.asarray(mill, dtype='<i4'))
+        for band in evc:
+            record(handle, band.reshape(-1).astype('<c16'))
+
+
+def get_periodic_part(mill, evc, grid):
+    """Return the periodic part of the wavefunctions on a real space grid (crystal coordinates)."""
+    phases = np.exp(2j * np.pi * np.dot(grid, np.transpose(mill)))
+    return np.einsum('rg,npg->npr', phases, evc)
+
+
+def test_python_overlaps(tmpdir):
+    """Test the overlaps computed from the plane-wave coefficients against the real space ones."""
+    rng = np.random.RandomState(0)
+    mill_range = range(-2, 3)
+    mill = np.array([[i, j, k] for i in mill_range for j in mill_range for k in mill_range if i * i + j * j + k * k <= 4])
+
+    wfcs = []
+    for ik in range(2):
+        # Every kpoint has its own ordering and subset of plane waves
+        order = rng.permutation(len(mill))[:len(mill) - 3]
+        evc = rng.rand(3, 2, len(order)) + 1j * rng.rand(3, 2, len(order))
+        filename = str(tmpdir.join('wfc{}.dat'.format(ik + 1)))
+        write_qe_wfc(filename, mill[order], evc)
+        wfcs.append(read_qe_wfc(filename))
+        assert np.allclose(wfcs[-1][0], mill[order])
+        assert np.allclose(wfcs[-1][1], evc)
+
+    axis = np.arange(12) / 12.
+    grid = np.array([[x, y, z] for x in axis for y in axis for z in axis])
+    u_a = get_periodic_part(wfcs[0][0], wfcs[0][1], grid)
+    u_b = get_periodic_part(wfcs[1][0], wfcs[1][1], grid)
+
+    expected = np.einsum('mpr,npr->mn', np.conj(u_a), u_b) / len(grid)
+    assert np.allclose(get_overlap(wfcs[0][0], wfcs[0][1], wfcs[1][0], wfcs[1][1]), expected)
+
+    # The wavefunctions at `k + G` have the periodic part `exp(-iGr) u_k`
+    shift = np.array([0, 0, 1])
+    u_shifted = u_b * np.exp(-2j * np.pi * np.dot(grid, shift))
+    expected = np.einsum('mpr,npr->mn', np.conj(u_a), u_shifted) / len(grid)
+    assert np.allclose(get_overlap(wfcs[0][0], wfcs[0][1], wfcs[1][0], wfcs[1][1], shift), expected)
+
+
+def test_python_overlap_system(tmpdir):
+    """Test that the system closes the line with the wavefunctions of the first kpoint and selects the bands."""
+    rng = np.random.RandomState(1)
+    save_dir = tmpdir.mkdir('save')
+    mill = np.array([[0, 0, 0], [0, 0, 1], [0, 0, -1], [1, 0, 0]])
+    evcs = [rng.rand(4, 1, 4) + 1j * rng.rand(4, 1, 4) for _ in range(2)]
+    for ik, evc in enumerate(evcs):
+        write_qe_wfc(str(save_dir.join('wfc{}.dat'.format(ik + 1))), mill, evc)
+
+    nscf = tmpdir.join('aiida.nscf.in')
+    nscf.write('&control\n/\n')
+    system = PythonOverlapSystem(
+        input_files=[str(nscf)], kpt_fct=lambda kpt: '', kpt_path='aiida.nscf.in', command='true',
+        build_folder=str(tmpdir.join('build')), save_dir=str(save_dir), exclude_bands=[1], num_bands=2
+        )
+
+    mmn = system.get_mmn([np.array([0, 0, t]) for t in (0, 0.5, 1)])
+    bands = evcs[0][1:3], evcs[1][1:3]
+    assert np.allclose(mmn[0], get_overlap(mill, bands[0], mill, bands[1]))
+    assert np.allclose(mmn[1], get_overlap(mill, bands[1], mill, bands[0], (0, 0, 1)))
+    # The coefficient of `G` at `k + (0, 0, 1)` is the one of `G + (0, 0, 1)` at `k`
+    expected = np.einsum('mg,ng->mn', np.conj(bands[1][:, 0, [0, 2]]), bands[0][:, 0, [1, 0]])
+    assert np.allclose(mmn[1], expected)
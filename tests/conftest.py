@@ -233,3 +233,36 @@ def generate_remote_data():
         return remote
 
     return _generate_remote_data
+
+
+@pytest.fixture
+def generate_bands_data(tmpdir):
+    """Return a fake `BandsData` storing the `bands` array in a repository folder, that can be memory-mapped."""
+    import uuid
+    import numpy as np
+
+    class DummyBandsData(object):
+        """Fake `BandsData` with the `bands` array saved as a `.npy` file of its repository folder."""
+
+        def __init__(self, folder, bands, is_stored):
+            """Save the `bands` array in `folder` and count the times the array is loaded in `loaded`."""
+            self.folder = folder
+            self.uuid = str(uuid.uuid4())
+            self.is_stored = is_stored
+            self.loaded = 0
+            np.save(str(folder.join('bands.npy')), bands)
+
+        def open(self, key, mode='r'):
+            """Open the file `key` of the repository folder."""
+            return open(str(self.folder.join(key)), mode)
+
+        def get_array(self, name):
+            """Load the array `name` in memory."""
+            self.loaded += 1
+            return np.load(str(self.folder.join('{}.npy'.format(name))))
+
+    def _generate_bands_data(bands, is_stored=True):
+        """Return a `DummyBandsData` with the given `bands` array, in a new folder."""
+        return DummyBandsData(tmpdir.mkdir(str(uuid.uuid4())), bands, is_stored)
+
+    return _generate_bands_data
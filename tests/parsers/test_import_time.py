@@ -0,0 +1,41 @@
+"""Tests for the time needed to load the plugin entry points."""
+from __future__ import absolute_import
+import json
+import subprocess
+import sys
+
+# Seconds allowed to import the parser on top of `aiida.parsers`, that any parser plugin has to load anyway
+IMPORT_TIME_BUDGET = 0.5
+
+HEAVY_MODULES = ['sklearn', 'scipy', 'aiida_quantumespresso.workflows', 'aiida_z2pack.calculations.z2pack']
+
+SCRIPT = """
+import json, sys, time
+import aiida.parsers.parser
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'time': elapsed, 'modules': [name for name in {heavy} if name in sys.modules]}}))
+"""
+
+
+def get_import_stats(module):
+    """Import `module` in a new interpreter and return the time spent and the heavy modules it loaded."""
+    script = SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_parser_import_time():
+    """Test that importing the parser does not load the heavy dependencies and stays within the time budget."""
+    stats = [get_import_stats('aiida_z2pack.parsers.z2pack') for _ in range(3)]
+
+    assert not stats[0]['modules']
+    assert min(stat['time'] for stat in stats) < IMPORT_TIME_BUDGET
+
+
+def test_workchain_lazy_imports():
+    """Test that importing the workchains does not load the analysis libraries and the plugins they launch."""
+    stats = get_import_stats('aiida_z2pack.workchains.chern')
+
+    assert not set(stats['modules']) & {'sklearn', 'aiida_quantumespresso.workflows'}
@@ -0,0 +1,61 @@
+"""Tests for the search of the crossings of several band pairs from the same bands."""
+from __future__ import absolute_import
+
+import numpy as np
+
+from aiida.common import AttributeDict
+
+from aiida_z2pack.workchains.functions import find_lowgap_points, get_gap_array, get_gap_arrays, get_pair_gap_array
+
+
+class DummyCalculation(object):
+    """Pw calculation with 8 electrons and no spin-orbit, whose highest valence band is the band `3`."""
+    def __init__(self, bands_data):
+        """Set the `output_band` and `output_parameters` outputs."""
+        self.outputs = AttributeDict({
+            'output_band': bands_data,
+            'output_parameters': {'number_of_electrons': 8., 'spin_orbit_calculation': False},
+            })
+
+
+def test_gap_arrays(generate_bands_data):
+    """Test that the gaps of all the pairs match the ones computed one pair at a time."""
+    bands = np.random.rand(40, 10)
+    bands_data = generate_bands_data(bands)
+
+    gaps = get_gap_arrays(bands_data, [6, 3, 4])
+    assert gaps.shape == (40, 3)
+    for column, vb in enumerate([6, 3, 4]):
+        assert np.allclose(gaps[:, column], get_gap_array(bands_data, vb + 1, vb))
+    assert not gaps.flags.writeable
+    assert get_gap_arrays(bands_data, [6, 3, 4]) is gaps
+
+
+def test_find_lowgap_points_pairs():
+    """Test that every column of the gaps gives the same points of a search on that column alone."""
+    rng = np.random.RandomState(0)
+    kpt_cart = rng.rand(500, 3)
+    gaps = rng.rand(500, 2) * 0.1
+    last_pinned = kpt_cart[:5]
+
+    found, pinned = find_lowgap_points(kpt_cart, gaps, last_pinned, 0.2, 0.01)
+    assert len(found) == len(pinned) == 2
+    for column in range(2):
+        single_found, single_pinned = find_lowgap_points(kpt_cart, gaps[:, column], last_pinned, 0.2, 0.01)
+        assert np.array_equal(found[column], single_found[0])
+        assert np.array_equal(pinned[column], single_pinned[0])
+        assert np.all(gaps[found[column], column] <= 0.01)
+
+
+
+def test_pair_gap_array(generate_bands_data):
+    """Test that the gap of every k-point is the one of its own band pair, `-1` standing for the valence band."""
+    bands = np.random.rand(6, 10)
+    calculation = DummyCalculation(generate_bands_data(bands))
+
+    pairs = np.array([6, -1, 3, 6, 4, -1])
+    gaps = get_pair_gap_array(calculation, pairs)
+    for gap, row, vb in zip(gaps, bands, [6, 3, 3, 6, 4, 3]):
+        assert np.isclose(gap, row[vb + 1] - row[vb])
+
+    assert np.allclose(get_pair_gap_array(calculation), bands[:, 4] - bands[:, 3])
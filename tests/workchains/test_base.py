@@ -0,0 +1,17 @@
+"""Tests for the `Z2packBaseWorkChain`."""
+from __future__ import absolute_import
+
+from aiida_z2pack.workchains.base import get_nscf_num_bands
+
+
+def test_nscf_num_bands():
+    """Test that the nscf calculations compute the occupied bands plus the buffer, capped at the scf bands."""
+    parameters = {'CONTROL': {'calculation': 'scf'}, 'SYSTEM': {'ecutwfc': 30.0}}
+
+    assert get_nscf_num_bands(parameters, 8, 20, 4) == 12
+    assert get_nscf_num_bands(parameters, 8, 10, 4) == 10
+    assert get_nscf_num_bands(parameters, 8, 20, 0) == 8
+
+    # A negative buffer or an explicit `nbnd` keep the number of bands unchanged
+    assert get_nscf_num_bands(parameters, 8, 20, -1) is None
+    assert get_nscf_num_bands({'system': {'NBND': 16}}, 8, 20, 4) is None
@@ -0,0 +1,89 @@
+"""Tests for the content-hash cache of the z2pack workchains."""
+from __future__ import absolute_import
+from aiida import orm
+
+from aiida_z2pack.workchains.cache import get_z2pack_cache_hash
+
+PARAMETERS = {'pw': {'CONTROL': {'calculation': 'scf'}, 'SYSTEM': {'ecutwfc': 30.0}}}
+SETTINGS = {'dimension_mode': '2D', 'invariant': 'Z2'}
+
+
+def test_hash_site_order(aiida_profile, generate_structure, generate_upf_data):
+    """Test that the hash does not depend on the order of the sites or lattice translations."""
+    upf = {'Si': generate_upf_data('Si')}
+    struct = generate_structure()
+
+    swapped = orm.StructureData(cell=struct.cell)
+    cell = struct.cell
+    for site in reversed(struct.sites):
+        position = [x + y for x, y in zip(site.position, cell[0])]
+        swapped.append_atom(position=position, symbols='Si', name='Si')
+
+    assert get_z2pack_cache_hash(struct, upf, PARAMETERS, SETTINGS) == \
+        get_z2pack_cache_hash(swapped, upf, PARAMETERS, SETTINGS)
+
+
+def test_hash_settings(aiida_profile, generate_structure, generate_upf_data):
+    """Test that only the settings affecting the result change the hash."""
+    upf = {'Si': generate_upf_data('Si')}
+    struct = generate_structure()
+    defaults = {'num_lines': 11}
+
+    ref = get_z2pack_cache_hash(struct, upf, PARAMETERS, SETTINGS, defaults)
+
+    settings = dict(SETTINGS, mpi_command='mpirun -np 4', num_lines=11)
+    assert get_z2pack_cache_hash(struct, upf, PARAMETERS, settings, defaults) == ref
+
+    settings = dict(SETTINGS, num_lines=21)
+    assert get_z2pack_cache_hash(struct, upf, PARAMETERS, settings, defaults) != ref
+
+    parameters = {'pw': {'CONTROL': {'calculation': 'nscf'}, 'SYSTEM': {'ecutwfc': 30.0}}}
+    assert get_z2pack_cache_hash(struct, upf, parameters, SETTINGS, defaults) == ref
+
+    parameters = {'pw': {'CONTROL': {'calculation': 'scf'}, 'SYSTEM': {'ecutwfc': 40.0}}}
+    assert get_z2pack_cache_hash(struct, upf, parameters, SETTINGS, defaults) != ref
+
+
+def test_hash_small_floats(aiida_profile, generate_structure, generate_upf_data):
+    """Test that parameters differing only in a small threshold give different hashes."""
+    upf = {'Si': generate_upf_data('Si')}
+    struct = generate_structure()
+
+    loose = {'pw': {'CONTROL': {'calculation': 'scf'}, 'ELECTRONS': {'conv_thr': 1e-8}}}
+    tight = {'pw': {'CONTROL': {'calculation': 'scf'}, 'ELECTRONS': {'conv_thr': 1e-10}}}
+    assert get_z2pack_cache_hash(struct, upf, loose, SETTINGS) != get_z2pack_cache_hash(struct, upf, tight, SETTINGS)
+
+
+def test_hash_kpoints(aiida_profile, generate_structure, generate_upf_data):
+    """Test that the k-point sampling of the scf calculation changes the hash."""
+    upf = {'Si': generate_upf_data('Si')}
+    struct = generate_structure()
+
+    def get_hash(kpoints):
+        return get_z2pack_cache_hash(struct, upf, PARAMETERS, SETTINGS, kpoints=kpoints)
+
+    mesh_4 = orm.KpointsData()
+    mesh_4.set_kpoints_mesh([4, 4, 4])
+    mesh_6 = orm.KpointsData()
+    mesh_6.set_kpoints_mesh([6, 6, 6])
+    explicit = orm.KpointsData()
+    explicit.set_kpoints([[0., 0., 0.], [0.5, 0., 0.]])
+
+    hashes = [get_hash(kpoints) for kpoints in (None, mesh_4, mesh_6, explicit, orm.Float(0.2), orm.Float(0.3))]
+    assert len(set(hashes)) == len(hashes)
+
+
+def test_hash_wannier90_folder(aiida_profile, fixture_localhost, generate_structure, generate_upf_data):
+    """Test that the Wannier Hamiltonian of the `tb` backend changes the hash."""
+    upf = {'Si': generate_upf_data('Si')}
+    struct = generate_structure()
+    settings = dict(SETTINGS, backend='tb')
+
+    folder_1 = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp/w90_1')
+    folder_2 = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp/w90_2')
+
+    hashes = [
+        get_z2pack_cache_hash(struct, upf, PARAMETERS, settings, wannier90_folder=folder)
+        for folder in (None, folder_1, folder_2)
+        ]
+    assert len(set(hashes)) == len(hashes)
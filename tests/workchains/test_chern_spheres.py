@@ -0,0 +1,35 @@
+"""Tests for the choice of the spheres used by `Z2pack3DChernWorkChain`."""
+from __future__ import absolute_import
+import numpy as np
+
+from aiida_z2pack.workchains.functions import get_chern_spheres
+
+CROSSINGS = [
+    [0.10, 0.10, 0.10],
+    [0.11, 0.10, 0.10],
+    [0.50, 0.50, 0.50],
+    [0.99, 0.50, 0.50],
+    [0.02, 0.50, 0.50],
+    ]
+
+
+def test_adaptive_radius():
+    """Test that the radii adapt to the nearest crossing, also across the boundary of the cell."""
+    centers, radii, groups = get_chern_spheres(CROSSINGS, 0.005, min_radius=0.001)
+
+    assert np.allclose(centers, CROSSINGS)
+    assert np.allclose(radii, [0.004, 0.004, 0.005, 0.005, 0.005])
+    assert groups.tolist() == [0, 1, 2, 3, 4]
+
+    _, radii, _ = get_chern_spheres(CROSSINGS, 0.005, min_radius=0.0045)
+    assert np.allclose(radii[:2], 0.0045)
+
+
+def test_grouped_crossings():
+    """Test that close crossings are wrapped in a single sphere containing all of them."""
+    centers, radii, groups = get_chern_spheres(CROSSINGS, 0.05, min_radius=0.001, group_distance=0.05)
+
+    assert groups.tolist() == [0, 0, 1, 2, 2]
+    assert np.allclose(centers[0], [0.105, 0.1, 0.1])
+    assert np.allclose(np.mod(centers[2], 1.), [0.005, 0.5, 0.5])
+    assert np.allclose(radii, [0.055, 0.05, 0.065])
@@ -0,0 +1,21 @@
+"""Tests for the recovery from the provenance of the history of the workchain loops."""
+from __future__ import absolute_import
+from collections import namedtuple
+
+from aiida_z2pack.workchains.chern import get_called_processes
+
+DummyProcess = namedtuple('DummyProcess', ['pk', 'process_label'])
+DummyNode = namedtuple('DummyNode', ['called'])
+
+
+def test_called_processes():
+    """Test that only the processes with the given label are returned, in order of creation."""
+    node = DummyNode(called=[
+        DummyProcess(12, 'PwBaseWorkChain'),
+        DummyProcess(10, 'get_crossing_and_lowgap_points'),
+        DummyProcess(15, 'get_crossing_and_lowgap_points'),
+        DummyProcess(3, 'get_crossing_and_lowgap_points'),
+        ])
+
+    assert [p.pk for p in get_called_processes(node, 'get_crossing_and_lowgap_points')] == [3, 10, 15]
+    assert get_called_processes(node, 'Z2packBaseWorkChain') == []
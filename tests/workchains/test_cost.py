@@ -0,0 +1,108 @@
+"""Tests for the accounting of the cost of the calculations launched by the workchains."""
+from __future__ import absolute_import
+import pytest
+
+from aiida import orm
+from aiida.common import AttributeDict, LinkType
+
+from aiida_z2pack.workchains.cost import get_calcjob_cost, get_cost_breakdown, is_budget_exhausted
+
+
+@pytest.fixture
+def generate_calcjob_node(fixture_localhost):
+    """Return a factory of stored `CalcJobNode` with the given wall time and resources."""
+
+    def _generate_calcjob_node(
+        entry_point_name='quantumespresso.pw', resources=None, job_seconds=None, output_seconds=None, nkpoints=0,
+        caller=None
+        ):
+        from aiida.schedulers.datastructures import JobInfo
+
+        node = orm.CalcJobNode(computer=fixture_localhost, process_type='aiida.calculations:' + entry_point_name)
+        node.set_process_label('PwCalculation')
+        node.set_option('resources', resources or {'num_machines': 1, 'num_mpiprocs_per_machine': 4})
+        if job_seconds is not None:
+            job_info = JobInfo()
+            job_info.job_id = '1'
+            job_info.wallclock_time_seconds = job_seconds
+            node.set_last_job_info(job_info)
+        if nkpoints:
+            kpoints = orm.KpointsData()
+            kpoints.set_kpoints([[0., 0., 0.]] * nkpoints)
+            kpoints.store()
+            node.add_incoming(kpoints, link_type=LinkType.INPUT_CALC, link_label='kpoints')
+        if caller is not None:
+            node.add_incoming(caller, link_type=LinkType.CALL_CALC, link_label='CALL')
+        node.store()
+
+        if output_seconds is not None:
+            parameters = orm.Dict(dict={'wall_time_seconds': output_seconds})
+            parameters.add_incoming(node, link_type=LinkType.CREATE, link_label='output_parameters')
+            parameters.store()
+
+        return node
+
+    return _generate_calcjob_node
+
+
+def generate_workchain_node():
+    """Return a stored `WorkChainNode`."""
+    node = orm.WorkChainNode()
+    node.store()
+    return node
+
+
+class DummyWorkChain(object):
+    """Workchain with the budget inputs and a node."""
+
+    def __init__(self, node, **inputs):
+        """Set the workchain node and the inputs given as keyword arguments."""
+        self.node = node
+        self.inputs = AttributeDict(inputs)
+        self.reports = []
+
+    def report(self, msg):
+        """Store the reported message in `reports`."""
+        self.reports.append(msg)
+
+
+def test_calcjob_cost(aiida_profile, generate_calcjob_node):
+    """Test that the cost is the scheduler wall time times the MPI processes, with the parsed time as fallback."""
+    node = generate_calcjob_node(job_seconds=1800, output_seconds=60, nkpoints=3)
+    assert get_calcjob_cost(node) == (2., 3)
+
+    node = generate_calcjob_node(resources={'num_machines': 2, 'num_mpiprocs_per_machine': 3}, output_seconds=1200)
+    assert get_calcjob_cost(node) == (2., 0)
+
+    node = generate_calcjob_node()
+    assert get_calcjob_cost(node) == (0., 0)
+
+
+def test_cost_breakdown(aiida_profile, generate_calcjob_node):
+    """Test that the cost of the calculations called by a workchain is summed by process label."""
+    workchain = generate_workchain_node()
+    generate_calcjob_node(job_seconds=900, nkpoints=2, caller=workchain)
+    generate_calcjob_node(job_seconds=2700, nkpoints=5, caller=workchain)
+    generate_calcjob_node(job_seconds=3600, nkpoints=7)
+
+    res = get_cost_breakdown(workchain)
+    assert res['core_hours'] == pytest.approx(4.)
+    assert res['kpoints'] == 7
+    assert list(res['processes']) == ['PwCalculation']
+    assert res['processes']['PwCalculation']['count'] == 2
+    assert res['processes']['PwCalculation']['kpoints'] == 7
+
+
+def test_budget_exhausted(aiida_profile, generate_calcjob_node):
+    """Test that the budget is exhausted once any of the given limits is reached."""
+    workchain = generate_workchain_node()
+    generate_calcjob_node(job_seconds=3600, nkpoints=10, caller=workchain)
+
+    assert not is_budget_exhausted(DummyWorkChain(workchain))
+    assert not is_budget_exhausted(DummyWorkChain(workchain, max_core_hours=orm.Float(5.)))
+    assert not is_budget_exhausted(DummyWorkChain(workchain, max_kpoints=orm.Int(11)))
+
+    dummy = DummyWorkChain(workchain, max_core_hours=orm.Float(5.), max_kpoints=orm.Int(10))
+    assert is_budget_exhausted(dummy)
+    assert len(dummy.reports) == 1
+    assert is_budget_exhausted(DummyWorkChain(workchain, max_core_hours=orm.Float(4.)))
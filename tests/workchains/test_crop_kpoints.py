@@ -0,0 +1,36 @@
+"""Tests for the cropping of the k-points mesh done by `crop_kpoints`."""
+from __future__ import absolute_import
+from itertools import product
+
+import numpy as np
+import pytest
+
+from aiida_z2pack.workchains.functions import get_mesh_points_in_spheres, recipr_base
+
+CELL = [[3., 0., 0.], [-1.5, 2.6, 0.], [0.5, 0.3, 4.]]
+CENTERS = [[0.1, 0.2, 0.3], [0.12, 0.21, 0.3], [0.9, 0.5, 0.02]]
+
+
+@pytest.mark.parametrize('offset', [(0., 0., 0.), (0.5, 0.5, 0.5)])
+def test_mesh_points_in_spheres(offset):
+    """Test the cropping against the one of the full mesh, also with small slabs."""
+    mesh = (20, 24, 16)
+    recipr = recipr_base(np.array(CELL))
+    radius = 0.3
+
+    full = (np.array(list(product(*[range(n) for n in mesh]))) + offset) / mesh
+    dist = np.linalg.norm(np.dot(full[:, None, :] - np.array(CENTERS)[None], recipr), axis=2)
+    expected = full[np.any(dist <= radius, axis=1)]
+    assert len(expected) > 0
+
+    assert np.allclose(get_mesh_points_in_spheres(mesh, offset, recipr, CENTERS, radius), expected)
+    assert np.allclose(get_mesh_points_in_spheres(mesh, offset, recipr, CENTERS, radius, max_chunk_bytes=1), expected)
+
+
+def test_dense_mesh():
+    """Test that a dense mesh is cropped without building it."""
+    recipr = recipr_base(np.array(CELL))
+    kpt = get_mesh_points_in_spheres((1000, 1000, 1000), (0., 0., 0.), recipr, CENTERS, 0.01)
+
+    assert len(kpt) > 0
+    assert np.all(np.linalg.norm(np.dot(kpt[:, None, :] - np.array(CENTERS)[None], recipr), axis=2).min(axis=1) <= 0.01)
@@ -0,0 +1,56 @@
+"""Tests for the process pool running the numerical kernels of the calcfunctions."""
+from __future__ import absolute_import
+import asyncio
+
+import numpy as np
+import pytest
+
+from aiida_z2pack.workchains import executor
+from aiida_z2pack.workchains.functions import get_cubic_grid_points
+
+
+@pytest.fixture
+def kernel_workers(monkeypatch):
+    """Start a pool with two processes on a tested aiida-core version, shutting it down at the end of the test."""
+    import aiida
+
+    monkeypatch.setattr(aiida, '__version__', '1.6.9')
+    monkeypatch.setenv(executor.KERNEL_WORKERS_ENV, '2')
+    yield
+    executor.shutdown_kernel_executor()
+
+
+def test_run_kernel(kernel_workers):  # pylint: disable=unused-argument,redefined-outer-name
+    """Test that the kernels give the same result in the pool and inline."""
+    centers = np.random.rand(5, 3)
+    expected = get_cubic_grid_points(centers, 0.1, 3)
+
+    assert np.allclose(executor.run_kernel(get_cubic_grid_points, centers, 0.1, 3), expected)
+    assert executor.get_kernel_executor() is not None
+
+    # A running loop is entered again only if it is reentrant, otherwise the kernel runs inline
+    async def step():
+        return executor.run_kernel(get_cubic_grid_points, centers, 0.1, 3)
+
+    assert np.allclose(asyncio.new_event_loop().run_until_complete(step()), expected)
+
+    nest_asyncio = pytest.importorskip('nest_asyncio')
+    loop = asyncio.new_event_loop()
+    nest_asyncio.apply(loop)
+    assert np.allclose(loop.run_until_complete(step()), expected)
+
+
+def test_run_kernel_untested_version(kernel_workers, monkeypatch):  # pylint: disable=unused-argument,redefined-outer-name
+    """Test that the kernels run inline with the aiida-core versions not tested with the pool."""
+    import aiida
+
+    monkeypatch.setattr(aiida, '__version__', '1.5.2')
+    assert executor.get_kernel_executor() is None
+    assert executor.run_kernel(np.add, 1, 2) == 3
+
+
+def test_run_kernel_inline(monkeypatch):
+    """Test that the kernels run inline if the pool is disabled."""
+    monkeypatch.setenv(executor.KERNEL_WORKERS_ENV, '0')
+    assert executor.get_kernel_executor() is None
+    assert executor.run_kernel(np.add, 1, 2) == 3
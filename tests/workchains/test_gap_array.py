@@ -0,0 +1,34 @@
+"""Tests for the extraction of the gaps from the memory-mapped bands."""
+from __future__ import absolute_import
+
+import numpy as np
+
+from aiida_z2pack.workchains.functions import get_gap_array, open_bands_array
+
+
+def test_gap_array(generate_bands_data):
+    """Test that the gaps are read from the memory-mapped array and shared by the callers."""
+    bands = np.random.rand(50, 8)
+    bands_data = generate_bands_data(bands)
+
+    assert isinstance(open_bands_array(bands_data), np.memmap)
+
+    gaps = get_gap_array(bands_data, 4, 3)
+    assert np.allclose(gaps, bands[:, 4] - bands[:, 3])
+    assert not isinstance(gaps, np.memmap)
+    assert not gaps.flags.writeable
+    assert get_gap_array(bands_data, 4, 3) is gaps
+    assert get_gap_array(bands_data, 5, 4) is not gaps
+    assert bands_data.loaded == 0
+
+
+def test_gap_array_not_stored(generate_bands_data):
+    """Test that the gaps of unstored nodes are not cached and that the array is loaded if it can't be mapped."""
+    bands = np.random.rand(10, 4)
+    bands_data = generate_bands_data(bands, is_stored=False)
+    bands_data.open = None
+
+    gaps = get_gap_array(bands_data, 2, 1)
+    assert np.allclose(gaps, bands[:, 2] - bands[:, 1])
+    assert bands_data.loaded == 1
+    assert get_gap_array(bands_data, 2, 1) is not gaps
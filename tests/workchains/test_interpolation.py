@@ -0,0 +1,35 @@
+"""Tests for the Wannier interpolation of the bands used by `FindCrossingsWorkChain`."""
+from __future__ import absolute_import
+import numpy as np
+
+from aiida_z2pack.workchains.functions import parse_wannier_hr, interpolate_wannier_bands
+
+HOPPINGS = {
+    (-1, 0, 0): np.array([[0.3, 0.5], [0.5, -0.3]]),
+    (0, 0, 0): np.array([[1.0, 0.0], [0.0, -1.0]]),
+    (1, 0, 0): np.array([[0.3, 0.5], [0.5, -0.3]]),
+}
+
+
+def write_hr(hoppings):
+    """Write a two-band model in the Wannier90 `_hr.dat` format."""
+    lines = ['written by test', '2', str(len(hoppings)), ' '.join(['1'] * len(hoppings))]
+    for rvec, ham in sorted(hoppings.items()):
+        for col in range(2):
+            for row in range(2):
+                lines.append('{:5d}{:5d}{:5d}{:5d}{:5d}{:12.6f}{:12.6f}'.format(
+                    *rvec, row + 1, col + 1, ham[row, col], 0.))
+
+    return '\n'.join(lines)
+
+
+def test_interpolate_wannier_bands():
+    """Test the batched interpolation against a direct diagonalization."""
+    rvec, deg, hoppings = parse_wannier_hr(write_hr(HOPPINGS))
+
+    kpt = np.random.rand(20, 3)
+    eig = interpolate_wannier_bands(kpt, rvec, deg, hoppings, max_chunk_bytes=200)
+
+    for k, res in zip(kpt, eig):
+        ham_k = sum(ham * np.exp(2j * np.pi * np.dot(k, r)) for r, ham in HOPPINGS.items())
+        assert np.allclose(res, np.linalg.eigvalsh(ham_k))
@@ -0,0 +1,45 @@
+"""Tests for the selection of the low-gap points done by `get_crossing_and_lowgap_points`."""
+from __future__ import absolute_import
+import numpy as np
+import pytest
+
+from aiida_z2pack.workchains.functions import select_lowgap_points
+
+
+def select_lowgap_points_loop(query, gaps, lim, scale=None):
+    """Select the low-gap points shrinking the threshold of every center one step at a time, as a reference."""
+    where = []
+    for q in query:
+        q = np.array(q, dtype=int)
+        if len(q) == 0:
+            continue
+        min_gap = gaps[q].min()
+
+        app = None
+        current = 0.25 / min_gap if scale is None else scale
+        while app is None or len(app) > lim:
+            app = np.where(gaps[q] < min_gap * current)[0]
+            current *= 0.98
+            if current < 1.0001:
+                app = np.where(gaps[q] < min_gap * 1.0001)[0]
+                break
+        where.extend(q[app])
+
+    return np.unique(np.array(where, dtype=int))
+
+
+@pytest.mark.parametrize('lim,scale', [(200, None), (5, 2.5), (2, 2.5), (1, 1.001)])
+def test_select_lowgap_points(lim, scale):
+    """Test that the batched selection gives the same points of the iterative one."""
+    rng = np.random.RandomState(lim)
+    gaps = rng.rand(2000) * 0.5
+    # Degenerate gaps, selected together also beyond `lim`
+    gaps[:10] = gaps[10]
+    query = [rng.choice(len(gaps), size=rng.randint(0, 300), replace=False) for _ in range(100)]
+    query.append(np.arange(20))
+
+    res = select_lowgap_points(query, gaps, lim, scale)
+    assert np.array_equal(res, select_lowgap_points_loop(query, gaps, lim, scale))
+    assert len(res) > 0
+
+    assert len(select_lowgap_points([[], []], gaps, lim, scale)) == 0
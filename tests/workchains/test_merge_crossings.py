@@ -0,0 +1,41 @@
+"""Tests for the incremental merge of the crossings found by `FindCrossingsWorkChain`."""
+from __future__ import absolute_import
+import numpy as np
+
+from aiida_z2pack.workchains.functions import cluster_crossings, fold_crossings, get_cubic_grid_points
+
+RECIPR = np.eye(3) * 2 * np.pi
+
+
+def get_cluster(center, npoints, rng):
+    """Return `npoints` crossings spread around `center` well below the merge distance."""
+    return np.array(center) + (rng.rand(npoints, 3) - 0.5) * 1.E-4
+
+
+def test_fold_crossings():
+    """Test that folding the crossings iteration by iteration gives the same result of merging them at the end."""
+    rng = np.random.RandomState(0)
+    first = np.vstack((get_cluster([0.1, 0.2, 0.3], 3, rng), get_cluster([0.5, 0.5, 0.5], 2, rng)))
+    second = np.vstack((get_cluster([0.1, 0.2, 0.3], 4, rng), get_cluster([0.7, 0.1, 0.0], 1, rng)))
+
+    crossings, counts = fold_crossings(np.empty((0, 3)), [], first, RECIPR)
+    crossings, counts = fold_crossings(crossings, counts, second, RECIPR)
+    crossings, counts = fold_crossings(crossings, counts, np.empty((0, 3)), RECIPR)
+
+    expected = cluster_crossings(np.vstack((first, second)), RECIPR)
+    order = np.lexsort(crossings.T)
+    assert np.allclose(crossings[order], expected[np.lexsort(expected.T)])
+    assert sorted(counts.tolist()) == [1, 2, 7]
+
+
+def test_grid_exclude():
+    """Test that the grid points close to the excluded ones are skipped."""
+    centers = np.array([[0., 0., 0.], [1., 1., 1.]])
+    grid = get_cubic_grid_points(centers, 0.4, 3)
+    assert len(grid) == 250
+
+    res = get_cubic_grid_points(centers, 0.4, 3, exclude=np.array([[1., 1., 1.]]))
+    assert len(res) == 250 - 7
+    assert np.all(np.linalg.norm(res - [1., 1., 1.], axis=1) > 0.1)
+
+    assert len(get_cubic_grid_points(centers[:1], 0.4, 1, exclude=centers[:1] + [[0.15, 0, 0]])) == 3
@@ -0,0 +1,84 @@
+"""Tests for the interpolation of the scf gap used to seed the `FindCrossingsWorkChain`."""
+from __future__ import absolute_import
+from itertools import product
+
+import numpy as np
+
+from aiida import orm
+from aiida.common import LinkType
+
+from aiida_z2pack.workchains.functions import (
+    find_periodic_minima, fourier_upsample, get_lowgap_points_from_scf, unfold_mesh_values
+    )
+
+
+def gap_function(kpt):
+    """Smooth periodic function with the symmetry of a square lattice, minimum at `(0.5, 0.5, 0.5)`."""
+    kpt = np.atleast_2d(kpt)
+    return 3 + np.cos(2 * np.pi * kpt[:, 0]) + np.cos(2 * np.pi * kpt[:, 1]) + 0.3 * np.cos(2 * np.pi * kpt[:, 2])
+
+
+def test_unfold_mesh_values():
+    """Test the unfolding of the values on the irreducible points with a C4z rotation and time reversal."""
+    mesh = (4, 4, 4)
+    c4z = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    rotations = [np.linalg.matrix_power(c4z, n) for n in range(4)]
+
+    full = np.array(list(product(*[np.arange(n) / n for n in mesh])))
+    irreducible = []
+    seen = set()
+    for kpt in full:
+        key = tuple(np.mod(np.round(kpt * mesh), mesh).astype(int))
+        if key in seen:
+            continue
+        irreducible.append(kpt)
+        for rot in rotations:
+            for sign in (1, -1):
+                seen.add(tuple(np.mod(np.round(sign * np.dot(kpt, rot) * mesh), mesh).astype(int)))
+    irreducible = np.array(irreducible)
+    assert len(irreducible) < len(full)
+
+    grid = unfold_mesh_values(irreducible, gap_function(irreducible), mesh, (0, 0, 0), rotations)
+    assert np.allclose(grid.reshape(-1), gap_function(full))
+
+    # Without the rotations the mesh can't be covered
+    assert unfold_mesh_values(irreducible, gap_function(irreducible), mesh, (0, 0, 0), rotations[:1]) is None
+
+
+def test_fourier_minima():
+    """Test that the interpolation is exact for a band-limited function and that its minimum is found."""
+    mesh = (6, 6, 1)
+    coarse = gap_function(np.array(list(product(*[np.arange(n) / n for n in mesh])))).reshape(mesh)
+
+    fine = fourier_upsample(coarse, 4)
+    assert fine.shape == (24, 24, 1)
+
+    kpt = np.array(list(product(*[np.arange(n) / n for n in fine.shape])))
+    assert np.allclose(fine.reshape(-1), gap_function(kpt))
+
+    assert find_periodic_minima(fine).tolist() == [[12, 12, 0]]
+
+
+def test_seeding_explicit_kpoints(aiida_profile, fixture_localhost, generate_structure):
+    """Test that no seeds are returned if the scf used an explicit list of kpoints instead of a mesh."""
+    structure = generate_structure()
+    kpoints = orm.KpointsData()
+    kpoints.set_cell_from_structure(structure)
+    kpoints.set_kpoints([[0., 0., 0.], [0.5, 0., 0.]])
+    structure.store()
+    kpoints.store()
+
+    calculation = orm.CalcJobNode(computer=fixture_localhost, process_type='aiida.calculations:quantumespresso.pw')
+    calculation.add_incoming(structure, link_type=LinkType.INPUT_CALC, link_label='structure')
+    calculation.add_incoming(kpoints, link_type=LinkType.INPUT_CALC, link_label='kpoints')
+    calculation.store()
+
+    bands = orm.BandsData()
+    bands.set_kpointsdata(kpoints)
+    bands.set_bands(np.zeros((2, 4)))
+    bands.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_band')
+    bands.store()
+
+    res = get_lowgap_points_from_scf(bands)
+    assert res.get_array('pinned').shape == (0, 3)
+    assert res.get_array('gaps').shape == (0, )
@@ -0,0 +1,36 @@
+"""Tests for the splitting of the k-points of the bands calculations in chunks."""
+from __future__ import absolute_import
+import numpy as np
+from aiida import orm
+
+from aiida_z2pack.workchains.sharding import concatenate_bands, split_kpoints
+
+
+def test_split_concatenate(aiida_profile, generate_structure):  # pylint: disable=unused-argument
+    """Test that the bands of the chunks are concatenated in the order of the original k-points."""
+    kpoints = orm.KpointsData()
+    kpoints.set_cell_from_structure(generate_structure())
+    kpoints.set_kpoints(np.random.rand(10, 3))
+
+    chunks = split_kpoints(kpoints, orm.Int(4))
+    assert sorted(chunks) == ['kpoints_0', 'kpoints_1', 'kpoints_2']
+    assert [len(chunks['kpoints_{}'.format(n)].get_kpoints()) for n in range(3)] == [4, 3, 3]
+
+    kwargs = {}
+    expected = []
+    for n in range(3):
+        chunk = chunks['kpoints_{}'.format(n)]
+        bands = orm.BandsData()
+        bands.set_kpointsdata(chunk)
+        values = np.random.rand(len(chunk.get_kpoints()), 6)
+        bands.set_bands(values, units='eV')
+        expected.append(values)
+        kwargs['bands_{}'.format(n)] = bands
+        kwargs['parameters_{}'.format(n)] = orm.Dict(dict={'number_of_electrons': 8., 'spin_orbit_calculation': False})
+
+    res = concatenate_bands(kpoints=kpoints, **kwargs)
+    assert np.allclose(res['output_band'].get_kpoints(), kpoints.get_kpoints())
+    assert np.allclose(res['output_band'].get_bands(), np.vstack(expected))
+    assert res['output_parameters']['number_of_electrons'] == 8.
+    # The analysis functions reach the original k-points through the creator of the bands
+    assert res['output_band'].creator.inputs.kpoints.uuid == kpoints.uuid
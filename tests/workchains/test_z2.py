@@ -0,0 +1,40 @@
+"""Tests for the helpers of the `Z2pack3DZ2WorkChain`."""
+from __future__ import absolute_import
+import numpy as np
+
+from aiida_z2pack.workchains.functions import compute_z2_indices, get_equivalent_directions, get_z2_plane_surface
+
+
+def test_z2_plane_surface():
+    """Test that the surfaces span half of the right plane."""
+    assert get_z2_plane_surface(2, 0.0) == 'lambda t1,t2: [t1/2, t2, 0.0]'
+    assert get_z2_plane_surface(0, 0.5) == 'lambda t1,t2: [0.5, t1/2, t2]'
+
+
+def test_equivalent_directions():
+    """Test the grouping of the directions related by the point group."""
+    identity = np.eye(3, dtype=int)
+    c4z = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    c3 = np.array([[0, 0, 1], [1, 0, 0], [0, 1, 0]])
+    hexagonal_c6 = np.array([[1, -1, 0], [1, 0, 0], [0, 0, 1]])
+
+    assert get_equivalent_directions([identity]) == [0, 1, 2]
+    assert get_equivalent_directions([identity, c4z]) == [0, 0, 2]
+    assert get_equivalent_directions([identity, c3]) == [0, 0, 0]
+    # The normal of `k_2 = c` goes to `-e_1`, while the one of `k_1 = c` goes to `e_1 + e_2`
+    assert get_equivalent_directions([identity, hexagonal_c6]) == [0, 0, 2]
+
+
+def test_z2_indices():
+    """Test the strong and weak indices computed from the planes."""
+    # Bi2Se3-like strong topological insulator: (1; 000)
+    planes = {(i, 0.0): 1 for i in range(3)}
+    planes.update({(i, 0.5): 0 for i in range(3)})
+    res = compute_z2_indices(planes)
+    assert res['z2_index'] == '(1; 000)'
+    assert res['consistent']
+
+    # Only the planes along `k_3`: the weak indices along the other directions are unknown
+    res = compute_z2_indices({(2, 0.0): 0, (2, 0.5): 1})
+    assert (res['strong_index'], res['weak_indices']) == (1, [None, None, 1])
+    assert 'z2_index' not in res